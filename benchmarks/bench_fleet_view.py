@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+Fleet View Benchmark
+Synthetic load on the fleet view: many devices restoring at once, each
+reporting progress at a high rate from worker threads, while the UI thread
+flushes at the view's frame rate
+
+    python3 benchmarks/bench_fleet_view.py
+    python3 benchmarks/bench_fleet_view.py --devices 200 --rate 500 --seconds 5
+
+Updates go through FleetModel exactly as the engine callbacks send them.
+Frame time is what the UI thread spends per flush and rows touched is the
+number of Treeview calls it leads to, against one call per update without
+batching. With a display (or Xvfb) the same load drives a real FleetView
+and the lag of the Tk event loop is measured too; headless those metrics
+are null.
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from fleet_view import FleetModel, FleetView
+
+PHASES = ("ibec", "ramdisk", "filesystem", "baseband", "finalize")
+
+
+def produce(model, devices, rate, seconds, stop, producers=4):
+    """Threads that report progress for every device, rate updates per device per second"""
+    def worker(keys):
+        start = time.monotonic()
+        sent = 0
+        while not stop.is_set():
+            elapsed = time.monotonic() - start
+            if elapsed >= seconds:
+                break
+            for key in keys:
+                percent = min(100.0, 100.0 * elapsed / seconds)
+                model.update(key, phase=PHASES[int(percent) * len(PHASES) // 101],
+                             percent=percent, status="Restoring")
+            sent += 1
+            delay = start + sent / rate - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+    keys = [f"00008030-{i:016X}" for i in range(devices)]
+    threads = [threading.Thread(target=worker, args=(keys[i::producers],), daemon=True)
+               for i in range(producers)]
+    now = time.monotonic()
+    for key in keys:
+        model.update(key, mode="Normal", status="Restoring", started=now, active=True)
+    for thread in threads:
+        thread.start()
+    return threads
+
+
+def percentile(samples, fraction):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+def run_headless(devices, rate, seconds, fps, visible_rows):
+    model = FleetModel()
+    stop = threading.Event()
+    threads = produce(model, devices, rate, seconds, stop)
+    frames = []
+    touched = 0
+    interval = 1.0 / fps
+    next_frame = time.monotonic()
+    while any(thread.is_alive() for thread in threads):
+        began = time.perf_counter()
+        changed, added, removed = model.flush(visible=(0, visible_rows - 1))
+        frames.append(time.perf_counter() - began)
+        touched += len(changed) + len(added) + len(removed)
+        next_frame += interval
+        time.sleep(max(0.0, next_frame - time.monotonic()))
+    stop.set()
+    changed, added, removed = model.flush()
+    touched += len(changed) + len(added) + len(removed)
+    return model.updates, frames, touched
+
+
+def run_tk(devices, rate, seconds, fps):
+    import tkinter as tk
+    try:
+        root = tk.Tk()
+    except tk.TclError:
+        return None
+    try:
+        view = FleetView(root, root, fps=fps)
+        view.frame.grid(row=0, column=0)
+        stop = threading.Event()
+        threads = produce(view.model, devices, rate, seconds, stop)
+        applies = []
+        lags = []
+        original = view.apply
+
+        def timed_apply():
+            began = time.perf_counter()
+            count = original()
+            applies.append(time.perf_counter() - began)
+            return count
+        view.apply = timed_apply
+        view.start()
+
+        # A 10 ms heartbeat: how late it fires is how unresponsive the window is
+        expected = [time.perf_counter() + 0.01]
+
+        def heartbeat():
+            now = time.perf_counter()
+            lags.append(max(0.0, now - expected[0]))
+            expected[0] = now + 0.01
+            root.after(10, heartbeat)
+        root.after(10, heartbeat)
+        while any(thread.is_alive() for thread in threads):
+            root.update()
+            time.sleep(0.001)
+        stop.set()
+        view.stop()
+        return applies, lags, len(view.tree.get_children())
+    finally:
+        root.destroy()
+
+
+def run(devices=50, rate=200, seconds=3.0, fps=10, visible_rows=20):
+    updates, frames, touched = run_headless(devices, rate, seconds, fps, visible_rows)
+    result = {
+        "benchmark": "fleet_view",
+        "devices": devices,
+        "updates": updates,
+        "updates_per_second": round(updates / seconds),
+        "frames": len(frames),
+        "frame_p50_us": round(percentile(frames, 0.5) * 1e6, 1),
+        "frame_max_us": round(max(frames) * 1e6, 1),
+        "rows_touched": touched,
+        "tk_calls_saved_ratio": round(updates / max(1, touched), 1),
+        "tk_apply_p95_ms": None,
+        "tk_lag_p95_ms": None,
+        "tk_lag_max_ms": None,
+    }
+    measured = run_tk(devices, rate, seconds, fps)
+    if measured:
+        applies, lags, rows = measured
+        result.update({
+            "tk_rows": rows,
+            "tk_apply_p95_ms": round(percentile(applies, 0.95) * 1e3, 2),
+            "tk_lag_p95_ms": round(percentile(lags, 0.95) * 1e3, 2),
+            "tk_lag_max_ms": round(max(lags) * 1e3, 2),
+        })
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--devices', type=int, default=50)
+    parser.add_argument('--rate', type=float, default=200,
+                        help="progress updates per device per second")
+    parser.add_argument('--seconds', type=float, default=3.0)
+    parser.add_argument('--fps', type=int, default=10, help="frame rate of the view")
+    parser.add_argument('--visible-rows', type=int, default=20,
+                        help="rows in view for the headless run")
+    args = parser.parse_args()
+    print(json.dumps(run(args.devices, args.rate, args.seconds, args.fps, args.visible_rows)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Inventory Daemon Benchmark
+Many front-ends refreshing at once through one InventoryDaemon, against each
+of them scanning sysfs on its own
+
+    python3 benchmarks/bench_inventory.py
+    python3 benchmarks/bench_inventory.py --clients 64 --refreshes 100
+
+The daemon runs on a thread over a fake sysfs tree and counts its scans.
+Refreshes are spaced --interval-ms apart per client, so the run spans
+several of the daemon's refresh windows. Fan-out is the time from a hotplug
+event at the daemon until every client has seen the new device.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+from fake_tools import make_sysfs
+from inventory_daemon import InventoryDaemon, connect_watcher, request
+from usb_detector import USBDetector
+from usb_watcher import ATTACH, HotplugWatcher, PipeEventSource
+
+
+class CountingDetector(USBDetector):
+    def __init__(self, sysfs_root):
+        super().__init__(sysfs_root)
+        self.scans = 0
+
+    def scan(self):
+        self.scans += 1
+        return super().scan()
+
+
+def add_device(root, port, devnum):
+    path = os.path.join(root, port)
+    os.makedirs(path)
+    for name, value in (('idVendor', '05ac'), ('idProduct', '1281'), ('busnum', 1),
+                        ('devnum', devnum), ('serial', f"CPID:8030 ECID:{devnum:016X}")):
+        with open(os.path.join(path, name), 'w') as f:
+            f.write(f"{value}\n")
+
+
+def run(clients=16, refreshes=50, devices=8, interval_ms=10):
+    workdir = tempfile.mkdtemp(prefix="inventory-")
+    socket_path = os.path.join(workdir, "inventory.sock")
+    source = PipeEventSource()
+    loop = asyncio.new_event_loop()
+    watchers = []
+    try:
+        root = make_sysfs(os.path.join(workdir, "usb"), devices)
+        detector = CountingDetector(root)
+        daemon = InventoryDaemon(socket_path, HotplugWatcher(detector, source))
+        thread = threading.Thread(target=loop.run_until_complete, args=(daemon.serve(),),
+                                  daemon=True)
+        thread.start()
+        deadline = time.monotonic() + 5
+        while not os.path.exists(socket_path) and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        seen = threading.Barrier(clients + 1)
+        for _ in range(clients):
+            watcher = connect_watcher(socket_path, spawn=False)
+            watcher.subscribe(lambda event: event.kind == ATTACH and event.device.port == "2-8"
+                              and seen.wait())
+            watcher.start()
+            watchers.append(watcher)
+
+        # Every client refreshes every interval_ms, all at once
+        latencies = []
+        lock = threading.Lock()
+        start_scans = detector.scans
+
+        def hammer(watcher):
+            samples = []
+            for _ in range(refreshes):
+                began = time.perf_counter()
+                watcher.refresh()
+                samples.append(time.perf_counter() - began)
+                time.sleep(interval_ms / 1e3)
+            with lock:
+                latencies.extend(samples)
+
+        start = time.perf_counter()
+        threads = [threading.Thread(target=hammer, args=(watcher,)) for watcher in watchers]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - start
+        daemon_scans = detector.scans - start_scans
+
+        # Local baseline: the same refreshes, one detector per client
+        local = [USBDetector(root) for _ in range(clients)]
+        began = time.perf_counter()
+        for local_detector in local:
+            for _ in range(refreshes):
+                local_detector.scan()
+        local_scan_us = (time.perf_counter() - began) / (clients * refreshes) * 1e6
+
+        add_device(root, "2-8", 90)
+        began = time.perf_counter()
+        source.trigger()
+        seen.wait(timeout=10)
+        fanout = time.perf_counter() - began
+        stats = request(socket_path, 'stats')
+
+        daemon.stop()
+        thread.join(timeout=10)
+    finally:
+        for watcher in watchers:
+            watcher.stop()
+        loop.close()
+        source.close()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    latencies.sort()
+    return {
+        "benchmark": "inventory",
+        "clients": clients,
+        "refreshes_per_client": refreshes,
+        "local_scans": clients * refreshes,
+        "daemon_scans": daemon_scans,
+        "interval_ms": interval_ms,
+        "seconds": round(elapsed, 3),
+        "refresh_p50_us": round(latencies[len(latencies) // 2] * 1e6, 1),
+        "refresh_p95_us": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+                                * 1e6, 1),
+        "local_scan_us": round(local_scan_us, 1),
+        "fanout_ms": round(fanout * 1e3, 2),
+        "subscribers": stats['subscribers'],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--refreshes', type=int, default=50, help="refreshes per client")
+    parser.add_argument('--devices', type=int, default=8)
+    parser.add_argument('--interval-ms', type=float, default=10,
+                        help="pause between the refreshes of one client")
+    args = parser.parse_args()
+    print(json.dumps(run(args.clients, args.refreshes, args.devices, args.interval_ms)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""
+IPSW Fetch Benchmark
+Downloads a synthetic IPSW from a local http.server mirror that throttles
+each connection, single-stream against parallel ranged, plus a resume
+
+    python3 benchmarks/bench_ipsw_fetch.py
+    python3 benchmarks/bench_ipsw_fetch.py --megabytes 256 --link-mbps 100 --connections 16
+
+The per-connection limit stands in for TCP throughput over a long path;
+the link limit caps all connections together, so the parallel fetch should
+approach --link-mbps while one stream stays at --stream-mbps.
+"""
+
+import argparse
+import hashlib
+import http.server
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+from ipsw_fetch import IPSWFetcher
+from ipsw_verify import IPSWVerifier
+
+WRITE_SIZE = 256 * 1024
+
+
+class TokenBucket:
+    """Shared byte budget per second, for the whole-link limit"""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.lock = threading.Lock()
+        self.next_free = time.monotonic()
+
+    def take(self, size):
+        if not self.rate:
+            return
+        with self.lock:
+            now = time.monotonic()
+            self.next_free = max(self.next_free, now) + size / self.rate
+            delay = self.next_free - size / self.rate - now
+        if delay > 0:
+            time.sleep(delay)
+
+
+def mirror_handler(directory, stream_rate, link):
+    class MirrorHandler(http.server.BaseHTTPRequestHandler):
+        """GET with single byte ranges and a strong ETag, throttled per connection"""
+
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            path = os.path.join(directory, os.path.basename(self.path))
+            if not os.path.isfile(path):
+                self.send_error(404)
+                return
+            size = os.path.getsize(path)
+            etag = f'"{os.stat(path).st_mtime_ns:x}-{size:x}"'
+            start, end = 0, size - 1
+            ranged = self.headers.get('Range', '').startswith('bytes=')
+            if ranged and self.headers.get('If-Range', etag) != etag:
+                ranged = False
+            if ranged:
+                first, _, last = self.headers['Range'][6:].partition('-')
+                start, end = int(first), min(int(last) if last else size - 1, size - 1)
+                self.send_response(206)
+                self.send_header('Content-Range', f"bytes {start}-{end}/{size}")
+            else:
+                self.send_response(200)
+            self.send_header('Content-Length', str(end - start + 1))
+            self.send_header('ETag', etag)
+            self.send_header('Accept-Ranges', 'bytes')
+            self.end_headers()
+
+            with open(path, 'rb') as f:
+                f.seek(start)
+                remaining = end - start + 1
+                began = time.monotonic()
+                sent = 0
+                while remaining > 0:
+                    data = f.read(min(WRITE_SIZE, remaining))
+                    link.take(len(data))
+                    try:
+                        self.wfile.write(data)
+                    except (BrokenPipeError, ConnectionResetError):
+                        return
+                    remaining -= len(data)
+                    sent += len(data)
+                    if stream_rate:
+                        delay = began + sent / stream_rate - time.monotonic()
+                        if delay > 0:
+                            time.sleep(delay)
+
+    return MirrorHandler
+
+
+def make_ipsw(path, megabytes):
+    """A stored zip with a large pseudo-random member, like an IPSW's root filesystem"""
+    block = hashlib.sha256(b"ipsw").digest() * (1024 * 1024 // 32)
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_STORED) as archive:
+        archive.writestr('BuildManifest.plist', b'')
+        with archive.open('rootfs.dmg', 'w', force_zip64=True) as member:
+            for i in range(megabytes):
+                member.write(hashlib.sha256(i.to_bytes(4, 'little')).digest() + block[32:])
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for data in iter(lambda: f.read(WRITE_SIZE), b''):
+            digest.update(data)
+    return digest.hexdigest()
+
+
+def run(megabytes=64, connections=8, chunk_megabytes=None, stream_mbps=20, link_mbps=100):
+    workdir = tempfile.mkdtemp(prefix="ipsw-fetch-")
+    server = None
+    try:
+        mirror = os.path.join(workdir, "mirror")
+        os.makedirs(mirror)
+        name = "iPhone_Fake_17.5_21F79_Restore.ipsw"
+        sha256 = make_ipsw(os.path.join(mirror, name), megabytes)
+
+        link = TokenBucket(link_mbps * 1024 * 1024)
+        handler = mirror_handler(mirror, stream_mbps * 1024 * 1024, link)
+        server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f"http://127.0.0.1:{server.server_address[1]}/{name}"
+        # 16 chunks or more, so a cancelled fetch has finished chunks to resume from
+        chunk_size = (chunk_megabytes or max(1, megabytes // 16)) * 1024 * 1024
+
+        results = {}
+        for label, count in (("single", 1), ("parallel", connections)):
+            fetcher = IPSWFetcher(count, chunk_size, verifier=IPSWVerifier())
+            result = fetcher.fetch(url, os.path.join(workdir, label), sha256)
+            assert result.ok, result.summary
+            results[label] = result
+
+        # Resume: cancel half way, then fetch again
+        fetcher = IPSWFetcher(connections, chunk_size, verifier=IPSWVerifier())
+        timer = threading.Timer(results["parallel"].seconds / 2, fetcher.cancel)
+        timer.start()
+        cancelled = fetcher.fetch(url, os.path.join(workdir, "resume"), sha256)
+        timer.cancel()
+        resumed = fetcher.fetch(url, os.path.join(workdir, "resume"), sha256)
+        assert resumed.ok, resumed.summary
+    finally:
+        if server:
+            server.shutdown()
+            server.server_close()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    single, parallel = results["single"], results["parallel"]
+    return {
+        "benchmark": "ipsw_fetch",
+        "megabytes": megabytes,
+        "connections": connections,
+        "stream_limit_mbps": stream_mbps,
+        "link_limit_mbps": link_mbps,
+        "single_seconds": round(single.seconds, 3),
+        "single_mb_per_second": round(single.throughput, 1),
+        "parallel_seconds": round(parallel.seconds, 3),
+        "parallel_mb_per_second": round(parallel.throughput, 1),
+        "speedup": round(single.seconds / parallel.seconds, 2),
+        "link_utilisation": round(parallel.throughput / link_mbps, 2),
+        "resume_interrupted": not cancelled.ok,
+        "resumed_at_mb": round(resumed.resumed / (1024 * 1024), 1),
+        "resume_seconds": round(resumed.seconds, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--megabytes', type=int, default=64)
+    parser.add_argument('--connections', type=int, default=8)
+    parser.add_argument('--chunk-megabytes', type=int,
+                        help="Range request size (default: 1/16 of the file)")
+    parser.add_argument('--stream-mbps', type=float, default=20,
+                        help="throughput limit of one connection, MB/s (0 = none)")
+    parser.add_argument('--link-mbps', type=float, default=100,
+                        help="throughput limit of all connections together, MB/s (0 = none)")
+    args = parser.parse_args()
+    print(json.dumps(run(args.megabytes, args.connections, args.chunk_megabytes,
+                         args.stream_mbps, args.link_mbps)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+Log Pipeline Benchmark
+Replays stub idevicerestore output through the GUI logging path and reports
+lines per second and resident memory growth
+
+    python3 benchmarks/bench_log_pipeline.py --lines 1000000
+    python3 benchmarks/bench_log_pipeline.py --legacy --lines 20000
+
+Uses a real Tk window when a display is available, otherwise a headless
+stand-in for the text widget (reported as "sink": "headless").
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from log_pipeline import LogPipeline
+
+STUB_OUTPUT = (
+    "import sys\n"
+    "w = sys.stdout.write\n"
+    "for i in range(int(sys.argv[1])):\n"
+    "    w(f'DEBUG: send_component: sending chunk {i} of filesystem (65536 bytes)\\n')\n"
+)
+
+
+def rss_bytes():
+    """Current resident set size"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class HeadlessText:
+    """Minimal stand-in for a Tk Text widget when no display is available"""
+
+    def __init__(self):
+        self.lines = []
+
+    def insert(self, index, text):
+        self.lines.extend(text.splitlines())
+
+    def delete(self, first, last):
+        if last == 'end':
+            self.lines = []
+        else:
+            del self.lines[:int(last.split('.')[0]) - 1]
+
+    def see(self, index):
+        pass
+
+
+class HeadlessRoot:
+    """Minimal after()/mainloop() scheduler standing in for Tk"""
+
+    def __init__(self):
+        self._timers = []
+        self._running = False
+
+    def after(self, ms, func, *args):
+        timer = [time.monotonic() + ms / 1000.0, func, args]
+        self._timers.append(timer)
+        return timer
+
+    def after_cancel(self, timer):
+        if timer in self._timers:
+            self._timers.remove(timer)
+
+    def update_idletasks(self):
+        pass
+
+    def mainloop(self):
+        self._running = True
+        while self._running and self._timers:
+            self._timers.sort(key=lambda timer: timer[0])
+            due, func, args = self._timers.pop(0)
+            delay = due - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            func(*args)
+
+    def quit(self):
+        self._running = False
+
+    def destroy(self):
+        self.quit()
+
+
+def make_ui():
+    try:
+        import tkinter as tk
+        from tkinter import scrolledtext
+        root = tk.Tk()
+        text = scrolledtext.ScrolledText(root, height=15)
+        text.pack()
+        return root, text, "tk"
+    except Exception:
+        return HeadlessRoot(), HeadlessText(), "headless"
+
+
+def run(lines=1000000, legacy=False, max_lines=5000, fps=30):
+    """Replay `lines` lines of stub output and return the measurements"""
+    root, widget, sink = make_ui()
+    spill_dir = tempfile.mkdtemp()
+    pipeline = LogPipeline(widget, root, max_lines=max_lines, fps=fps,
+                           spill_path=os.path.join(spill_dir, "bench.log"))
+
+    def log_legacy(message):
+        # The pre-pipeline log_message: one insert, see and redraw per line
+        timestamp = time.strftime("%H:%M:%S")
+        widget.insert('end', f"[{timestamp}] {message}\n")
+        widget.see('end')
+        root.update_idletasks()
+
+    def log_pipeline(message):
+        timestamp = time.strftime("%H:%M:%S")
+        pipeline.write(f"[{timestamp}] {message}")
+
+    log = log_legacy if legacy else log_pipeline
+    done = threading.Event()
+    rss_start = rss_bytes()
+    rss_peak = [rss_start]
+
+    def reader():
+        process = subprocess.Popen([sys.executable, '-c', STUB_OUTPUT, str(lines)],
+                                   stdout=subprocess.PIPE, text=True, bufsize=1)
+        for line in iter(process.stdout.readline, ''):
+            log(line.strip())
+        process.wait()
+        done.set()
+
+    def watch():
+        rss_peak[0] = max(rss_peak[0], rss_bytes())
+        if done.is_set() and (legacy or pipeline.lines_written >= lines):
+            root.quit()
+        else:
+            root.after(50, watch)
+
+    start = time.monotonic()
+    if legacy:
+        # Legacy logging ran the widget calls on the reader thread
+        reader()
+        watch()
+    else:
+        pipeline.start()
+        threading.Thread(target=reader, daemon=True).start()
+        root.after(50, watch)
+        root.mainloop()
+    elapsed = time.monotonic() - start
+    pipeline.close()
+    rss_end = rss_bytes()
+    root.destroy()
+
+    return {
+        "benchmark": "log_pipeline",
+        "mode": "legacy" if legacy else "pipeline",
+        "sink": sink,
+        "lines": lines,
+        "seconds": round(elapsed, 3),
+        "lines_per_second": round(lines / elapsed) if elapsed else None,
+        "rss_start_mb": round(rss_start / 2**20, 1),
+        "rss_peak_mb": round(max(rss_peak[0], rss_end) / 2**20, 1),
+        "rss_growth_mb": round((max(rss_peak[0], rss_end) - rss_start) / 2**20, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--lines', type=int, default=1000000)
+    parser.add_argument('--legacy', action='store_true',
+                        help="measure the old per-line insert/see/update_idletasks path")
+    parser.add_argument('--max-lines', type=int, default=5000)
+    parser.add_argument('--fps', type=int, default=30)
+    args = parser.parse_args()
+    print(json.dumps(run(args.lines, args.legacy, args.max_lines, args.fps)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Log Store Benchmark
+Writes synthetic restore sessions through LogStore, then compares an indexed
+query with decompressing and scanning every log for the same answer
+
+    python3 benchmarks/bench_log_store.py
+    python3 benchmarks/bench_log_store.py --sessions 2000 --lines 5000 --budget-mb 16
+
+Every fourth session fails in the baseband phase; the query is "failures in
+the baseband phase of the last 7 days". A budget smaller than the logs
+written shows rotation at work.
+"""
+
+import argparse
+import gzip
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from log_store import FAILURE, LogStore
+
+BASEBAND_ERROR = "ERROR: Unable to send BasebandData: USB transfer timed out"
+
+
+def session_lines(i, lines):
+    yield "Found device in Recovery mode"
+    yield "Sending iBEC (1234567 bytes)..."
+    yield "About to send filesystem..."
+    for chunk in range(lines):
+        yield f"DEBUG: asr_send_payload: sent chunk {chunk} ({65536 + i % 7} bytes) to ASR"
+    yield "Done sending filesystem"
+    yield "About to send BasebandData..."
+
+
+def run(sessions=500, lines=2000, budget_mb=0, queries=200):
+    workdir = tempfile.mkdtemp(prefix="log-store-")
+    try:
+        budget = int(budget_mb * 2**20) if budget_mb else 2**40
+        store = LogStore(os.path.join(workdir, "logs"), budget)
+
+        write_seconds = 0.0
+        finish = []
+        raw_bytes = compressed_bytes = 0
+        for i in range(sessions):
+            failed = i % 4 == 3
+            log = store.open(f"00008030-{i % 64:016X}", "/srv/ipsw/iPhone_17.5_21F79_Restore.ipsw")
+            start = time.perf_counter()
+            for text in session_lines(i, lines):
+                log.write(text)
+            if failed:
+                log.write(BASEBAND_ERROR)
+                log.error("baseband", BASEBAND_ERROR)
+            write_seconds += time.perf_counter() - start
+            raw_bytes += log.raw_bytes
+
+            start = time.perf_counter()
+            log.close(255 if failed else 0, "baseband" if failed else "finalize")
+            finish.append(time.perf_counter() - start)
+            compressed_bytes += os.path.getsize(log.path) if os.path.exists(log.path) else 0
+
+        since = time.time() - 7 * 86400
+        samples = []
+        for _ in range(queries):
+            start = time.perf_counter()
+            found = store.sessions(outcome=FAILURE, phase="baseband", since=since, limit=None)
+            samples.append(time.perf_counter() - start)
+
+        # The same question answered by decompressing every log still on disk
+        start = time.perf_counter()
+        scanned = 0
+        for root, _, names in os.walk(store.log_dir):
+            for name in names:
+                if name.endswith(".log.gz"):
+                    with gzip.open(os.path.join(root, name), 'rt') as f:
+                        scanned += any(line.startswith("ERROR: Unable to send BasebandData")
+                                       for line in f)
+        scan = time.perf_counter() - start
+        disk_usage = store.disk_usage
+        kept = sum(1 for session in store.sessions(limit=None) if session.path)
+        store.close()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    samples.sort()
+    return {
+        "benchmark": "log_store",
+        "sessions": sessions,
+        "lines_per_session": lines,
+        "raw_mb": round(raw_bytes / 2**20, 1),
+        "compression_ratio": round(raw_bytes / max(1, compressed_bytes), 1),
+        "write_mb_per_second": round(raw_bytes / 2**20 / write_seconds, 1),
+        "lines_per_second": round(sessions * (lines + 5) / write_seconds),
+        "finish_mean_ms": round(statistics.mean(finish) * 1e3, 3),
+        "query_matches": len(found),
+        "query_p50_ms": round(samples[len(samples) // 2] * 1e3, 3),
+        "query_p95_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1e3, 3),
+        "scan_matches": scanned,
+        "scan_ms": round(scan * 1e3, 1),
+        "logs_kept": kept,
+        "disk_usage_mb": round(disk_usage / 2**20, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--sessions', type=int, default=500)
+    parser.add_argument('--lines', type=int, default=2000, help="output lines per session")
+    parser.add_argument('--budget-mb', type=float, default=0,
+                        help="log budget in MiB (default: no rotation)")
+    parser.add_argument('--queries', type=int, default=200)
+    args = parser.parse_args()
+    print(json.dumps(run(args.sessions, args.lines, args.budget_mb, args.queries)))
+
+
+if __name__ == "__main__":
+    main()
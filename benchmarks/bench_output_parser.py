@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Output Parser Benchmark
+Measures the per-byte overhead of RestoreOutputParser over recorded
+idevicerestore logs
+
+    python3 benchmarks/bench_output_parser.py                  # synthetic log
+    python3 benchmarks/bench_output_parser.py --log restore.log --log other.log
+"""
+
+import argparse
+import io
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from restore_metrics import RestoreSession
+from restore_output import RestoreOutputParser
+
+CHUNK_SIZE = 65536
+
+
+def synthetic_log(megabytes=32):
+    """A debug-level restore log with in-place progress bars"""
+    parts = [b"Found device in Recovery mode\n", b"Sending iBEC (1234567 bytes)...\n",
+             b"Sending RestoreRamDisk (104857600 bytes)...\n", b"About to send filesystem...\n",
+             b"Sending filesystem now...\n"]
+    size = sum(len(part) for part in parts)
+    i = 0
+    while size < megabytes * 1024 * 1024:
+        if i % 20 == 0:
+            part = b"\r[%-50s] %5.1f%%" % (b"=" * (i % 50), (i / 200.0) % 100)
+        else:
+            part = b"DEBUG: asr_send_payload: sent chunk %d (65536 bytes) to ASR\n" % i
+        parts.append(part)
+        size += len(part)
+        i += 1
+    parts += [b"\nDone sending filesystem\n", b"Status: Restore Finished\n", b"DONE\n"]
+    return b"".join(parts)
+
+
+def run(data, repeat=3):
+    """Return the best-of-`repeat` parse and baseline timings for `data`"""
+    chunks = [data[i:i + CHUNK_SIZE] for i in range(0, len(data), CHUNK_SIZE)]
+
+    def parse():
+        parser = RestoreOutputParser()
+        count = 0
+        for chunk in chunks:
+            count += len(parser.feed(chunk))
+        return count + len(parser.close())
+
+    def parse_with_metrics():
+        # Same as parse() plus the per-event RestoreSession bookkeeping
+        parser = RestoreOutputParser()
+        session = RestoreSession()
+        count = 0
+        for chunk in chunks:
+            for event in parser.feed(chunk):
+                session.handle(event)
+                count += 1
+        for event in parser.close():
+            session.handle(event)
+            count += 1
+        session.finish(0)
+        return count
+
+    def readline_baseline():
+        # The old front-end path: text-mode readline per line
+        stream = io.TextIOWrapper(io.BytesIO(data), encoding='utf-8', errors='replace')
+        return sum(1 for line in iter(stream.readline, '') if line.strip())
+
+    def best(func):
+        times = []
+        result = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = func()
+            times.append(time.perf_counter() - start)
+        return min(times), result
+
+    parse_seconds, events = best(parse)
+    metrics_seconds, _ = best(parse_with_metrics)
+    readline_seconds, lines = best(readline_baseline)
+    return {
+        "benchmark": "output_parser",
+        "bytes": len(data),
+        "events": events,
+        "parser_seconds": round(parse_seconds, 4),
+        "parser_ns_per_byte": round(parse_seconds * 1e9 / len(data), 2),
+        "parser_mb_per_second": round(len(data) / parse_seconds / 2**20, 1),
+        "metrics_ns_per_byte": round((metrics_seconds - parse_seconds) * 1e9 / len(data), 2),
+        "readline_lines": lines,
+        "readline_ns_per_byte": round(readline_seconds * 1e9 / len(data), 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--log', action='append', default=[],
+                        help="recorded idevicerestore output (repeatable)")
+    parser.add_argument('--megabytes', type=int, default=32,
+                        help="size of the synthetic log when no --log is given")
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    if args.log:
+        data = b"".join(open(path, 'rb').read() for path in args.log)
+    else:
+        data = synthetic_log(args.megabytes)
+    print(json.dumps(run(data, args.repeat)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Preflight Benchmark
+Time to reject an IPSW that does not fit the attached devices, one device at
+a time against all of them in parallel, cold (manifests not yet parsed,
+devices not yet identified) and warm
+
+    python3 benchmarks/bench_preflight.py
+    python3 benchmarks/bench_preflight.py --devices 32 --ipsw 50
+
+Devices are in normal mode and identified by the fake ideviceinfo, one
+process per device as with the real tool, which waits --query-ms for the
+device round trip; half of them are models the IPSW does not support.
+Recovery-mode devices are identified from their USB serial and need no
+process at all.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+from fake_tools import FakeToolchain, fake_udid, make_ipsw_library
+from ipsw_catalog import IPSWCatalog
+from preflight import Preflight
+from usb_detector import USBDevice
+
+
+def normal_devices(count):
+    return [USBDevice(f"1-{i + 1}", 1, i + 2, 0x12a8, fake_udid(i).replace('-', ''))
+            for i in range(count)]
+
+
+def run(devices=16, ipsw=20, query_ms=150):
+    workdir = tempfile.mkdtemp(prefix="preflight-")
+    try:
+        with FakeToolchain(devices=devices, query_seconds=query_ms / 1e3):
+            library = make_ipsw_library(os.path.join(workdir, "ipsw"), ipsw)
+            files = sorted(os.path.join(library, name) for name in os.listdir(library))
+            target = files[0]
+            attached = normal_devices(devices)
+
+            def timed(preflight, parallel):
+                start = time.perf_counter()
+                if parallel:
+                    results = preflight.check_many((target, device) for device in attached)
+                else:
+                    results = [preflight.check(target, device) for device in attached]
+                return time.perf_counter() - start, results
+
+            sequential, _ = timed(Preflight(IPSWCatalog(os.path.join(workdir, "seq.db"))), False)
+            catalog = IPSWCatalog(os.path.join(workdir, "catalog.db"))
+            preflight = Preflight(catalog)
+            parallel, results = timed(preflight, True)
+            warm, _ = timed(preflight, True)
+            rejected = sum(1 for result in results if not result.ok)
+
+            # Manifest parsing alone: first look at each file, then the memoised lookup
+            cold_catalog = IPSWCatalog(os.path.join(workdir, "cold.db"))
+            start = time.perf_counter()
+            for path in files:
+                cold_catalog.add(path)
+            manifest_cold = (time.perf_counter() - start) / len(files)
+            samples = []
+            for path in files:
+                start = time.perf_counter()
+                cold_catalog.add(path)
+                samples.append(time.perf_counter() - start)
+            manifest_warm = statistics.median(samples)
+
+            recovery = USBDevice("2-1", 2, 1, 0x1281,
+                                 "CPID:8101 CPRV:11 BDID:0C ECID:0000000000000005")
+            start = time.perf_counter()
+            recovery_result = Preflight(catalog).check(target, recovery)
+            recovery_check = time.perf_counter() - start
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        "benchmark": "preflight",
+        "devices": devices,
+        "ipsw_files": ipsw,
+        "query_ms": query_ms,
+        "rejected": rejected,
+        "sequential_ms": round(sequential * 1e3, 1),
+        "parallel_ms": round(parallel * 1e3, 1),
+        "warm_ms": round(warm * 1e3, 2),
+        "manifest_cold_us": round(manifest_cold * 1e6, 1),
+        "manifest_warm_us": round(manifest_warm * 1e6, 1),
+        "recovery_serial_us": round(recovery_check * 1e6, 1),
+        "recovery_rejected": not recovery_result.ok,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--devices', type=int, default=16)
+    parser.add_argument('--ipsw', type=int, default=20, help="IPSW files in the library")
+    parser.add_argument('--query-ms', type=float, default=150,
+                        help="simulated device round trip of one ideviceinfo call")
+    args = parser.parse_args()
+    print(json.dumps(run(args.devices, args.ipsw, args.query_ms)))
+
+
+if __name__ == "__main__":
+    main()
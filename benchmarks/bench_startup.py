@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Startup Benchmark
+The tool check of a launch: the old `which idevicerestore` fork against an
+in-process lookup, a first (cold) capability probe against a cached one, and
+`simple_iphone_manager.py --status` end to end with and without the cache
+
+    python3 benchmarks/bench_startup.py
+    python3 benchmarks/bench_startup.py --launches 20
+
+Launches run against fake tools with a private HOME and the inventory daemon
+disabled, so every launch starts from the same state. Without a sysfs USB
+tree the status check reports an error, which costs the same either way.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from fake_tools import FakeToolchain
+from toolchain import Toolchain
+
+
+def timed(func, iterations):
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples)
+
+
+def run(launches=10, iterations=200):
+    workdir = tempfile.mkdtemp(prefix="startup-")
+    try:
+        with FakeToolchain():
+            cache_path = os.path.join(workdir, "toolchain.json")
+
+            which = shutil.which('which')
+            which_fork = timed(lambda: subprocess.run([which, 'idevicerestore'], check=True,
+                                                      capture_output=True),
+                               iterations // 4 or 1) if which else None
+            resolve = timed(lambda: Toolchain(cache_path).missing(), iterations)
+
+            def cold():
+                if os.path.exists(cache_path):
+                    os.unlink(cache_path)
+                Toolchain(cache_path).tool('idevicerestore')
+            probe_cold = timed(cold, max(1, launches))
+            probe_warm = timed(lambda: Toolchain(cache_path).tool('idevicerestore'), iterations)
+
+            env = dict(os.environ, HOME=os.path.join(workdir, "home"), IPHONE_MANAGER_INVENTORY="0")
+            cmd = [sys.executable, os.path.join(REPO_DIR, "simple_iphone_manager.py"), "--status"]
+            launch_cache = os.path.join(env['HOME'], ".cache", "iphone_firmware_manager",
+                                        "toolchain.json")
+
+            def launch(warm):
+                if not warm and os.path.exists(launch_cache):
+                    os.unlink(launch_cache)
+                subprocess.run(cmd, env=env, check=True, capture_output=True)
+            launch(True)
+            launch_cold = timed(lambda: launch(False), launches)
+            launch_warm = timed(lambda: launch(True), launches)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        "benchmark": "startup",
+        "launches": launches,
+        "which_fork_ms": round(which_fork * 1e3, 2) if which_fork is not None else None,
+        "resolve_us": round(resolve * 1e6, 1),
+        "probe_cold_ms": round(probe_cold * 1e3, 2),
+        "probe_warm_us": round(probe_warm * 1e6, 1),
+        "launch_cold_ms": round(launch_cold * 1e3, 1),
+        "launch_warm_ms": round(launch_warm * 1e3, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--launches', type=int, default=10,
+                        help="process launches per variant (median is reported)")
+    parser.add_argument('--iterations', type=int, default=200,
+                        help="in-process lookups per variant")
+    args = parser.parse_args()
+    print(json.dumps(run(args.launches, args.iterations)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+USB Topology Scheduler Benchmark
+Restores every phone of a fake hub/controller tree at once, with and without
+TopologyScheduler, and compares tail latency and failures
+
+    python3 benchmarks/bench_usb_topology.py
+    python3 benchmarks/bench_usb_topology.py --controllers 1 --devices-per-hub 7
+
+Restores are stubs on a simulated bus with a virtual clock (ticks), so runs
+are deterministic and take well under a second. A transfer gets an equal
+share of its hub and of its controller, whichever is smaller; a transfer
+starved below --min-rate stalls and times out with --stall-probability per
+tick, and the restore is retried from scratch up to --attempts times, as the
+job journal would.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+from fake_tools import make_hub_sysfs
+from usb_detector import USBDetector
+from usb_topology import TopologyScheduler, UsbTopology
+
+# Event loop iterations between ticks, enough for release -> grant -> next transfer
+SETTLE_ITERATIONS = 20
+
+
+class SimulatedBus:
+    """Shared hub and controller bandwidth on a virtual clock"""
+
+    def __init__(self, topology, hub_bandwidth, controller_bandwidth, min_rate,
+                 stall_probability, seed=1):
+        self.topology = topology
+        self.hub_bandwidth = hub_bandwidth
+        self.controller_bandwidth = controller_bandwidth
+        self.min_rate = min_rate
+        self.stall_probability = stall_probability
+        self.random = random.Random(seed)
+        self.now = 0
+        self.transfers = {}
+        self.sleepers = []
+
+    def transfer(self, port, size):
+        """Future that is True when size units are sent, False if the transfer timed out"""
+        future = asyncio.get_running_loop().create_future()
+        self.transfers[future] = [port, size]
+        return future
+
+    def sleep(self, ticks):
+        future = asyncio.get_running_loop().create_future()
+        self.sleepers.append((self.now + ticks, future))
+        return future
+
+    def step(self):
+        self.now += 1
+        hubs, controllers = {}, {}
+        for port, _ in self.transfers.values():
+            hub, controller = self.topology.hub(port), self.topology.controller(port)
+            hubs[hub] = hubs.get(hub, 0) + 1
+            controllers[controller] = controllers.get(controller, 0) + 1
+
+        for future, transfer in list(self.transfers.items()):
+            port = transfer[0]
+            rate = min(self.hub_bandwidth / hubs[self.topology.hub(port)],
+                       self.controller_bandwidth / controllers[self.topology.controller(port)])
+            if rate < self.min_rate and self.random.random() < self.stall_probability:
+                del self.transfers[future]
+                future.set_result(False)
+                continue
+            transfer[1] -= rate
+            if transfer[1] <= 0:
+                del self.transfers[future]
+                future.set_result(True)
+
+        for entry in [entry for entry in self.sleepers if entry[0] <= self.now]:
+            self.sleepers.remove(entry)
+            entry[1].set_result(None)
+
+
+async def simulate(ports, topology, scheduler, size, device_ticks, attempts, bus_options):
+    bus = SimulatedBus(topology, **bus_options)
+
+    async def restore(port):
+        for attempt in range(1, attempts + 1):
+            slot = await scheduler.acquire(port) if scheduler else None
+            sent = await bus.transfer(port, size)
+            if slot:
+                slot.release()
+            if sent:
+                await bus.sleep(device_ticks)
+                return bus.now, attempt, True
+        return bus.now, attempts, False
+
+    tasks = [asyncio.ensure_future(restore(port)) for port in ports]
+    while not all(task.done() for task in tasks):
+        for _ in range(SETTLE_ITERATIONS):
+            await asyncio.sleep(0)
+        bus.step()
+    results = [task.result() for task in tasks]
+
+    # Failed restores have to be re-entered by hand, their latency is unbounded
+    latencies = sorted(ticks for ticks, _, ok in results if ok) or [0]
+    return {
+        "p50_ticks": latencies[len(latencies) // 2],
+        "p95_ticks": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+        "max_ticks": latencies[-1],
+        "mean_ticks": round(statistics.mean(latencies), 1),
+        "failed": sum(1 for _, _, ok in results if not ok),
+        "retries": sum(attempt - 1 for _, attempt, _ in results),
+    }
+
+
+async def acquire_release(scheduler, ports, iterations):
+    start = time.perf_counter()
+    for i in range(iterations):
+        slot = await scheduler.acquire(ports[i % len(ports)])
+        slot.release()
+    return time.perf_counter() - start
+
+
+def run(controllers=2, buses_per_controller=2, hubs_per_bus=1, devices_per_hub=4, per_hub=2,
+        per_controller=4, size=100.0, device_ticks=60, attempts=3, hub_bandwidth=12.0,
+        controller_bandwidth=24.0, min_rate=4.0, stall_probability=0.05, seed=1):
+    workdir = tempfile.mkdtemp(prefix="usb-topology-")
+    try:
+        root = make_hub_sysfs(os.path.join(workdir, "usb"), controllers, buses_per_controller,
+                              hubs_per_bus, devices_per_hub)
+        ports = [device.port for device in USBDetector(root).scan()]
+        topology = UsbTopology(root)
+        bus_options = {'hub_bandwidth': hub_bandwidth, 'controller_bandwidth': controller_bandwidth,
+                       'min_rate': min_rate, 'stall_probability': stall_probability, 'seed': seed}
+
+        naive = asyncio.run(simulate(ports, topology, None, size, device_ticks, attempts,
+                                     bus_options))
+        scheduler = TopologyScheduler(topology, per_hub, per_controller)
+        scheduled = asyncio.run(simulate(ports, topology, scheduler, size, device_ticks,
+                                         attempts, bus_options))
+        overhead = asyncio.run(acquire_release(scheduler, ports, 20000)) / 20000
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    result = {
+        "benchmark": "usb_topology",
+        "devices": len(ports),
+        "hubs": len({topology.hub(port) for port in ports}),
+        "controllers": len({topology.controller(port) for port in ports}),
+        "per_hub": per_hub,
+        "per_controller": per_controller,
+    }
+    result.update({f"naive_{key}": value for key, value in naive.items()})
+    result.update({f"scheduled_{key}": value for key, value in scheduled.items()})
+    # Cost of an uncontended acquire() + release() on the event loop
+    result["acquire_release_us"] = round(overhead * 1e6, 2)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--controllers', type=int, default=2)
+    parser.add_argument('--buses-per-controller', type=int, default=2)
+    parser.add_argument('--hubs-per-bus', type=int, default=1)
+    parser.add_argument('--devices-per-hub', type=int, default=4)
+    parser.add_argument('--per-hub', type=int, default=2)
+    parser.add_argument('--per-controller', type=int, default=4)
+    parser.add_argument('--attempts', type=int, default=3)
+    parser.add_argument('--min-rate', type=float, default=4.0,
+                        help="per-transfer bandwidth below which transfers may stall")
+    parser.add_argument('--stall-probability', type=float, default=0.05)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    print(json.dumps(run(args.controllers, args.buses_per_controller, args.hubs_per_bus,
+                         args.devices_per_hub, args.per_hub, args.per_controller,
+                         attempts=args.attempts, min_rate=args.min_rate,
+                         stall_probability=args.stall_probability, seed=args.seed)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+Orchestrator Check
+Drives run_jobs and RestoreEngine against the stub idevicerestore of fake_tools
+and a fake sysfs tree, and checks the outcome of every device, exits non-zero
+on the first mismatch
+
+    python3 benchmarks/check_orchestrator.py
+    python3 benchmarks/check_orchestrator.py --devices 12 --max-concurrent 3
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import zipfile
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+import restore_engine
+from fake_tools import FakeToolchain, fake_udid, make_sysfs
+from job_journal import JobJournal, SUCCEEDED, FAILED as JOB_FAILED
+from restore_batch import device_selector, run_jobs
+from restore_engine import COMPLETED, FAILED, RESTORING, RestoreEngine
+from restore_output import LINE
+from toolchain import Toolchain
+from usb_detector import USBDetector
+
+
+def expected_identifier(index, recovery):
+    """Identifier make_sysfs gives device index: odd ones are in recovery with recovery set"""
+    return f"{index:016X}" if recovery and index % 2 else fake_udid(index)
+
+
+def check(devices=8, max_concurrent=3, lines=200, fail_every=4, fail_code=3, recovery=True):
+    """Return a list of problems, empty if the restores behaved"""
+    problems = []
+    workdir = tempfile.mkdtemp(prefix="orchestrator-check-")
+    try:
+        ipsw = os.path.join(workdir, "check.ipsw")
+        with zipfile.ZipFile(ipsw, 'w') as archive:
+            archive.writestr('BuildManifest.plist', b'')
+        detector = USBDetector(make_sysfs(os.path.join(workdir, "sysfs"), devices,
+                                          recovery=recovery))
+        # One attempt per job, so a failing stub is reported instead of retried
+        journal = JobJournal(':memory:', max_attempts=1)
+
+        with FakeToolchain(devices=devices, lines=lines, fail_every=fail_every,
+                           fail_code=fail_code, recovery=recovery):
+            running = set()
+            peak = [0]
+            output = {}
+            results = {}
+
+            def on_update(restore):
+                if restore.status == RESTORING:
+                    running.add(restore.device)
+                else:
+                    running.discard(restore.device)
+                peak[0] = max(peak[0], len(running))
+
+            def on_event(restore, event):
+                if event.kind == LINE:
+                    output.setdefault(restore.device, []).append(event.text)
+
+            def on_result(job, device, restore, error):
+                results[job.device if device is None else device.identifier] = (job, restore)
+
+            engine = RestoreEngine(on_update=on_update, on_event=on_event)
+            attached = detector.scan()
+            expected = [expected_identifier(i, recovery) for i in range(devices)]
+            if sorted(device.identifier for device in attached) != sorted(expected):
+                problems.append(f"discovered {[device.identifier for device in attached]}, "
+                                f"expected {expected}")
+
+            command = engine.build_command(fake_udid(0), ipsw, erase=True,
+                                           exclude_baseband=False)
+            if command != ['idevicerestore', '-u', fake_udid(0), '-e', ipsw]:
+                problems.append(f"unexpected command line {command}")
+
+            options = {'erase': True, 'exclude_baseband': False}
+            job_ids = journal.enqueue_many([(device_selector(device), ipsw, options,
+                                             None, None, None) for device in attached])
+            restore_engine.run(run_jobs(engine, journal, job_ids, detector.scan,
+                                        lambda ipsw, sha256: None, on_result, max_concurrent,
+                                        poll=0.05))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if sorted(results) != sorted(expected):
+        problems.append(f"restored {sorted(results)}, expected {sorted(expected)}")
+    if peak[0] > max_concurrent:
+        problems.append(f"{peak[0]} restores ran at once, cap is {max_concurrent}")
+    for index, identifier in enumerate(expected):
+        if identifier not in results:
+            continue
+        job, restore = results[identifier]
+        fails = fail_every and index % fail_every == fail_every - 1
+        want = (fail_code, FAILED, JOB_FAILED) if fails else (0, COMPLETED, SUCCEEDED)
+        if (restore.returncode, restore.status, job.state) != want:
+            problems.append(f"{identifier}: exit code {restore.returncode} ({restore.status}, "
+                            f"job {job.state}), expected {want[0]} ({want[1]}, job {want[2]})")
+        if not any(identifier in line for line in output.get(identifier, [])):
+            problems.append(f"{identifier}: output not attributed to the device")
+        if fails and not restore.errors:
+            problems.append(f"{identifier}: failure without an ERROR event")
+    return problems
+
+
+def check_unsupported_option(devices=3):
+    """Jobs needing an option the installed idevicerestore lacks fail alone, the rest run"""
+    problems = []
+    workdir = tempfile.mkdtemp(prefix="orchestrator-check-")
+    try:
+        ipsw = os.path.join(workdir, "check.ipsw")
+        with zipfile.ZipFile(ipsw, 'w') as archive:
+            archive.writestr('BuildManifest.plist', b'')
+        detector = USBDetector(make_sysfs(os.path.join(workdir, "sysfs"), devices))
+        journal = JobJournal(':memory:', max_attempts=1)
+        results = {}
+
+        def on_result(job, device, restore, error):
+            results[job.id] = job
+
+        with FakeToolchain(devices=devices, lines=20, missing_options=['-x']) as tools:
+            toolchain = Toolchain(os.path.join(workdir, "toolchain.json"),
+                                  search_path=tools.directory)
+            engine = RestoreEngine(toolchain=toolchain)
+            attached = detector.scan()
+            # Only the first device asks for -x
+            job_ids = journal.enqueue_many([
+                (device_selector(device), ipsw, {'exclude_baseband': index == 0},
+                 None, None, None) for index, device in enumerate(attached)])
+            try:
+                restore_engine.run(run_jobs(
+                    engine, journal, job_ids, detector.scan, lambda ipsw, sha256: None,
+                    on_result, poll=0.05))
+            except Exception as e:
+                problems.append(f"run_jobs raised {type(e).__name__}: {e}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    for index, job_id in enumerate(job_ids):
+        job = results.get(job_id)
+        if job is None:
+            problems.append(f"job {job_id}: no result, state {journal.get(job_id).state}")
+        elif index == 0 and (job.state != JOB_FAILED or '-x' not in (job.last_error or '')):
+            problems.append(f"job {job_id}: {job.state} ({job.last_error}), "
+                            f"expected failed for the missing -x")
+        elif index and job.state != SUCCEEDED:
+            problems.append(f"job {job_id}: {job.state} ({job.last_error}), expected succeeded")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--devices', type=int, default=8)
+    parser.add_argument('--max-concurrent', type=int, default=3)
+    parser.add_argument('--fail-every', type=int, default=4,
+                        help="every Nth stub restore fails half way (0 = never)")
+    parser.add_argument('--no-recovery', action='store_true',
+                        help="attach every device in normal mode, none in recovery")
+    args = parser.parse_args()
+    problems = check(args.devices, args.max_concurrent, fail_every=args.fail_every,
+                     recovery=not args.no_recovery)
+    problems += check_unsupported_option()
+    for problem in problems:
+        print(f"FAIL {problem}")
+    if problems:
+        sys.exit(1)
+    print(f"OK {args.devices} stub restores, {args.max_concurrent} at a time")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+"""
+Fake Device Tools
+Stand-ins for lsusb, idevice_id, ideviceinfo, irecovery and idevicerestore
+(plus a fake sysfs USB tree and IPSW library) so benchmarks run without hardware
+
+    with FakeToolchain(devices=8, lines=2000, fail_every=4):
+        ...  # the tools on PATH are the fakes
+"""
+
+import json
+import os
+import plistlib
+import shutil
+import stat
+import sys
+import tempfile
+import zipfile
+
+FAKE_LSUSB = r'''
+import json, sys
+config = json.load(open(CONFIG))
+for i in range(config['devices']):
+    product = '1281' if config['recovery'] and i % 2 else '12a8'
+    name = 'Mobile Device (Recovery Mode)' if product == '1281' else 'iPhone 5/5C/5S/6/SE/7/8/X/XR'
+    print(f"Bus 00{i // 8 + 1} Device {i + 2:03d}: ID 05ac:{product} Apple, Inc. {name}")
+for i in range(config['other_devices']):
+    print(f"Bus 00{i // 8 + 1} Device {i + 100:03d}: ID 046d:c52b Logitech, Inc. Unifying Receiver")
+'''
+
+FAKE_IDEVICE_ID = r'''
+import json, sys
+config = json.load(open(CONFIG))
+if '-l' in sys.argv:
+    for i in range(config['devices']):
+        print(udid(i))
+'''
+
+FAKE_IDEVICEINFO = r'''
+import json, sys, time
+config = json.load(open(CONFIG))
+args = sys.argv[1:]
+index = int(args[args.index('-u') + 1].split('-')[1], 16) if '-u' in args else 0
+time.sleep(config['query_seconds'])
+product_type, (chip_id, board_id, device_class) = board(index)
+print(f"BoardId: {board_id}\nChipID: {chip_id}\nDeviceClass: iPhone\n"
+      f"HardwareModel: {device_class.upper()}\nProductType: {product_type}\n"
+      f"ProductVersion: 17.5\nUniqueDeviceID: {udid(index)}")
+'''
+
+FAKE_IRECOVERY = r'''
+import json, sys, time
+config = json.load(open(CONFIG))
+args = sys.argv[1:]
+index = int(args[args.index('-i') + 1], 16) if '-i' in args else 0
+time.sleep(config['query_seconds'])
+product_type, (chip_id, board_id, device_class) = board(index)
+print(f"CPID: 0x{chip_id:04x}\nCPRV: 0x11\nBDID: 0x{board_id:02x}\nECID: 0x{index:016x}\n"
+      f"MODE: Recovery\nPRODUCT: {product_type}\nMODEL: {device_class}")
+'''
+
+FAKE_IDEVICERESTORE = r'''
+import json, sys, time
+config = json.load(open(CONFIG))
+args = sys.argv[1:]
+if '--version' in args:
+    print("idevicerestore 1.0.0-fake")
+    sys.exit(0)
+if '--help' in args:
+    print("\n".join(line for line in """Usage: idevicerestore [OPTIONS] PATH
+
+Restore IPSW firmware at PATH to an iOS device.
+
+OPTIONS:
+  -i, --ecid ECID       Target specific device by its ECID
+  -u, --udid UDID       Target specific device by its device UDID
+  -e, --erase           Perform full restore instead of update, erasing all data
+  -x, --exclude         Exclude nor/baseband upgrade
+  -y, --no-input        Non-interactive mode, do not ask for any user input
+  -d, --debug           Enable communication debugging
+  -h, --help            Prints usage information
+  -v, --version         Prints version information""".splitlines()
+                    if line.split(',')[0].strip() not in config['missing_options']))
+    sys.exit(0)
+if '-i' in args:
+    # Recovery and DFU devices are selected by ECID, make_sysfs numbers them like UDIDs
+    index = int(args[args.index('-i') + 1], 16)
+    device = "%016X" % index
+else:
+    device = args[args.index('-u') + 1] if '-u' in args else udid(0)
+    index = int(device.split('-')[1], 16)
+rate = config['line_rate']
+lines = config['lines']
+emit = sys.stdout.write
+
+emit(f"Found device {device}\n")
+emit("Sending iBEC (1048576 bytes)...\n")
+emit("Sending RestoreRamDisk (104857600 bytes)...\n")
+emit("About to send filesystem...\n")
+emit("Sending filesystem now...\n")
+start = time.monotonic()
+fails = config['fail_every'] and index % config['fail_every'] == config['fail_every'] - 1
+for i in range(lines):
+    if i % 50 == 0:
+        emit("\r[%-50s] %5.1f%%" % ("=" * (50 * i // lines), 100.0 * i / lines))
+    else:
+        emit(f"DEBUG: asr_send_payload: sent chunk {i} (65536 bytes)\n")
+    if fails and i == lines // 2:
+        sys.stdout.flush()
+        emit("\nERROR: Unable to send filesystem: " + config['fail_message'] + "\n")
+        sys.exit(config['fail_code'])
+    if rate:
+        delay = start + (i + 1) / rate - time.monotonic()
+        if delay > 0:
+            sys.stdout.flush()
+            time.sleep(delay)
+emit("\nDone sending filesystem\n")
+time.sleep(config['restore_seconds'])
+emit("Status: Restore Finished\nDONE\n")
+'''
+
+PRELUDE = '''#!{python}
+CONFIG = {config!r}
+
+def udid(i):
+    return "00008030-%016X" % i
+
+def board(i):
+    product_types = config['product_types']
+    product_type = product_types[i % len(product_types)]
+    return product_type, BOARDS[product_type]
+'''
+
+# ProductType -> (ApChipID, ApBoardID, board config) for fake manifests and devices
+BOARDS = {
+    "iPhone12,1": (0x8030, 0x04, "n104ap"),
+    "iPhone13,2": (0x8101, 0x0C, "d53gap"),
+    "iPhone14,5": (0x8110, 0x0A, "d17ap"),
+}
+
+
+def fake_udid(i):
+    return "00008030-%016X" % i
+
+
+class FakeToolchain:
+    """Write fake device tools to a temporary directory and put it first on PATH
+
+    devices:         number of attached devices reported
+    lines:           debug lines each idevicerestore run prints
+    line_rate:       lines per second per run (0 = as fast as possible)
+    restore_seconds: simulated on-device time after the filesystem is sent
+    fail_every:      every Nth device fails half way through (0 = never)
+    query_seconds:   simulated device round trip of ideviceinfo and irecovery
+    missing_options: short options idevicerestore leaves out of its usage text
+    """
+
+    def __init__(self, devices=4, lines=1000, line_rate=0, restore_seconds=0.0,
+                 fail_every=0, fail_message="USB transfer timed out", fail_code=255,
+                 recovery=False, other_devices=3, product_types=("iPhone12,1", "iPhone13,2"),
+                 query_seconds=0.0, missing_options=(), directory=None):
+        self.config = {
+            'devices': devices, 'lines': lines, 'line_rate': line_rate,
+            'restore_seconds': restore_seconds, 'fail_every': fail_every,
+            'fail_message': fail_message, 'fail_code': fail_code,
+            'recovery': recovery, 'other_devices': other_devices,
+            'product_types': list(product_types), 'query_seconds': query_seconds,
+            'missing_options': list(missing_options),
+        }
+        self.directory = directory
+        self._owns_directory = directory is None
+        self._old_path = None
+
+    def __enter__(self):
+        if self.directory is None:
+            self.directory = tempfile.mkdtemp(prefix="fake-tools-")
+        config_path = os.path.join(self.directory, "config.json")
+        with open(config_path, 'w') as f:
+            json.dump(self.config, f)
+
+        prelude = (PRELUDE.format(python=sys.executable, config=config_path) +
+                   f"BOARDS = {BOARDS!r}\n")
+        for name, body in (('lsusb', FAKE_LSUSB), ('idevice_id', FAKE_IDEVICE_ID),
+                           ('ideviceinfo', FAKE_IDEVICEINFO), ('irecovery', FAKE_IRECOVERY),
+                           ('idevicerestore', FAKE_IDEVICERESTORE)):
+            path = os.path.join(self.directory, name)
+            with open(path, 'w') as f:
+                f.write(prelude + body)
+            os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+
+        self._old_path = os.environ.get('PATH', '')
+        os.environ['PATH'] = self.directory + os.pathsep + self._old_path
+        return self
+
+    def __exit__(self, *exc):
+        os.environ['PATH'] = self._old_path
+        if self._owns_directory:
+            shutil.rmtree(self.directory, ignore_errors=True)
+            self.directory = None
+
+    def tool(self, name):
+        return os.path.join(self.directory, name)
+
+
+def make_sysfs(root, devices=4, other_devices=3, recovery=False):
+    """Build a fake /sys/bus/usb/devices tree with Apple and other devices"""
+    os.makedirs(root, exist_ok=True)
+
+    def add(port, attributes):
+        path = os.path.join(root, port)
+        os.makedirs(path, exist_ok=True)
+        os.makedirs(path + ":1.0", exist_ok=True)
+        for name, value in attributes.items():
+            with open(os.path.join(path, name), 'w') as f:
+                f.write(f"{value}\n")
+
+    for bus in range(1, (devices + other_devices) // 8 + 2):
+        os.makedirs(os.path.join(root, f"usb{bus}"), exist_ok=True)
+
+    for i in range(devices):
+        bus, port = i // 8 + 1, i % 8 + 1
+        if recovery and i % 2:
+            product, serial = '1281', f"CPID:8030 CPRV:20 BDID:0C ECID:{i:016X} IBFL:3C"
+        else:
+            product, serial = '12a8', fake_udid(i).replace('-', '')
+        add(f"{bus}-{port}", {'idVendor': '05ac', 'idProduct': product, 'serial': serial,
+                              'busnum': bus, 'devnum': i + 2})
+    for i in range(other_devices):
+        add(f"{i // 8 + 1}-{i % 8 + 1}.4", {'idVendor': '046d', 'idProduct': 'c52b',
+                                             'busnum': i // 8 + 1, 'devnum': i + 100})
+    return root
+
+
+def make_hub_sysfs(root, controllers=2, buses_per_controller=2, hubs_per_bus=1, devices_per_hub=4):
+    """Build a fake sysfs tree of phones behind hubs, with root hubs linked to PCI controllers
+
+    Like /sys/bus/usb/devices, each usbN is a symlink into the device tree, so
+    the two root hubs of one controller resolve to the same parent.
+    """
+    os.makedirs(root, exist_ok=True)
+    pci = os.path.join(os.path.dirname(os.path.abspath(root)), "devices", "pci0000:00")
+    bus = 0
+    i = 0
+    for controller in range(controllers):
+        for _ in range(buses_per_controller):
+            bus += 1
+            target = os.path.join(pci, f"0000:00:{0x14 + controller:02x}.0", f"usb{bus}")
+            os.makedirs(target, exist_ok=True)
+            os.symlink(target, os.path.join(root, f"usb{bus}"))
+            for hub in range(1, hubs_per_bus + 1):
+                # The hub itself, a Genesys Logic USB 2.0 hub
+                hub_path = os.path.join(root, f"{bus}-{hub}")
+                os.makedirs(hub_path, exist_ok=True)
+                for name, value in (('idVendor', '05e3'), ('idProduct', '0610'),
+                                    ('busnum', bus), ('devnum', 1 + hub)):
+                    with open(os.path.join(hub_path, name), 'w') as f:
+                        f.write(f"{value}\n")
+                for slot in range(1, devices_per_hub + 1):
+                    path = os.path.join(root, f"{bus}-{hub}.{slot}")
+                    os.makedirs(path, exist_ok=True)
+                    attributes = {'idVendor': '05ac', 'idProduct': '12a8', 'busnum': bus,
+                                  'devnum': i + 10, 'serial': fake_udid(i).replace('-', '')}
+                    for name, value in attributes.items():
+                        with open(os.path.join(path, name), 'w') as f:
+                            f.write(f"{value}\n")
+                    i += 1
+    return root
+
+
+def make_ipsw_library(directory, count=500, product_types=("iPhone12,1", "iPhone13,2")):
+    """Write `count` small but well-formed IPSW archives"""
+    os.makedirs(directory, exist_ok=True)
+    for i in range(count):
+        path = os.path.join(directory, f"iPhone_Fake_{17 + i % 3}.{i % 7}_{21000 + i}_Restore.ipsw")
+        product_type = product_types[i % len(product_types)]
+        identities = []
+        if product_type in BOARDS:
+            chip_id, board_id, device_class = BOARDS[product_type]
+            identities = [{'ApChipID': f"0x{chip_id:04X}", 'ApBoardID': f"0x{board_id:02X}",
+                           'Info': {'DeviceClass': device_class, 'Variant': variant}}
+                          for variant in ("Customer Erase Install (IPSW)",
+                                          "Customer Upgrade Install (IPSW)")]
+        manifest = {
+            'ProductVersion': f"{17 + i % 3}.{i % 7}",
+            'ProductBuildVersion': f"{21 + i % 3}A{i}",
+            'SupportedProductTypes': [product_type],
+            'BuildIdentities': identities,
+        }
+        with zipfile.ZipFile(path, 'w') as archive:
+            archive.writestr('BuildManifest.plist', plistlib.dumps(manifest))
+            archive.writestr('Restore.plist', b'')
+    return directory
@@ -0,0 +1,355 @@
+#!/usr/bin/env python3
+"""
+Benchmark Harness
+Runs every benchmark against fake device tools and prints one JSON document
+
+    python3 benchmarks/run_benchmarks.py --output baseline.json
+    python3 benchmarks/run_benchmarks.py --baseline baseline.json --fail-on-regression
+
+Metrics ending in _per_second are higher-is-better, every other timing
+(_us, _ms, _seconds, _ns_per_byte) is lower-is-better.
+"""
+
+import argparse
+import glob
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+import bench_fleet_view
+import bench_inventory
+import bench_ipsw_fetch
+import bench_log_pipeline
+import bench_log_store
+import bench_output_parser
+import bench_preflight
+import bench_startup
+import bench_usb_topology
+import restore_engine
+from fake_tools import FakeToolchain, make_sysfs, make_ipsw_library
+from ipsw_catalog import IPSWCatalog
+from job_journal import JobJournal, SUCCEEDED
+from restore_batch import device_selector, run_jobs
+from restore_engine import RestoreEngine
+from usb_detector import USBDetector
+
+LOWER_IS_BETTER = ('_us', '_ms', '_seconds', '_ns_per_byte')
+
+
+def percentiles(samples, scale=1e6):
+    """mean / p50 / p95 of a list of seconds, in microseconds by default"""
+    samples = sorted(samples)
+    p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+    return (round(statistics.mean(samples) * scale, 1), round(samples[len(samples) // 2] * scale, 1),
+            round(p95 * scale, 1))
+
+
+def timed(func, iterations):
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def bench_detection(workdir, devices=8, iterations=2000, lsusb_iterations=50):
+    """lsusb fork-and-parse (the old check_device_status) against the sysfs scanner"""
+    root = make_sysfs(os.path.join(workdir, "sysfs"), devices=devices, recovery=True)
+
+    def lsusb_check():
+        result = subprocess.run(['lsusb'], capture_output=True, text=True, timeout=10)
+        return [line for line in result.stdout.split('\n')
+                if 'Apple' in line and 'Mobile Device' in line]
+
+    with FakeToolchain(devices=devices, recovery=True):
+        lsusb_mean, lsusb_p50, lsusb_p95 = percentiles(timed(lsusb_check, lsusb_iterations))
+
+    detector = USBDetector(root)
+    detector.scan()
+    warm_mean, warm_p50, warm_p95 = percentiles(timed(detector.scan, iterations))
+    cold_mean, cold_p50, cold_p95 = percentiles(
+        timed(lambda: USBDetector(root).scan(), iterations // 4))
+
+    return {
+        "devices": devices,
+        "lsusb_mean_us": lsusb_mean, "lsusb_p50_us": lsusb_p50, "lsusb_p95_us": lsusb_p95,
+        "sysfs_mean_us": warm_mean, "sysfs_p50_us": warm_p50, "sysfs_p95_us": warm_p95,
+        "sysfs_cold_mean_us": cold_mean, "sysfs_cold_p95_us": cold_p95,
+    }
+
+
+def bench_ipsw_scan(workdir, files=500, warm_iterations=10):
+    """Old glob + stat listing against cold and warm catalog rescans"""
+    library = make_ipsw_library(os.path.join(workdir, "ipsw"), files)
+
+    def glob_listing():
+        return [(path, os.stat(path).st_size) for path in glob.glob(os.path.join(library, "*.ipsw"))]
+
+    glob_mean, _, _ = percentiles(timed(glob_listing, warm_iterations), scale=1e3)
+
+    catalog = IPSWCatalog(os.path.join(workdir, "catalog.db"))
+    start = time.perf_counter()
+    catalog.scan(library)
+    cold = time.perf_counter() - start
+    warm_mean, _, warm_p95 = percentiles(timed(lambda: catalog.scan(library), warm_iterations),
+                                         scale=1e3)
+    lookup_mean, _, _ = percentiles(
+        timed(lambda: catalog.compatible("iPhone12,1"), warm_iterations), scale=1e3)
+    catalog.close()
+
+    return {
+        "files": files,
+        "glob_stat_mean_ms": glob_mean,
+        "catalog_cold_ms": round(cold * 1e3, 1),
+        "catalog_warm_mean_ms": warm_mean,
+        "catalog_warm_p95_ms": warm_p95,
+        "compatible_lookup_mean_ms": lookup_mean,
+    }
+
+
+def bench_orchestration(workdir, devices=8, lines=500, fail_every=4):
+    """Wall time of journaled parallel restores against launching the same fake restores directly"""
+    ipsw = os.path.join(workdir, "orchestration.ipsw")
+    with zipfile.ZipFile(ipsw, 'w') as archive:
+        archive.writestr('BuildManifest.plist', b'')
+    detector = USBDetector(make_sysfs(os.path.join(workdir, "orchestration-sysfs"), devices))
+    journal = JobJournal(os.path.join(workdir, "orchestration-jobs.db"), max_attempts=1)
+
+    with FakeToolchain(devices=devices, lines=lines, fail_every=fail_every) as tools:
+        # Threads in use once every session is running, should not grow with devices
+        peak_threads = [0]
+        results = []
+
+        def on_update(restore):
+            peak_threads[0] = max(peak_threads[0], threading.active_count())
+
+        engine = RestoreEngine(on_update=on_update)
+        attached = detector.scan()
+
+        start = time.perf_counter()
+        processes = [subprocess.Popen([tools.tool('idevicerestore'), '-u', device.udid, ipsw],
+                                      stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+                     for device in attached]
+        for process in processes:
+            process.communicate()
+        direct = time.perf_counter() - start
+
+        start = time.perf_counter()
+        job_ids = journal.enqueue_many([(device_selector(device), ipsw, None, None, None, None)
+                                        for device in attached])
+        restore_engine.run(run_jobs(engine, journal, job_ids, detector.scan,
+                                    lambda ipsw, sha256: None,
+                                    lambda job, device, restore, error: results.append(job),
+                                    max_concurrent=devices, poll=0.05))
+        orchestrated = time.perf_counter() - start
+
+    succeeded = sum(1 for job in results if job.state == SUCCEEDED)
+    return {
+        "devices": len(results),
+        "lines_per_device": lines,
+        "succeeded": succeeded,
+        "failed": len(results) - succeeded,
+        "direct_seconds": round(direct, 3),
+        "orchestrated_seconds": round(orchestrated, 3),
+        "overhead_per_device_ms": round((orchestrated - direct) * 1e3 / max(1, len(results)), 2),
+        "peak_threads": peak_threads[0],
+    }
+
+
+def bench_journal(workdir, jobs=500):
+    """Job journal throughput: a burst of enqueues, then start+finish of every job"""
+    journal = JobJournal(os.path.join(workdir, "jobs.db"))
+    options = {'erase': True, 'exclude_baseband': True, 'debug': False}
+
+    start = time.perf_counter()
+    job_ids = journal.enqueue_many([(f"00008030-{i:016X}", "/srv/ipsw/17.5.ipsw", options,
+                                     None, None, None) for i in range(jobs)])
+    enqueue = time.perf_counter() - start
+
+    transitions = []
+    start = time.perf_counter()
+    for i, job_id in enumerate(job_ids):
+        began = time.perf_counter()
+        journal.start(job_id)
+        # Every fourth job hits a transient USB error and is scheduled for a retry
+        errors = ["ERROR: Unable to send filesystem: USB transfer timed out"] if i % 4 == 3 else []
+        journal.finish(job_id, 255 if errors else 0, errors)
+        transitions.append(time.perf_counter() - began)
+    lifecycle = time.perf_counter() - start
+
+    start = time.perf_counter()
+    journal.recover()
+    recover = time.perf_counter() - start
+    journal.close()
+
+    mean, _, p95 = percentiles(transitions)
+    return {
+        "jobs": jobs,
+        "enqueue_per_second": round(jobs / enqueue),
+        "jobs_per_second": round(jobs / lifecycle),
+        "start_finish_mean_us": mean,
+        "start_finish_p95_us": p95,
+        "recover_ms": round(recover * 1e3, 2),
+    }
+
+
+def bench_logging(lines=200000):
+    result = bench_log_pipeline.run(lines=lines)
+    return {key: value for key, value in result.items() if key != "benchmark"}
+
+
+def bench_parser(megabytes=8):
+    result = bench_output_parser.run(bench_output_parser.synthetic_log(megabytes))
+    return {key: value for key, value in result.items() if key != "benchmark"}
+
+
+def bench_logs(sessions=500):
+    result = bench_log_store.run(sessions=sessions)
+    return {key: value for key, value in result.items() if key != "benchmark"}
+
+
+def bench_daemon(refreshes=50):
+    result = bench_inventory.run(refreshes=refreshes)
+    return {key: value for key, value in result.items() if key != "benchmark"}
+
+
+def bench_fetch(megabytes=64):
+    result = bench_ipsw_fetch.run(megabytes=megabytes)
+    return {key: value for key, value in result.items() if key != "benchmark"}
+
+
+def bench_topology():
+    result = bench_usb_topology.run()
+    return {key: value for key, value in result.items() if key != "benchmark"}
+
+
+def bench_launch(launches=10):
+    result = bench_startup.run(launches=launches)
+    return {key: value for key, value in result.items() if key != "benchmark"}
+
+
+def bench_fleet(devices=50, seconds=3.0):
+    result = bench_fleet_view.run(devices=devices, seconds=seconds)
+    return {key: value for key, value in result.items() if key != "benchmark"}
+
+
+def bench_compatibility(devices=16):
+    result = bench_preflight.run(devices=devices)
+    return {key: value for key, value in result.items() if key != "benchmark"}
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BENCH_DIR,
+                              capture_output=True, text=True, timeout=10).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run(selected=None, quick=False):
+    workdir = tempfile.mkdtemp(prefix="iphone-bench-")
+    scale = 0.1 if quick else 1.0
+    benchmarks = {
+        "detection": lambda: bench_detection(workdir, iterations=int(2000 * scale) or 10,
+                                             lsusb_iterations=int(50 * scale) or 5),
+        "logging": lambda: bench_logging(lines=int(200000 * scale)),
+        "parser": lambda: bench_parser(megabytes=max(1, int(8 * scale))),
+        "ipsw_scan": lambda: bench_ipsw_scan(workdir, files=int(500 * scale) or 10),
+        "orchestration": lambda: bench_orchestration(workdir, lines=int(500 * scale) or 10),
+        "journal": lambda: bench_journal(workdir, jobs=int(500 * scale) or 10),
+        "topology": bench_topology,
+        "log_store": lambda: bench_logs(sessions=int(500 * scale) or 10),
+        "inventory": lambda: bench_daemon(refreshes=int(50 * scale) or 5),
+        "fetch": lambda: bench_fetch(megabytes=max(16, int(64 * scale))),
+        "fleet_view": lambda: bench_fleet(seconds=max(1.0, 3.0 * scale)),
+        "preflight": lambda: bench_compatibility(devices=max(4, int(16 * scale))),
+        "startup": lambda: bench_launch(launches=max(3, int(10 * scale))),
+    }
+    results = {}
+    try:
+        for name, bench in benchmarks.items():
+            if selected and name not in selected:
+                continue
+            print(f"running {name}...", file=sys.stderr)
+            results[name] = bench()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        "meta": {
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "quick": quick,
+            "timestamp": round(time.time()),
+        },
+        "results": results,
+    }
+
+
+def compare(current, baseline, tolerance):
+    """Return [(metric, baseline, current, change, regressed)] for shared numeric metrics"""
+    rows = []
+    for name, metrics in current["results"].items():
+        for key, value in metrics.items():
+            old = baseline.get("results", {}).get(name, {}).get(key)
+            if not isinstance(value, (int, float)) or not isinstance(old, (int, float)) or not old:
+                continue
+            if key.endswith('_per_second'):
+                change = (value - old) / old
+                regressed = change < -tolerance
+            elif key.endswith(LOWER_IS_BETTER):
+                change = (value - old) / old
+                regressed = change > tolerance
+            else:
+                continue
+            rows.append((f"{name}.{key}", old, value, change, regressed))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--only', action='append', help="run only this benchmark (repeatable)")
+    parser.add_argument('--quick', action='store_true', help="smaller workloads")
+    parser.add_argument('--output', help="write the JSON results to this file")
+    parser.add_argument('--baseline', help="compare against an earlier results file")
+    parser.add_argument('--tolerance', type=float, default=0.10,
+                        help="relative change treated as a regression (default 0.10)")
+    parser.add_argument('--fail-on-regression', action='store_true')
+    args = parser.parse_args()
+
+    current = run(args.only, args.quick)
+    text = json.dumps(current, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        rows = compare(current, baseline, args.tolerance)
+        for metric, old, new, change, regressed in rows:
+            mark = "REGRESSION" if regressed else ""
+            print(f"{metric:45} {old:>12} -> {new:<12} {change:+7.1%} {mark}", file=sys.stderr)
+        if args.fail_on_regression and any(row[4] for row in rows):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+Device Info
+Thin wrappers around the libimobiledevice query tools
+"""
+
+import subprocess
+
+
+def _run(cmd, timeout=10):
+    """stdout of a successful run, or None"""
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True, timeout=timeout)
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    if result.returncode != 0:
+        return None
+    return result.stdout
+
+
+def parse_fields(text):
+    """Parse "Key: Value" lines (ideviceinfo, irecovery -q) into a dict"""
+    fields = {}
+    for line in text.splitlines():
+        key, sep, value = line.partition(':')
+        if sep and key.strip() and not key.startswith(' '):
+            fields[key.strip()] = value.strip()
+    return fields
+
+
+def get_product_type(udid=None, ideviceinfo_cmd='ideviceinfo'):
+    """Return the ProductType (e.g. "iPhone12,1") of a normal-mode device, or None"""
+    cmd = [ideviceinfo_cmd, '-k', 'ProductType']
+    if udid:
+        cmd += ['-u', udid]
+    stdout = _run(cmd)
+    product_type = stdout.strip() if stdout else None
+    return product_type or None
+
+
+def query_device(udid=None, ideviceinfo_cmd='ideviceinfo'):
+    """ideviceinfo values (ProductType, HardwareModel, ChipID, ...) of a device, or None"""
+    cmd = [ideviceinfo_cmd]
+    if udid:
+        cmd += ['-u', udid]
+    stdout = _run(cmd)
+    return parse_fields(stdout) if stdout else None
+
+
+def query_recovery(ecid=None, irecovery_cmd='irecovery'):
+    """irecovery -q fields (CPID, BDID, MODEL, ...) of a recovery/DFU device, or None"""
+    cmd = [irecovery_cmd, '-q']
+    if ecid:
+        cmd += ['-i', f"0x{ecid}" if not ecid.lower().startswith('0x') else ecid]
+    stdout = _run(cmd)
+    return parse_fields(stdout) if stdout else None
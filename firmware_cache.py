@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+"""
+Firmware Cache
+Content-addressed store of extracted IPSW members, shared by every restore
+
+Each IPSW is unpacked once: members are stored under objects/ by SHA-256 and
+hard-linked into a per-IPSW checkout directory, which idevicerestore accepts
+in place of the .ipsw file. Checkouts are leased while a restore runs and
+the least recently used unleased ones are evicted to stay under the budget.
+"""
+
+import contextlib
+import fcntl
+import hashlib
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+from job_journal import pid_alive
+
+DEFAULT_CACHE_DIR = os.environ.get(
+    "IPHONE_MANAGER_FIRMWARE_CACHE",
+    os.path.expanduser("~/.cache/iphone_firmware_manager/firmware"))
+
+# Disk budget in GiB, 0 disables the cache
+DEFAULT_BUDGET = int(float(os.environ.get("IPHONE_MANAGER_FIRMWARE_CACHE_GB", "40")) * 2**30)
+
+READ_SIZE = 4 * 1024 * 1024
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS object (
+    digest TEXT PRIMARY KEY,
+    size INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS checkout (
+    key TEXT PRIMARY KEY,
+    ipsw_path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS checkout_object (
+    key TEXT NOT NULL REFERENCES checkout(key) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    PRIMARY KEY (key, name)
+);
+CREATE INDEX IF NOT EXISTS checkout_object_digest ON checkout_object(digest);
+CREATE TABLE IF NOT EXISTS lease (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    key TEXT NOT NULL,
+    pid INTEGER NOT NULL
+);
+"""
+
+
+class FirmwareCheckout:
+    """A leased firmware directory (or the IPSW itself when the cache was bypassed)
+
+    Use as a context manager, or call release() when the restore is done.
+    """
+
+    def __init__(self, cache, ipsw_file, path, key=None, lease_id=None, hit=False, reason=None):
+        self.cache = cache
+        self.ipsw_file = ipsw_file
+        self.path = path
+        self.key = key
+        self.hit = hit
+        self.reason = reason
+        self._lease_id = lease_id
+
+    @property
+    def cached(self):
+        return self.key is not None
+
+    @property
+    def description(self):
+        if not self.cached:
+            return f"using the IPSW directly ({self.reason})"
+        if self.hit:
+            return "using cached firmware components"
+        return "firmware components extracted to the cache"
+
+    def release(self):
+        if self._lease_id is not None:
+            self.cache._release(self.key, self._lease_id)
+            self._lease_id = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class FirmwareCache:
+    """Extract IPSW members once and lease the result to concurrent restores"""
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, budget=DEFAULT_BUDGET, workers=None):
+        self.cache_dir = cache_dir
+        self.budget = budget
+        self.workers = workers or os.cpu_count() or 1
+        self.objects_dir = os.path.join(cache_dir, "objects")
+        self.checkouts_dir = os.path.join(cache_dir, "checkouts")
+        self.tmp_dir = os.path.join(cache_dir, "tmp")
+        for directory in (self.objects_dir, self.checkouts_dir, self.tmp_dir):
+            os.makedirs(directory, exist_ok=True)
+
+        self.db = sqlite3.connect(os.path.join(cache_dir, "cache.db"), check_same_thread=False,
+                                  timeout=30)
+        self.db.execute("PRAGMA foreign_keys = ON")
+        self._lock = threading.Lock()
+        self._lock_file = open(os.path.join(cache_dir, "lock"), 'a')
+        with self._locked(), self.db:
+            self.db.executescript(SCHEMA)
+            self._prune_leases()
+
+    def close(self):
+        self.db.close()
+        self._lock_file.close()
+
+    @contextlib.contextmanager
+    def _locked(self):
+        """Serialise against other threads and other manager processes"""
+        with self._lock:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    @staticmethod
+    def key(st):
+        return f"{st.st_dev:x}-{st.st_ino:x}-{st.st_size:x}-{st.st_mtime_ns:x}"
+
+    def object_path(self, digest):
+        return os.path.join(self.objects_dir, digest[:2], digest[2:])
+
+    def checkout_path(self, key):
+        return os.path.join(self.checkouts_dir, key)
+
+    def usage(self):
+        """Bytes held by stored objects"""
+        with self._lock:
+            return self.db.execute("SELECT COALESCE(SUM(size), 0) FROM object").fetchone()[0]
+
+    def checkout(self, ipsw_file, on_progress=None):
+        """Return a leased FirmwareCheckout whose path can be passed to idevicerestore
+
+        Extracts the IPSW on first use. on_progress(done_bytes, total_bytes)
+        is called from worker threads as members are stored. Falls back to
+        the IPSW itself when the cache is disabled, the firmware does not fit
+        the budget or extraction fails.
+        """
+        if self.budget <= 0:
+            return FirmwareCheckout(self, ipsw_file, ipsw_file, reason="cache disabled")
+
+        try:
+            st = os.stat(ipsw_file)
+        except OSError as e:
+            # Deleted since it was queued: idevicerestore reports the missing file
+            return FirmwareCheckout(self, ipsw_file, ipsw_file, reason=f"extraction failed: {e}")
+        key = self.key(st)
+        path = self.checkout_path(key)
+        checkout = self._lease_existing(ipsw_file, key)
+        if checkout:
+            return checkout
+
+        # Only restores of this IPSW wait for its extraction, the cache lock is not held
+        with self._extracting(key):
+            checkout = self._lease_existing(ipsw_file, key)
+            if checkout:
+                return checkout
+            try:
+                with zipfile.ZipFile(ipsw_file) as archive:
+                    members = [info for info in archive.infolist() if not info.is_dir()]
+                for info in members:
+                    name = os.path.normpath(info.filename)
+                    if os.path.isabs(name) or name.startswith('..'):
+                        raise zipfile.BadZipFile(f"unsafe member name {info.filename!r}")
+                total = sum(info.file_size for info in members)
+                if total > self.budget:
+                    return FirmwareCheckout(self, ipsw_file, ipsw_file,
+                                            reason="firmware is larger than the cache budget")
+                with self._locked():
+                    self._evict(total)
+                if shutil.disk_usage(self.cache_dir).free < total:
+                    return FirmwareCheckout(self, ipsw_file, ipsw_file,
+                                            reason="not enough free disk space")
+                staging, stored = self._extract(ipsw_file, key, members, total, on_progress)
+            except (OSError, zipfile.BadZipFile) as e:
+                return FirmwareCheckout(self, ipsw_file, ipsw_file, reason=f"extraction failed: {e}")
+
+            with self._locked():
+                try:
+                    self._install(ipsw_file, key, staging, stored, total)
+                except OSError as e:
+                    shutil.rmtree(staging, ignore_errors=True)
+                    return FirmwareCheckout(self, ipsw_file, ipsw_file,
+                                            reason=f"extraction failed: {e}")
+                with self.db:
+                    lease_id = self._lease(key)
+            return FirmwareCheckout(self, ipsw_file, path, key, lease_id)
+
+    def _lease_existing(self, ipsw_file, key):
+        """Lease a complete checkout of key, None if there is none"""
+        path = self.checkout_path(key)
+        with self._locked(), self.db:
+            row = self.db.execute("SELECT 1 FROM checkout WHERE key = ?", (key,)).fetchone()
+            if row and os.path.isdir(path):
+                lease_id = self._lease(key)
+                return FirmwareCheckout(self, ipsw_file, path, key, lease_id, hit=True)
+            if row:
+                self._drop_checkout(key)
+        return None
+
+    @contextlib.contextmanager
+    def _extracting(self, key):
+        """Claim the extraction of key against other threads and processes"""
+        with open(os.path.join(self.tmp_dir, f"{key}.lock"), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _install(self, ipsw_file, key, staging, stored, total):
+        """Move an extracted checkout into place and record it; call with the lock held"""
+        # A directory without a row is left over from a crash
+        shutil.rmtree(self.checkout_path(key), ignore_errors=True)
+        os.replace(staging, self.checkout_path(key))
+        for name, digest, _ in stored:
+            # An eviction while extracting may have removed a shared object
+            target = self.object_path(digest)
+            if not os.path.exists(target):
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                os.link(os.path.join(self.checkout_path(key), name), target)
+        with self.db:
+            self.db.executemany("INSERT OR IGNORE INTO object VALUES (?, ?)",
+                                [(digest, size) for _, digest, size in stored])
+            self.db.execute("INSERT OR REPLACE INTO checkout VALUES (?, ?, ?, ?)",
+                            (key, ipsw_file, total, time.time()))
+            self.db.executemany("INSERT INTO checkout_object VALUES (?, ?, ?)",
+                                [(key, name, digest) for name, digest, _ in stored])
+
+    def _extract(self, ipsw_file, key, members, total, on_progress):
+        """Store members and link them into a staging directory, return (staging, stored)"""
+        staging = os.path.join(self.tmp_dir, f"{key}.{os.getpid()}")
+        shutil.rmtree(staging, ignore_errors=True)
+        os.makedirs(staging)
+        done = [0]
+        progress_lock = threading.Lock()
+
+        def store(info):
+            # Each worker opens its own handle, zlib and hashlib release the GIL
+            digest = hashlib.sha256()
+            tmp_path = os.path.join(self.tmp_dir, f"{key}.{os.getpid()}.{threading.get_ident()}")
+            with zipfile.ZipFile(ipsw_file) as archive, \
+                    archive.open(info) as src, open(tmp_path, 'wb') as dst:
+                while True:
+                    block = src.read(READ_SIZE)
+                    if not block:
+                        break
+                    digest.update(block)
+                    dst.write(block)
+            digest = digest.hexdigest()
+            target = self.object_path(digest)
+            if os.path.exists(target):
+                os.unlink(tmp_path)
+            else:
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                os.chmod(tmp_path, 0o444)
+                os.replace(tmp_path, target)
+
+            link = os.path.join(staging, info.filename)
+            os.makedirs(os.path.dirname(link), exist_ok=True)
+            try:
+                os.link(target, link)
+            except OSError:
+                os.symlink(target, link)
+            if on_progress:
+                with progress_lock:
+                    done[0] += info.file_size
+                    on_progress(done[0], total)
+            return info.filename, digest, info.file_size
+
+        try:
+            # Largest first so the root filesystem image does not start last
+            members = sorted(members, key=lambda info: info.file_size, reverse=True)
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                stored = list(pool.map(store, members))
+        except BaseException:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+        return staging, stored
+
+    def _lease(self, key):
+        self.db.execute("UPDATE checkout SET last_used = ? WHERE key = ?", (time.time(), key))
+        return self.db.execute("INSERT INTO lease (key, pid) VALUES (?, ?)",
+                               (key, os.getpid())).lastrowid
+
+    def _release(self, key, lease_id):
+        with self._lock, self.db:
+            self.db.execute("DELETE FROM lease WHERE id = ?", (lease_id,))
+            self.db.execute("UPDATE checkout SET last_used = ? WHERE key = ?", (time.time(), key))
+
+    def _prune_leases(self):
+        """Forget leases of processes that died mid-restore"""
+        for lease_id, pid in self.db.execute("SELECT id, pid FROM lease").fetchall():
+            if not pid_alive(pid):
+                self.db.execute("DELETE FROM lease WHERE id = ?", (lease_id,))
+
+    def _evict(self, needed):
+        """Drop unleased checkouts, least recently used first, until `needed` more bytes fit"""
+        with self.db:
+            self._prune_leases()
+            usage = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM object").fetchone()[0]
+            candidates = self.db.execute(
+                "SELECT key FROM checkout WHERE key NOT IN (SELECT key FROM lease) "
+                "ORDER BY last_used").fetchall()
+            for (key,) in candidates:
+                if usage + needed <= self.budget:
+                    break
+                usage -= self._drop_checkout(key)
+
+    def _drop_checkout(self, key):
+        """Remove a checkout and every object no other checkout uses, return bytes freed"""
+        shutil.rmtree(self.checkout_path(key), ignore_errors=True)
+        orphans = self.db.execute(
+            "SELECT digest, size FROM object WHERE digest IN "
+            "(SELECT digest FROM checkout_object WHERE key = ?) AND digest NOT IN "
+            "(SELECT digest FROM checkout_object WHERE key != ?)", (key, key)).fetchall()
+        self.db.execute("DELETE FROM checkout WHERE key = ?", (key,))
+        freed = 0
+        for digest, size in orphans:
+            try:
+                os.unlink(self.object_path(digest))
+            except FileNotFoundError:
+                pass
+            self.db.execute("DELETE FROM object WHERE digest = ?", (digest,))
+            freed += size
+        return freed
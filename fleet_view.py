@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+"""
+Fleet View
+One Treeview row per device (mode, status, phase, progress, elapsed time and
+last error), updated in batches at a capped frame rate
+"""
+
+import math
+import queue
+import threading
+import time
+import tkinter as tk
+from tkinter import ttk, scrolledtext
+
+COLUMNS = (
+    ('device', "Device", 190),
+    ('mode', "Mode", 80),
+    ('status', "Status", 110),
+    ('phase', "Phase", 100),
+    ('percent', "%", 50),
+    ('elapsed', "Elapsed", 65),
+    ('error', "Last error", 260),
+)
+
+MAX_ERROR_CHARS = 120
+
+
+def format_elapsed(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes}:{seconds:02d}"
+
+
+class FleetModel:
+    """Rows keyed by device; update() from any thread, flush() from the UI thread
+
+    Updates are merged per device until the next flush, so a device that
+    reports progress a thousand times between two frames costs one row
+    change. flush() returns only rows whose visible values changed.
+    """
+
+    def __init__(self):
+        self.rows = {}
+        self.order = []
+        self.updates = 0
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._removed = set()
+        # Rows to recompute: changed fields, or left off screen at a flush
+        self._dirty = set()
+        self._shown = {}
+
+    def update(self, key, **fields):
+        """Merge fields into the row of key (creating it); safe to call from any thread"""
+        with self._lock:
+            self.updates += 1
+            self._removed.discard(key)
+            pending = self._pending.get(key)
+            if pending is None:
+                self._pending[key] = fields
+            else:
+                pending.update(fields)
+
+    def remove(self, key):
+        with self._lock:
+            self._pending.pop(key, None)
+            self._removed.add(key)
+
+    def sync(self, devices):
+        """Show every detected device; rows of gone devices stay while they restore"""
+        present = set()
+        for device in devices:
+            present.add(device.identifier)
+            self.update(device.identifier, mode=device.mode)
+        for key in list(self.rows):
+            if key not in present and not self.rows[key].get('active'):
+                self.remove(key)
+
+    @property
+    def stale(self):
+        """True if rows are waiting to scroll into view"""
+        return bool(self._dirty)
+
+    def values(self, key, now):
+        row = self.rows[key]
+        percent = row.get('percent')
+        started = row.get('started')
+        finished = row.get('finished')
+        elapsed = None if started is None else (now if finished is None else finished) - started
+        error = row.get('error') or ""
+        return (key, row.get('mode') or "", row.get('status') or "", row.get('phase') or "",
+                f"{percent:.0f}%" if percent is not None else "",
+                format_elapsed(elapsed) if elapsed is not None else "",
+                error[:MAX_ERROR_CHARS])
+
+    def flush(self, now=None, visible=None):
+        """Apply merged updates, return (changed, added, removed)
+
+        changed and added are [(key, values)], removed is [key]. With
+        visible=(first, last), changed rows outside that index range are
+        kept dirty until they are in view.
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            removed, self._removed = self._removed, set()
+
+        removed = [key for key in removed if key in self.rows]
+        for key in removed:
+            del self.rows[key]
+            self._shown.pop(key, None)
+            self._dirty.discard(key)
+        if removed:
+            gone = set(removed)
+            self.order = [key for key in self.order if key not in gone]
+
+        added = []
+        for key, fields in pending.items():
+            row = self.rows.get(key)
+            if row is None:
+                self.rows[key] = dict(fields)
+                self.order.append(key)
+                added.append(key)
+            else:
+                row.update(fields)
+                self._dirty.add(key)
+
+        # Elapsed time keeps changing while a restore runs
+        self._dirty.update(key for key, row in self.rows.items()
+                           if row.get('started') is not None and row.get('finished') is None)
+        if visible is not None and self._dirty:
+            first, last = visible
+            in_view = set(self.order[first:last + 1])
+            candidates = self._dirty & in_view
+        else:
+            candidates = set(self._dirty)
+        self._dirty -= candidates
+
+        changed = []
+        for key in candidates:
+            values = self.values(key, now)
+            if values != self._shown.get(key):
+                self._shown[key] = values
+                changed.append((key, values))
+        new_rows = []
+        for key in added:
+            self._shown[key] = self.values(key, now)
+            new_rows.append((key, self._shown[key]))
+        return changed, new_rows, removed
+
+
+class FleetView:
+    """Treeview over a FleetModel plus the log of the selected device
+
+    The tree is refreshed at most fps times a second and rows scrolled out
+    of view are only updated once they are visible again. The log of a
+    device is read by load_log(key) on a worker thread when its row is
+    selected; live lines arrive through line() meanwhile.
+    """
+
+    def __init__(self, parent, root, load_log=None, fps=10, log_lines=1000):
+        self.root = root
+        self.model = FleetModel()
+        self.load_log = load_log
+        self.interval_ms = max(1, int(1000 / fps))
+        self.log_lines = log_lines
+        self.frames = 0
+        self._selected = None
+        self._loading = False
+        self._lines = queue.SimpleQueue()
+        self._after_id = None
+
+        self.frame = ttk.Frame(parent)
+        self.frame.columnconfigure(0, weight=1)
+        self.frame.rowconfigure(0, weight=1)
+        self.tree = ttk.Treeview(self.frame, columns=[name for name, _, _ in COLUMNS],
+                                 show='headings', selectmode='browse', height=8)
+        for name, heading, width in COLUMNS:
+            self.tree.heading(name, text=heading)
+            self.tree.column(name, width=width, stretch=name == 'error')
+        self.tree.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
+        self.scrollbar = ttk.Scrollbar(self.frame, orient=tk.VERTICAL, command=self.tree.yview)
+        self.scrollbar.grid(row=0, column=1, sticky=(tk.N, tk.S))
+        self.tree.configure(yscrollcommand=self.on_scroll)
+        self.tree.bind('<<TreeviewSelect>>', self.on_select)
+
+        self.log_text = scrolledtext.ScrolledText(self.frame, height=8, wrap=tk.NONE)
+        self.log_text.grid(row=1, column=0, columnspan=2, sticky=(tk.W, tk.E), pady=(5, 0))
+
+    def update(self, key, **fields):
+        """Queue a row change, safe to call from any thread"""
+        self.model.update(key, **fields)
+
+    def line(self, key, text):
+        """Queue a live output line; only lines of the selected device are kept"""
+        if key == self._selected:
+            self._lines.put((key, text))
+
+    def start(self):
+        if self._after_id is None:
+            self._after_id = self.root.after(self.interval_ms, self._tick)
+
+    def stop(self):
+        if self._after_id is not None:
+            self.root.after_cancel(self._after_id)
+            self._after_id = None
+
+    def _tick(self):
+        self.apply()
+        self._after_id = self.root.after(self.interval_ms, self._tick)
+
+    def visible_range(self):
+        """Indexes of the first and last row in view"""
+        first, last = self.tree.yview()
+        count = len(self.model.order)
+        return int(first * count), math.ceil(last * count)
+
+    def apply(self):
+        """Move queued changes to the widgets, return the number of rows touched"""
+        self.frames += 1
+        changed, added, removed = self.model.flush(visible=self.visible_range())
+        for key in removed:
+            self.tree.delete(key)
+        for key, values in added:
+            self.tree.insert('', 'end', iid=key, values=values)
+        for key, values in changed:
+            self.tree.item(key, values=values)
+        self._drain_lines()
+        return len(changed) + len(added) + len(removed)
+
+    def on_scroll(self, first, last):
+        self.scrollbar.set(first, last)
+        # Rows that just came into view may be stale
+        if self.model.stale and self._after_id is not None:
+            self.root.after_idle(self.apply)
+
+    def on_select(self, event=None):
+        selection = self.tree.selection()
+        key = selection[0] if selection else None
+        if key == self._selected:
+            return
+        self._selected = key
+        self.log_text.delete('1.0', 'end')
+        self._lines = queue.SimpleQueue()
+        if key and self.load_log:
+            # Live lines wait in the queue until the loaded log is shown
+            self._loading = True
+            self.log_text.insert('end', "Loading log...\n")
+            threading.Thread(target=self._load, args=(key,), daemon=True).start()
+
+    def _load(self, key):
+        try:
+            lines = self.load_log(key)[-self.log_lines:]
+        except Exception as e:
+            lines = [f"Could not load the log: {e}"]
+        self.root.after(0, self._show_log, key, lines)
+
+    def _show_log(self, key, lines):
+        if key != self._selected:
+            return
+        self._loading = False
+        self.log_text.delete('1.0', 'end')
+        if lines:
+            self.log_text.insert('end', '\n'.join(lines) + '\n')
+        self.log_text.see('end')
+
+    def _drain_lines(self):
+        if self._loading:
+            return
+        lines = []
+        try:
+            while True:
+                key, text = self._lines.get_nowait()
+                if key == self._selected:
+                    lines.append(text)
+        except queue.Empty:
+            pass
+        if not lines:
+            return
+        self.log_text.insert('end', '\n'.join(lines[-self.log_lines:]) + '\n')
+        excess = int(self.log_text.index('end-1c').split('.')[0]) - 1 - self.log_lines
+        if excess > 0:
+            self.log_text.delete('1.0', f'{excess + 1}.0')
+        self.log_text.see('end')
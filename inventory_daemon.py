@@ -0,0 +1,481 @@
+#!/usr/bin/env python3
+"""
+Inventory Daemon
+One process per host owns device discovery and serves the device list, with
+the current restore job of each device, to every front-end over a Unix socket
+
+    python3 inventory_daemon.py [--socket PATH] [--idle-exit SECONDS]
+
+The protocol is JSON lines. Requests are {"op": ...}:
+
+    snapshot   the current device list
+    refresh    rescan now (concurrent refreshes share one scan) and reply
+               with the device list
+    subscribe  reply with the device list, then again on every change
+    stats      clients, subscribers and scans so far
+
+Replies are {"type": "snapshot", "seq": N, "devices": [...]}, or
+{"type": "error", "error": "..."}. The daemon scans on hotplug events, on
+refresh requests (at most once per MIN_REFRESH_INTERVAL) and, without a
+hotplug source, every POLL_INTERVAL seconds; never once per client.
+
+Front-ends call connect_watcher(), which starts the daemon if needed and
+returns a HotplugWatcher fed by it, or a local HotplugWatcher if the daemon
+cannot be reached.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+from job_journal import JobJournal, ACTIVE_STATES, RUNNING
+from usb_detector import SYSFS_USB_DEVICES, USBDetector, USBDevice
+from usb_watcher import HotplugWatcher, PipeEventSource, default_event_source
+
+DEFAULT_SOCKET = os.environ.get(
+    "IPHONE_MANAGER_INVENTORY_SOCKET",
+    os.path.expanduser("~/.cache/iphone_firmware_manager/inventory.sock"))
+
+MIN_REFRESH_INTERVAL = 0.25
+POLL_INTERVAL = 2.0
+# Seconds between reads of the job journal
+JOB_INTERVAL = 2.0
+# A subscriber this far behind is disconnected instead of buffered
+MAX_CLIENT_BUFFER = 1024 * 1024
+# A daemon started by a front-end exits after this long without clients
+SPAWN_IDLE_EXIT = 600.0
+
+
+def device_record(device, job=None):
+    return {'port': device.port, 'busnum': device.busnum, 'devnum': device.devnum,
+            'product_id': device.product_id, 'serial': device.serial, 'mode': device.mode,
+            'udid': device.udid, 'ecid': device.ecid, 'identifier': device.identifier,
+            'job': job}
+
+
+def device_from_record(record):
+    """USBDevice for a device_record(), with its current job as .job"""
+    device = USBDevice(record['port'], record['busnum'], record['devnum'], record['product_id'],
+                       record['serial'])
+    device.job = record.get('job')
+    return device
+
+
+def job_record(job):
+    return {'id': job.id, 'state': job.state, 'attempts': job.attempts,
+            'max_attempts': job.max_attempts, 'ipsw': os.path.basename(job.ipsw)}
+
+
+class InventoryDaemon:
+    """asyncio Unix-socket server around one HotplugWatcher"""
+
+    def __init__(self, socket_path=DEFAULT_SOCKET, watcher=None, journal=None, idle_exit=None,
+                 min_refresh_interval=MIN_REFRESH_INTERVAL):
+        self.socket_path = socket_path
+        self.watcher = watcher or HotplugWatcher()
+        self.journal = journal
+        self.idle_exit = idle_exit
+        self.min_refresh_interval = min_refresh_interval
+        self.seq = 0
+        self.scans = 0
+        self.clients = 0
+        self.subscribers = set()
+        self.jobs = []
+        # writer -> handler task of every connected client
+        self._connections = {}
+        self._scan = None
+        self._scanned_at = 0.0
+        self._idle_since = time.monotonic()
+        self._changed = False
+        self._encoded = None
+        self._stopped = None
+        self._loop = None
+
+    def stop(self):
+        if self._stopped:
+            self._loop.call_soon_threadsafe(self._stopped.set)
+
+    async def serve(self):
+        """Serve until stop() is called or the daemon has been idle for idle_exit seconds"""
+        self._loop = asyncio.get_running_loop()
+        self._stopped = asyncio.Event()
+        _claim_socket(self.socket_path)
+
+        # Hotplug events arrive on the watcher thread, a burst is broadcast once
+        self.watcher.subscribe(lambda event: self._loop.call_soon_threadsafe(self._mark_changed))
+        try:
+            watching = await self._loop.run_in_executor(None, self.watcher.start)
+        except OSError:
+            # No USB tree (yet): serve an empty list and keep polling
+            watching = False
+        self.scans += 1
+        self._scanned_at = time.monotonic()
+        if self.journal:
+            self.jobs = await self._loop.run_in_executor(None, self.journal.jobs, ACTIVE_STATES)
+
+        server = await asyncio.start_unix_server(self._client, path=self.socket_path)
+        tasks = [asyncio.ensure_future(self._housekeeping())]
+        if not watching:
+            tasks.append(asyncio.ensure_future(self._poll()))
+        try:
+            await self._stopped.wait()
+        finally:
+            for task in tasks:
+                task.cancel()
+            server.close()
+            # Closed connections end their handlers with EOF
+            handlers = list(self._connections.values())
+            for writer in list(self._connections):
+                writer.close()
+            await asyncio.gather(*handlers, return_exceptions=True)
+            self.watcher.stop()
+            try:
+                os.unlink(self.socket_path)
+            except FileNotFoundError:
+                pass
+
+    def snapshot(self):
+        jobs = {}
+        for job in self.jobs:
+            # A running job wins over one waiting for its retry
+            for key in (job.port, job.device):
+                if key and (key not in jobs or job.state == RUNNING):
+                    jobs[key] = job
+        records = []
+        for device in self.watcher.devices:
+            job = jobs.get(device.port) or jobs.get(device.udid) or jobs.get(device.ecid)
+            records.append(device_record(device, job_record(job) if job else None))
+        return {'type': 'snapshot', 'seq': self.seq, 'devices': records}
+
+    async def refresh(self):
+        """Rescan unless a scan is running (then share it) or one just finished"""
+        if self._scan is None:
+            if time.monotonic() - self._scanned_at < self.min_refresh_interval:
+                return
+            self._scan = asyncio.ensure_future(self._rescan())
+        scan = self._scan
+        await asyncio.shield(scan)
+
+    async def _rescan(self):
+        try:
+            await self._loop.run_in_executor(None, self.watcher.refresh)
+            self.scans += 1
+            self._scanned_at = time.monotonic()
+        except OSError:
+            # Keep serving the last good device list
+            pass
+        finally:
+            self._scan = None
+
+    def _snapshot_line(self):
+        # Encoded once per change, not once per request
+        if self._encoded is None:
+            self._encoded = (json.dumps(self.snapshot()) + '\n').encode()
+        return self._encoded
+
+    def _mark_changed(self):
+        self._encoded = None
+        if not self._changed:
+            self._changed = True
+            self._loop.call_soon(self._broadcast)
+
+    def _broadcast(self):
+        self._changed = False
+        self.seq += 1
+        self._encoded = None
+        line = self._snapshot_line()
+        for writer in list(self.subscribers):
+            self._send(writer, line)
+
+    def _send(self, writer, line):
+        if writer.transport.get_write_buffer_size() > MAX_CLIENT_BUFFER:
+            self.subscribers.discard(writer)
+            writer.close()
+            return
+        writer.write(line)
+
+    async def _client(self, reader, writer):
+        self.clients += 1
+        self._connections[writer] = asyncio.current_task()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    op = json.loads(line).get('op')
+                except (ValueError, AttributeError):
+                    op = None
+                if op == 'refresh':
+                    await self.refresh()
+                if op in ('snapshot', 'refresh', 'subscribe'):
+                    reply = self._snapshot_line()
+                elif op == 'stats':
+                    reply = {'type': 'stats', 'clients': self.clients,
+                             'subscribers': len(self.subscribers), 'scans': self.scans,
+                             'seq': self.seq}
+                else:
+                    reply = {'type': 'error', 'error': f"unknown request {line[:80]!r}"}
+                if isinstance(reply, dict):
+                    reply = (json.dumps(reply) + '\n').encode()
+                self._send(writer, reply)
+                if op == 'subscribe':
+                    self.subscribers.add(writer)
+                await writer.drain()
+        except (ConnectionError, asyncio.LimitOverrunError, ValueError):
+            pass
+        finally:
+            self.clients -= 1
+            self.subscribers.discard(writer)
+            self._connections.pop(writer, None)
+            self._idle_since = time.monotonic()
+            writer.close()
+
+    async def _poll(self):
+        while True:
+            await asyncio.sleep(POLL_INTERVAL)
+            try:
+                await self.refresh()
+            except OSError:
+                pass
+
+    async def _housekeeping(self):
+        """Follow the job journal and exit when idle"""
+        while True:
+            await asyncio.sleep(JOB_INTERVAL)
+            if self.journal:
+                jobs = await self._loop.run_in_executor(None, self.journal.jobs, ACTIVE_STATES)
+                if _job_keys(jobs) != _job_keys(self.jobs):
+                    self.jobs = jobs
+                    self._mark_changed()
+            if (self.idle_exit and not self.clients and
+                    time.monotonic() - self._idle_since > self.idle_exit):
+                self._stopped.set()
+
+
+def _job_keys(jobs):
+    return [(job.id, job.state, job.attempts, job.port) for job in jobs]
+
+
+def _claim_socket(socket_path):
+    """Remove a stale socket file, raise OSError if a daemon is listening on it"""
+    os.makedirs(os.path.dirname(socket_path) or '.', exist_ok=True)
+    if not os.path.exists(socket_path):
+        return
+    try:
+        _connect(socket_path, 1.0).close()
+    except OSError:
+        os.unlink(socket_path)
+        return
+    raise OSError(f"An inventory daemon is already listening on {socket_path}")
+
+
+def _connect(socket_path, timeout):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.settimeout(timeout)
+        sock.connect(socket_path)
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+
+def request(socket_path, op, timeout=10.0):
+    """Send one request, return the reply"""
+    with _connect(socket_path, timeout) as sock:
+        sock.sendall((json.dumps({'op': op}) + '\n').encode())
+        with sock.makefile('rb') as f:
+            line = f.readline()
+    if not line:
+        raise OSError(f"{socket_path}: connection closed")
+    reply = json.loads(line)
+    if reply.get('type') == 'error':
+        raise OSError(f"{socket_path}: {reply['error']}")
+    return reply
+
+
+def ensure_daemon(socket_path=DEFAULT_SOCKET, timeout=5.0):
+    """Start a daemon on socket_path unless one answers; OSError if none comes up"""
+    try:
+        request(socket_path, 'stats', timeout)
+        return False
+    except OSError:
+        pass
+    subprocess.Popen([sys.executable, os.path.abspath(__file__), '--socket', socket_path,
+                      '--idle-exit', str(SPAWN_IDLE_EXIT)],
+                     stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                     stderr=subprocess.DEVNULL, start_new_session=True)
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            request(socket_path, 'stats', timeout)
+            return True
+        except OSError:
+            # Another front-end may have won the race, its daemon answers as well
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.05)
+
+
+class DaemonDetector:
+    """USBDetector stand-in backed by the daemon
+
+    scan() returns the snapshot a subscription just pushed, else asks the
+    daemon to refresh. If the daemon is gone and cannot be restarted,
+    scanning falls back to a local USBDetector.
+    """
+
+    def __init__(self, socket_path=DEFAULT_SOCKET, spawn=True):
+        self.socket_path = socket_path
+        self.spawn = spawn
+        self.pushed = None
+        self.local = None
+
+    def scan(self):
+        if self.local:
+            return self.local.scan()
+        pushed, self.pushed = self.pushed, None
+        if pushed is not None:
+            return pushed
+        try:
+            reply = request(self.socket_path, 'refresh')
+        except OSError:
+            if not self.reconnect():
+                return self.local.scan()
+            reply = request(self.socket_path, 'refresh')
+        return [device_from_record(record) for record in reply['devices']]
+
+    def reconnect(self):
+        """Restart the daemon if allowed, else switch to local scans; True if it answers"""
+        try:
+            if self.spawn:
+                ensure_daemon(self.socket_path)
+            else:
+                request(self.socket_path, 'stats')
+            return True
+        except OSError:
+            self.local = USBDetector()
+            return False
+
+
+class DaemonEventSource:
+    """HotplugWatcher event source reading pushed snapshots from a subscription"""
+
+    def __init__(self, detector):
+        self.detector = detector
+        self.local = None
+        self._buffer = b''
+        self.sock = self._subscribe()
+
+    def _subscribe(self):
+        sock = _connect(self.detector.socket_path, 10.0)
+        sock.sendall(b'{"op": "subscribe"}\n')
+        sock.setblocking(False)
+        return sock
+
+    def fileno(self):
+        return self.local.fileno() if self.local else self.sock.fileno()
+
+    def read(self):
+        """Drain pushed snapshots, return True if there is a new one"""
+        if self.local:
+            return self.local.read()
+        latest = None
+        while True:
+            try:
+                data = self.sock.recv(65536)
+            except BlockingIOError:
+                break
+            except OSError:
+                data = b''
+            if not data:
+                self._reconnect()
+                return True
+            self._buffer += data
+            *lines, self._buffer = self._buffer.split(b'\n')
+            for line in lines:
+                try:
+                    message = json.loads(line)
+                except ValueError:
+                    # A garbled line must not kill the watcher thread; the next snapshot fixes it
+                    continue
+                if isinstance(message, dict) and message.get('type') == 'snapshot':
+                    latest = message
+        if latest is None:
+            return False
+        self.detector.pushed = [device_from_record(record) for record in latest['devices']]
+        return True
+
+    def _reconnect(self):
+        self.sock.close()
+        self._buffer = b''
+        if self.detector.reconnect():
+            try:
+                self.sock = self._subscribe()
+                return
+            except OSError:
+                self.detector.local = USBDetector()
+        # Without a daemon the watcher goes back to local hotplug events
+        self.local = default_event_source() or PipeEventSource()
+
+    def close(self):
+        if self.local:
+            self.local.close()
+        self.sock.close()
+
+
+def connect_watcher(socket_path=DEFAULT_SOCKET, spawn=True):
+    """HotplugWatcher fed by the inventory daemon, or a local one if it cannot be reached
+
+    $IPHONE_MANAGER_INVENTORY=0 always returns a local watcher.
+    """
+    if os.environ.get("IPHONE_MANAGER_INVENTORY", "1") == "0":
+        return HotplugWatcher()
+    detector = DaemonDetector(socket_path, spawn)
+    try:
+        if spawn:
+            ensure_daemon(socket_path)
+        source = DaemonEventSource(detector)
+    except OSError:
+        return HotplugWatcher()
+    return HotplugWatcher(detector, source)
+
+
+def is_shared(watcher):
+    """True if a watcher from connect_watcher() is fed by the daemon"""
+    return isinstance(watcher.detector, DaemonDetector) and not watcher.detector.local
+
+
+def main():
+    parser = argparse.ArgumentParser(description="iPhone device inventory daemon")
+    parser.add_argument('--socket', default=DEFAULT_SOCKET, help=f"default: {DEFAULT_SOCKET}")
+    parser.add_argument('--idle-exit', type=float,
+                        help="exit after this many seconds without clients")
+    parser.add_argument('--sysfs-root', default=SYSFS_USB_DEVICES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    daemon = InventoryDaemon(args.socket, HotplugWatcher(USBDetector(args.sysfs_root)),
+                             JobJournal(), idle_exit=args.idle_exit)
+
+    async def serve():
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, daemon.stop)
+        await daemon.serve()
+
+    try:
+        asyncio.run(serve())
+    except OSError as e:
+        print(f"❌ {str(e)}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,19 +5,43 @@ A GUI application for managing iPhone firmware and device recovery
 """
 
 import tkinter as tk
-from tkinter import ttk, filedialog, messagebox, scrolledtext
-import subprocess
-import threading
+from tkinter import ttk, filedialog, messagebox, scrolledtext, simpledialog
+import asyncio
+import collections
 import os
 import sys
 import time
 from pathlib import Path
 
+from device_info import get_product_type
+from firmware_cache import FirmwareCache
+from fleet_view import FleetView
+from inventory_daemon import connect_watcher, is_shared
+from ipsw_catalog import IPSWCatalog, library_dirs
+from ipsw_fetch import IPSWFetcher, DEFAULT_MIRROR, resolve_url
+from ipsw_verify import IPSWVerifier, VerifyCache, read_sha256_file
+from job_journal import JobJournal, SUCCEEDED, CANCELLED
+from log_store import LogStore
+from log_pipeline import LogPipeline
+from preflight import Preflight
+from restore_batch import device_selector, run_jobs
+from restore_output import ERROR, LINE, PHASE_START
+from restore_engine import RestoreEngine, LoopBridge
+from restore_metrics import MetricsWriter, phase_summary
+from usb_detector import MODE_NORMAL
+from usb_topology import TopologyScheduler
+from toolchain import Toolchain
+from usb_watcher import ATTACH, MODE_CHANGE
+
+# Returned by the restore coroutines instead of results, shown on the Tk thread
+INCOMPATIBLE = "The IPSW file does not support the connected device(s). Check the log for details."
+CORRUPT = "The IPSW file is corrupt or incomplete. Check the log for details."
+
 class iPhoneFirmwareManager:
-    def __init__(self, root):
+    def __init__(self, root, toolchain=None):
         self.root = root
         self.root.title("iPhone Firmware Manager")
-        self.root.geometry("800x600")
+        self.root.geometry("900x700")
         self.root.configure(bg='#f0f0f0')
         
         # Variables
@@ -25,9 +49,54 @@ class iPhoneFirmwareManager:
         self.device_mode = "Unknown"
         self.ipsw_file = ""
         self.restore_in_progress = False
+        # Device discovery is shared with other front-ends through the inventory daemon
+        self.watcher = connect_watcher()
+        self.catalog = IPSWCatalog()
+        self.verifier = IPSWVerifier(cache=VerifyCache())
+        self.metrics = MetricsWriter()
+        self.firmware_cache = FirmwareCache()
+        self.journal = JobJournal()
+        # Raw output of every session, compressed and indexed for later searches
+        self.log_store = LogStore(catalog=self.catalog)
+        self.fetcher = IPSWFetcher(catalog=self.catalog, verifier=self.verifier)
+        # Caps concurrent firmware transfers per USB hub and controller
+        self.scheduler = TopologyScheduler()
+        # Tool paths and capabilities, probed once per installed binary
+        self.toolchain = toolchain or Toolchain()
+        # Device/firmware compatibility, manifests parsed once per file by the catalog
+        self.preflight = Preflight(self.catalog,
+                                   self.toolchain.path('ideviceinfo') or 'ideviceinfo',
+                                   self.toolchain.path('irecovery') or 'irecovery')
+        self.product_types = {}
+        self.cancel_requested = False
+        # Task of the running restore on the engine loop, cancelled by the Cancel button
+        self.restore_task = None
+        # Restores and device probes share one asyncio loop on one thread
+        self.bridge = LoopBridge(self.root)
+        self.engine = RestoreEngine(on_update=self.handle_restore_update,
+                                    on_event=self.handle_restore_event,
+                                    on_message=lambda text: self.log_message(f"📦 {text}"),
+                                    metrics=self.metrics, firmware_cache=self.firmware_cache,
+                                    scheduler=self.scheduler, log_store=self.log_store,
+                                    toolchain=self.toolchain)
         
         self.setup_ui()
+        # Log lines from worker threads are queued and inserted on the Tk loop
+        self.log_pipeline = LogPipeline(self.log_text, self.root,
+                                        spill_path=LogPipeline.default_spill_path())
+        self.log_pipeline.start()
+        self.fleet.start()
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+        
+        self.watcher.subscribe(self.on_device_event)
+        if not self.watcher.start():
+            self.log_message("USB hotplug events unavailable, use Refresh Status")
+        elif is_shared(self.watcher):
+            self.log_message("Device list shared through the inventory daemon")
         self.check_device_status()
+        # A new or updated idevicerestore is probed off the Tk thread
+        self.bridge.submit(self.engine.probe_tools(), self.tools_probed)
+        self.root.after(0, self.resume_jobs)
         
     def setup_ui(self):
         # Main frame
@@ -73,6 +142,9 @@ class iPhoneFirmwareManager:
         
         ttk.Button(ipsw_frame, text="Browse", command=self.browse_ipsw).grid(row=0, column=2)
         
+        self.download_btn = ttk.Button(ipsw_frame, text="Download...", command=self.download_ipsw)
+        self.download_btn.grid(row=0, column=3, padx=(10, 0))
+        
         # Restore Options
         options_frame = ttk.LabelFrame(main_frame, text="Restore Options", padding="10")
         options_frame.grid(row=3, column=0, columnspan=3, sticky=(tk.W, tk.E), pady=(0, 10))
@@ -89,6 +161,11 @@ class iPhoneFirmwareManager:
         ttk.Checkbutton(options_frame, text="Debug mode (Verbose output)", 
                        variable=self.debug_var).grid(row=2, column=0, sticky=tk.W)
         
+        ttk.Label(options_frame, text="Parallel restores:").grid(row=3, column=0, sticky=tk.W, pady=(5, 0))
+        self.max_concurrent_var = tk.IntVar(value=4)
+        ttk.Spinbox(options_frame, from_=1, to=32, width=5, 
+                   textvariable=self.max_concurrent_var).grid(row=3, column=1, sticky=tk.W, pady=(5, 0))
+        
         # Action Buttons
         button_frame = ttk.Frame(main_frame)
         button_frame.grid(row=4, column=0, columnspan=3, pady=(0, 10))
@@ -97,24 +174,42 @@ class iPhoneFirmwareManager:
                                      command=self.start_restore, style="Accent.TButton")
         self.restore_btn.grid(row=0, column=0, padx=(0, 10))
         
+        self.restore_all_btn = ttk.Button(button_frame, text="Restore All Devices", 
+                                         command=self.start_restore_all)
+        self.restore_all_btn.grid(row=0, column=1, padx=(0, 10))
+        
         self.force_restart_btn = ttk.Button(button_frame, text="Force Restart Device", 
                                            command=self.force_restart)
-        self.force_restart_btn.grid(row=0, column=1, padx=(0, 10))
+        self.force_restart_btn.grid(row=0, column=2, padx=(0, 10))
         
         self.exit_recovery_btn = ttk.Button(button_frame, text="Exit Recovery Mode", 
                                            command=self.exit_recovery)
-        self.exit_recovery_btn.grid(row=0, column=2)
+        self.exit_recovery_btn.grid(row=0, column=3, padx=(0, 10))
+        
+        self.cancel_btn = ttk.Button(button_frame, text="Cancel Restore", 
+                                    command=self.cancel_restore, state="disabled")
+        self.cancel_btn.grid(row=0, column=4)
         
         # Progress Bar
-        self.progress = ttk.Progressbar(main_frame, mode='indeterminate')
+        self.progress_var = tk.DoubleVar(value=0.0)
+        self.progress_shown = 0
+        self.progress = ttk.Progressbar(main_frame, mode='determinate', maximum=100,
+                                        variable=self.progress_var)
         self.progress.grid(row=5, column=0, columnspan=3, sticky=(tk.W, tk.E), pady=(0, 10))
         
-        # Log Output
-        log_frame = ttk.LabelFrame(main_frame, text="Output Log", padding="10")
-        log_frame.grid(row=6, column=0, columnspan=3, sticky=(tk.W, tk.E, tk.N, tk.S), pady=(0, 10))
+        # Log Output and the per-device fleet view share one notebook
+        notebook = ttk.Notebook(main_frame)
+        notebook.grid(row=6, column=0, columnspan=3, sticky=(tk.W, tk.E, tk.N, tk.S), pady=(0, 10))
+        main_frame.rowconfigure(6, weight=1)
+        
+        log_frame = ttk.Frame(notebook, padding="10")
         log_frame.columnconfigure(0, weight=1)
         log_frame.rowconfigure(0, weight=1)
-        main_frame.rowconfigure(6, weight=1)
+        notebook.add(log_frame, text="Output Log")
+        
+        self.fleet = FleetView(notebook, self.root, load_log=self.device_log)
+        self.fleet.frame.configure(padding="10")
+        notebook.add(self.fleet.frame, text="Devices")
         
         self.log_text = scrolledtext.ScrolledText(log_frame, height=15, wrap=tk.WORD)
         self.log_text.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
@@ -123,62 +218,179 @@ class iPhoneFirmwareManager:
         ttk.Button(log_frame, text="Clear Log", command=self.clear_log).grid(row=1, column=0, pady=(5, 0))
         
     def log_message(self, message):
-        """Add message to log with timestamp"""
+        """Add message to log with timestamp, safe to call from any thread"""
         timestamp = time.strftime("%H:%M:%S")
-        self.log_text.insert(tk.END, f"[{timestamp}] {message}\n")
-        self.log_text.see(tk.END)
-        self.root.update_idletasks()
+        self.log_pipeline.write(f"[{timestamp}] {message}")
         
     def clear_log(self):
         """Clear the log output"""
-        self.log_text.delete(1.0, tk.END)
+        self.log_pipeline.clear()
+        
+    def on_close(self):
+        """Flush the log and stop background watchers before exiting"""
+        self.watcher.stop()
+        # A partial download is kept and resumed next time
+        self.fetcher.cancel()
+        self.bridge.stop()
+        self.fleet.stop()
+        self.log_pipeline.close()
+        self.root.destroy()
         
     def check_device_status(self):
         """Check if iPhone is connected and its mode"""
-        def check_thread():
-            try:
-                # Check USB devices
-                result = subprocess.run(['lsusb'], capture_output=True, text=True, timeout=10)
-                apple_devices = [line for line in result.stdout.split('\n') if 'Apple' in line and 'Mobile Device' in line]
-                
-                if apple_devices:
-                    self.device_connected = True
-                    if 'Recovery Mode' in apple_devices[0]:
-                        self.device_mode = "Recovery Mode"
-                        self.status_label.config(text="Connected", foreground="green")
-                        self.mode_label.config(text="Recovery Mode", foreground="red")
-                    else:
-                        self.device_mode = "Normal"
-                        self.status_label.config(text="Connected", foreground="green")
-                        self.mode_label.config(text="Normal Mode", foreground="blue")
-                else:
-                    self.device_connected = False
-                    self.device_mode = "Not Connected"
-                    self.status_label.config(text="Not Connected", foreground="red")
-                    self.mode_label.config(text="Unknown", foreground="gray")
-                    
-                self.log_message(f"Device status: {self.device_mode}")
-                
-            except Exception as e:
-                self.log_message(f"Error checking device: {str(e)}")
-                self.device_connected = False
-                self.status_label.config(text="Error", foreground="red")
+        try:
+            devices = self.watcher.refresh()
+            self.show_device_status(devices)
+            self.log_message(f"Device status: {self.device_mode}")
+            
+        except Exception as e:
+            self.log_message(f"Error checking device: {str(e)}")
+            self.device_connected = False
+            self.status_label.config(text="Error", foreground="red")
+            
+    def show_device_status(self, devices):
+        """Update the status labels and the fleet view from a list of detected devices"""
+        self.fleet.model.sync(devices)
+        if devices:
+            self.device_connected = True
+            self.device_mode = devices[0].mode
+            status = "Connected" if len(devices) == 1 else f"Connected ({len(devices)} devices)"
+            self.status_label.config(text=status, foreground="green")
+            if self.device_mode == MODE_NORMAL:
+                self.mode_label.config(text="Normal Mode", foreground="blue")
+            else:
+                self.mode_label.config(text=self.device_mode, foreground="red")
+        else:
+            self.device_connected = False
+            self.device_mode = "Not Connected"
+            self.status_label.config(text="Not Connected", foreground="red")
+            self.mode_label.config(text="Unknown", foreground="gray")
+            
+    def on_device_event(self, event):
+        """Hotplug callback, runs on the watcher thread"""
+        self.root.after(0, self.handle_device_event, event)
         
-        threading.Thread(target=check_thread, daemon=True).start()
+    def handle_device_event(self, event):
+        """Log a hotplug event and update the status labels"""
+        device = event.device
+        if event.kind == MODE_CHANGE:
+            self.log_message(f"📱 {device.identifier}: {event.previous_mode} → {device.mode}")
+        elif event.kind == ATTACH:
+            self.log_message(f"📱 Device attached: {device.mode} ({device.identifier})")
+        else:
+            self.log_message(f"📱 Device detached ({device.identifier})")
+        self.show_device_status(self.watcher.devices)
+        
+    def connected_product_type(self):
+        """ProductType of the first connected normal-mode device, or None"""
+        devices = self.watcher.devices
+        if not devices or not devices[0].udid:
+            return None
+        udid = devices[0].udid
+        if udid not in self.product_types:
+            self.product_types[udid] = get_product_type(udid, self.toolchain.path('ideviceinfo')
+                                                        or 'ideviceinfo')
+        return self.product_types[udid]
         
     def browse_ipsw(self):
         """Browse for IPSW file"""
+        # The device query and library scan can take seconds, the dialog waits for them
+        self.bridge.submit(self.find_compatible(), self.open_ipsw_dialog)
+        
+    async def find_compatible(self):
+        """(ProductType, catalogued firmware for it) of the connected device, off the Tk thread"""
+        return await asyncio.get_running_loop().run_in_executor(None, self.compatible_firmware)
+        
+    def compatible_firmware(self):
+        product_type = self.connected_product_type()
+        if not product_type:
+            return None, []
+        for directory in library_dirs():
+            self.catalog.scan(directory)
+        return product_type, self.catalog.compatible(product_type)
+        
+    def open_ipsw_dialog(self, future):
+        """Show the file dialog in the library of compatible firmware, runs on the Tk thread"""
+        initial_dir = None
+        try:
+            product_type, compatible = future.result()
+        except Exception as e:
+            self.log_message(f"Could not look up compatible firmware: {str(e)}")
+            product_type, compatible = None, []
+        if compatible:
+            self.log_message(f"Compatible firmware for {product_type}:")
+            for entry in compatible[:5]:
+                self.log_message(f"  {entry.name} - {entry.description}")
+            initial_dir = os.path.dirname(compatible[0].path)
+                
         file_path = filedialog.askopenfilename(
             title="Select IPSW File",
+            initialdir=initial_dir,
             filetypes=[("IPSW files", "*.ipsw"), ("All files", "*.*")]
         )
         if file_path:
-            self.ipsw_file = file_path
-            self.ipsw_entry.config(state="normal")
-            self.ipsw_entry.delete(0, tk.END)
-            self.ipsw_entry.insert(0, file_path)
-            self.ipsw_entry.config(state="readonly")
-            self.log_message(f"Selected IPSW file: {os.path.basename(file_path)}")
+            self.select_ipsw(file_path, product_type)
+            
+    def select_ipsw(self, file_path, product_type=None):
+        """Use an IPSW for the next restore"""
+        self.ipsw_file = file_path
+        self.ipsw_entry.config(state="normal")
+        self.ipsw_entry.delete(0, tk.END)
+        self.ipsw_entry.insert(0, file_path)
+        self.ipsw_entry.config(state="readonly")
+        
+        async def describe():
+            await asyncio.get_running_loop().run_in_executor(
+                None, self.describe_ipsw, file_path, product_type)
+        self.bridge.submit(describe())
+        
+    def describe_ipsw(self, file_path, product_type=None):
+        """Log what an IPSW is and whether it fits the device, runs on an executor thread"""
+        entry = self.catalog.add(file_path)
+        self.log_message(f"Selected IPSW file: {os.path.basename(file_path)} - {entry.description}")
+        product_type = product_type or self.connected_product_type()
+        if product_type and not entry.supports(product_type):
+            self.log_message(f"⚠️ This firmware does not list {product_type} as supported")
+            
+    def download_ipsw(self):
+        """Fetch an IPSW from the firmware mirror into the library"""
+        name = simpledialog.askstring("Download IPSW", "IPSW URL, or file name on the mirror:",
+                                      initialvalue=DEFAULT_MIRROR, parent=self.root)
+        if not name or not name.strip():
+            return
+        try:
+            url = resolve_url(name.strip())
+        except ValueError as e:
+            messagebox.showerror("Error", str(e))
+            return
+            
+        self.download_btn.config(state="disabled")
+        self.set_progress(0)
+        self.log_message(f"Downloading {url}...")
+        self.bridge.submit(self.perform_download(url), self.download_finished)
+        
+    async def perform_download(self, url):
+        """Run the fetch on an executor thread, the engine loop stays free"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            None, self.fetcher.fetch, url, None, None,
+            lambda done, total: self.set_progress(100.0 * done / total if total else 0))
+        
+    def download_finished(self, future):
+        """Report the outcome of perform_download, runs on the Tk thread"""
+        self.download_btn.config(state="normal")
+        try:
+            result = future.result()
+        except Exception as e:
+            self.log_message(f"❌ Download failed: {str(e)}")
+            return
+            
+        if result.ok:
+            self.log_message(f"✅ {os.path.basename(result.path)} {result.summary}")
+            self.select_ipsw(result.path)
+        else:
+            self.log_message(f"❌ {os.path.basename(result.path)}: {result.summary}")
+            messagebox.showerror("Error", "Download failed. Check the log for details.")
             
     def start_restore(self):
         """Start the restore process"""
@@ -197,49 +409,192 @@ class iPhoneFirmwareManager:
         # Confirm restore
         if messagebox.askyesno("Confirm Restore", 
                               "This will erase all data on your iPhone. Continue?"):
-            self.restore_in_progress = True
-            self.restore_btn.config(state="disabled")
-            self.progress.start()
+            self.set_restore_buttons(True)
+            self.cancel_requested = False
+            self.set_progress(0)
             self.log_message("Starting restore process...")
             
-            # Start restore in separate thread
-            threading.Thread(target=self.perform_restore, daemon=True).start()
+            # The restore runs on the engine loop, the outcome comes back on the Tk thread
+            self.bridge.submit(self.track_restore(self.perform_restore(self.restore_options())),
+                               self.restore_finished)
             
-    def perform_restore(self):
-        """Perform the actual restore"""
-        try:
-            # Build idevicerestore command
-            cmd = ['idevicerestore']
+    def restore_options(self):
+        """Journal options from the checkboxes; Tk variables are read on the Tk thread only"""
+        return {'erase': self.erase_var.get(), 'exclude_baseband': self.exclude_baseband_var.get(),
+                'debug': self.debug_var.get()}
             
-            if self.erase_var.get():
-                cmd.append('-e')
-                
-            if self.exclude_baseband_var.get():
-                cmd.append('-x')
-                
-            if self.debug_var.get():
-                cmd.append('-d')
-                
-            cmd.append(self.ipsw_file)
+    def verify_firmware(self):
+        """Pre-flight integrity check of the selected IPSW, runs on an executor thread
+
+        A failure is only logged, the caller reports it on the Tk thread.
+        """
+        self.log_message(f"Verifying {os.path.basename(self.ipsw_file)}...")
+        result = self.verifier.verify(self.ipsw_file, read_sha256_file(self.ipsw_file))
+        if result.ok:
+            self.log_message(f"✅ IPSW {result.summary}")
+            return True
             
-            self.log_message(f"Running command: {' '.join(cmd)}")
+        self.log_message(f"❌ IPSW {result.summary}")
+        return False
+        
+    def preflight_devices(self, devices):
+        """Check the selected IPSW against devices, return those it fits; runs on an executor
+
+        Rejections are only logged, the caller reports an empty list on the Tk thread.
+        """
+        compatible = []
+        for result in self.preflight.check_many((self.ipsw_file, device) for device in devices):
+            if result.ok:
+                compatible.append(result.device)
+            else:
+                self.log_message(f"❌ {result.device.identifier}: {result.summary}")
+        if compatible:
+            self.log_message(f"✅ {os.path.basename(self.ipsw_file)} fits {len(compatible)} of "
+                             f"{len(devices)} device(s)")
+        return compatible
+        
+    def check_compatibility(self, ipsw_file, device):
+        """preflight() for run_jobs: why the IPSW cannot restore the device, or None"""
+        result = self.preflight.check(ipsw_file, device)
+        return None if result.ok else result.error
+        
+    def check_firmware(self, ipsw_file, sha256=None):
+        """verify() for run_jobs: an error message, or None if the IPSW is intact"""
+        result = self.verifier.verify(ipsw_file, sha256 or read_sha256_file(ipsw_file))
+        return None if result.ok else f"IPSW {result.summary}"
+        
+    def log_retry(self, job, error):
+        delay = max(0, job.next_attempt_at - time.time())
+        self.log_message(f"🔁 {job.device}: attempt {job.attempts}/{job.max_attempts} failed "
+                         f"({error}), retrying in {delay:.0f}s")
+        
+    async def run_jobs(self, job_ids, max_concurrent=4):
+        """Run journal jobs on the engine loop, return [(job, restore)] as they finished"""
+        results = []
+        await run_jobs(self.engine, self.journal, job_ids, self.watcher.refresh,
+                       self.check_firmware,
+                       lambda job, device, restore, error: results.append((job, restore)),
+                       max_concurrent, on_retry=self.log_retry,
+                       preflight=self.check_compatibility)
+        return results
+        
+    def set_progress(self, percent):
+        """Update the progress bar, safe to call from any thread"""
+        # Only whole-percent changes reach Tk, in-place updates are frequent
+        if int(percent) != self.progress_shown or percent == 0:
+            self.progress_shown = int(percent)
+            self.root.after(0, self.progress_var.set, percent)
             
-            # Run the restore command
-            process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, 
-                                     text=True, bufsize=1, universal_newlines=True)
+    def handle_restore_event(self, restore, event):
+        """Log output lines and phases, drive the progress bar; runs on the engine loop"""
+        prefix = f"[{restore.udid[:8]}] " if restore.udid else ""
+        if event.kind == LINE:
+            self.log_message(f"{prefix}{event.text}")
+            self.fleet.line(restore.device, event.text)
+        elif event.kind == PHASE_START:
+            self.log_message(f"{prefix}▶ Phase: {event.phase}")
+        if event.kind != LINE:
+            self.fleet.update(restore.device, phase=event.phase, percent=restore.percent,
+                              **({'error': event.text} if event.kind == ERROR else {}))
+        if event.overall is not None:
+            self.set_progress(self.engine.overall_percent())
             
-            # Read output in real-time
-            for line in iter(process.stdout.readline, ''):
-                if line:
-                    self.log_message(line.strip())
-                    
-            process.wait()
+    def handle_restore_update(self, restore):
+        """Log status changes of multi-device restores, update the fleet row; runs on the loop"""
+        if restore.udid:
+            self.log_message(f"[{restore.udid[:8]}] {restore.status}")
+        self.fleet.update(restore.device, status=restore.status, phase=restore.phase,
+                          percent=restore.percent, started=restore.started,
+                          finished=restore.finished, active=restore.finished is None,
+                          error=restore.errors[-1] if restore.errors else None)
+        
+    def device_log(self, device):
+        """Last lines of a device's latest restore for the fleet view; runs on a worker thread"""
+        restore = self.engine.restores.get(device)
+        if restore and restore.log:
+            return restore.log[-self.fleet.log_lines:]
+        sessions = self.log_store.sessions(device=device, limit=1)
+        if not sessions or not sessions[0].path:
+            return []
+        try:
+            return list(collections.deque(self.log_store.lines(sessions[0].id),
+                                          maxlen=self.fleet.log_lines))
+        except FileNotFoundError:
+            return []
+            
+    def set_restore_buttons(self, running):
+        self.restore_in_progress = running
+        self.restore_btn.config(state="disabled" if running else "normal")
+        self.restore_all_btn.config(state="disabled" if running else "normal")
+        self.cancel_btn.config(state="normal" if running else "disabled")
+        
+    def cancel_restore(self):
+        """Stop every running idevicerestore of this window and drop its queued jobs"""
+        self.cancel_requested = True
+        self.log_message("Cancelling restore...")
+        self.bridge.call_soon(self.stop_restore)
+        
+    async def track_restore(self, coro):
+        """Run a restore coroutine as the task cancel_restore() stops, on the engine loop"""
+        self.restore_task = asyncio.current_task()
+        try:
+            return await coro
+        finally:
+            self.restore_task = None
+            
+    def stop_restore(self):
+        """Cancel the restore task and its idevicerestore runs; runs on the engine loop"""
+        if self.restore_task:
+            # run_jobs cancels the jobs still queued or waiting out a retry backoff
+            self.restore_task.cancel()
+        self.engine.cancel()
+        
+    async def perform_restore(self, options):
+        """Check and verify the firmware and restore the connected device, on the engine loop"""
+        loop = asyncio.get_running_loop()
+        devices = self.watcher.devices
+        # Seconds to rule out the wrong firmware, before the whole file is verified
+        if devices and not await loop.run_in_executor(None, self.preflight_devices, devices[:1]):
+            return INCOMPATIBLE
+        if not await loop.run_in_executor(None, self.verify_firmware):
+            return CORRUPT
+        if self.cancel_requested:
+            return None
             
-            if process.returncode == 0:
+        self.log_message("📦 Preparing firmware components...")
+        # Journaled, so transient USB failures are retried and a crash can be resumed
+        job_id = self.journal.enqueue(
+            device_selector(devices[0]) if devices else 'any', self.ipsw_file, options)
+        [result] = await self.run_jobs([job_id])
+        return result
+        
+    def restore_finished(self, future):
+        """Report the outcome of perform_restore, runs on the Tk thread"""
+        try:
+            if future.cancelled():
+                self.log_message("⏹ Restore cancelled")
+                return
+            result = future.result()
+            if result is None:
+                return
+            if isinstance(result, str):
+                messagebox.showerror("Error", result)
+                return
+                
+            job, restore = result
+            if restore and restore.session:
+                record = restore.session.record()
+                self.log_message(f"⏱ Restore took {restore.duration:.0f}s ({phase_summary(record)})")
+            
+            if job.state == SUCCEEDED:
+                self.set_progress(100)
                 self.log_message("✅ Restore completed successfully!")
                 messagebox.showinfo("Success", "iPhone restore completed successfully!")
+            elif job.state == CANCELLED:
+                self.log_message("⏹ Restore cancelled")
             else:
-                self.log_message(f"❌ Restore failed with exit code: {process.returncode}")
+                self.log_message(f"❌ Restore failed after {job.attempts} attempt(s): "
+                                 f"{job.last_error or f'exit code {job.returncode}'}")
                 messagebox.showerror("Error", "Restore failed. Check the log for details.")
                 
         except Exception as e:
@@ -247,11 +602,119 @@ class iPhoneFirmwareManager:
             messagebox.showerror("Error", f"Restore failed: {str(e)}")
             
         finally:
-            self.restore_in_progress = False
-            self.restore_btn.config(state="normal")
-            self.progress.stop()
+            self.set_restore_buttons(False)
             self.check_device_status()
             
+    def start_restore_all(self):
+        """Start restoring every attached device in parallel"""
+        if not self.ipsw_file or not os.path.exists(self.ipsw_file):
+            messagebox.showerror("Error", "Please select a valid IPSW file.")
+            return
+            
+        if self.restore_in_progress:
+            messagebox.showwarning("Warning", "Restore already in progress.")
+            return
+            
+        if messagebox.askyesno("Confirm Restore", 
+                              "This will erase all data on ALL connected iPhones. Continue?"):
+            self.set_restore_buttons(True)
+            self.cancel_requested = False
+            self.set_progress(0)
+            self.log_message("Starting restore of all connected devices...")
+            
+            self.bridge.submit(self.track_restore(self.perform_restore_all(
+                self.restore_options(), max(1, self.max_concurrent_var.get()))),
+                self.restore_all_finished)
+            
+    async def perform_restore_all(self, options, max_concurrent):
+        """Restore all attached devices, one idevicerestore per UDID, on the engine loop"""
+        loop = asyncio.get_running_loop()
+        devices = await loop.run_in_executor(None, self.watcher.refresh)
+        if not devices:
+            self.log_message("❌ No devices found for restore")
+            return None
+            
+        devices = await loop.run_in_executor(None, self.preflight_devices, devices)
+        if not devices:
+            return INCOMPATIBLE
+        if not await loop.run_in_executor(None, self.verify_firmware):
+            return CORRUPT
+        if self.cancel_requested:
+            return None
+            
+        self.log_message(f"Restoring {len(devices)} device(s), {max_concurrent} at a time")
+        self.log_message("📦 Preparing firmware components...")
+        job_ids = self.journal.enqueue_many([(device_selector(device), self.ipsw_file, options,
+                                              None, None, None) for device in devices])
+        return await self.run_jobs(job_ids, max_concurrent)
+        
+    def restore_all_finished(self, future):
+        """Report the outcome of perform_restore_all or resumed jobs, runs on the Tk thread"""
+        try:
+            if future.cancelled():
+                self.log_message("⏹ Restores cancelled")
+                return
+            results = future.result()
+            if not results:
+                return
+            if isinstance(results, str):
+                messagebox.showerror("Error", results)
+                return
+                
+            for job, restore in results:
+                mark = "✅" if job.state == SUCCEEDED else "❌"
+                duration = f", {restore.duration:.0f}s" if restore else ""
+                self.log_message(f"{mark} {job.device}: {job.state} after {job.attempts} "
+                                 f"attempt(s) (exit code {job.returncode}{duration})")
+                
+            failed = sum(1 for job, _ in results if job.state != SUCCEEDED)
+            if failed:
+                messagebox.showerror("Error", f"{failed} of {len(results)} restores failed. "
+                                              "Check the log for details.")
+            else:
+                messagebox.showinfo("Success", f"All {len(results)} devices restored successfully!")
+                
+        except Exception as e:
+            self.log_message(f"❌ Error during restore: {str(e)}")
+            messagebox.showerror("Error", f"Restore failed: {str(e)}")
+            
+        finally:
+            self.set_restore_buttons(False)
+            self.check_device_status()
+            
+    def tools_probed(self, future):
+        """Log which idevicerestore the restores will run"""
+        if future.cancelled() or future.exception():
+            return
+        tool = self.toolchain.tool(self.engine.idevicerestore_cmd)
+        if tool:
+            self.log_message(f"Using {tool.description}")
+            
+    def resume_jobs(self):
+        """Offer to resume restore jobs left behind by a manager that exited or crashed"""
+        recovered = self.journal.recover()
+        if not recovered:
+            return
+            
+        jobs = self.journal.jobs(ids=recovered)
+        listing = "\n".join(f"{job.device}: {os.path.basename(job.ipsw)} "
+                             f"(attempt {job.attempts}/{job.max_attempts})" for job in jobs[:10])
+        if not messagebox.askyesno("Resume Restores",
+                                   f"{len(jobs)} restore job(s) did not finish last time:\n\n"
+                                   f"{listing}\n\nResume them now?"):
+            for job_id in recovered:
+                self.journal.cancel(job_id)
+            self.log_message(f"Cancelled {len(recovered)} unfinished restore job(s)")
+            return
+            
+        self.set_restore_buttons(True)
+        self.cancel_requested = False
+        self.set_progress(0)
+        self.log_message(f"Resuming {len(recovered)} restore job(s)...")
+        self.bridge.submit(self.track_restore(
+            self.run_jobs(recovered, max(1, self.max_concurrent_var.get()))),
+            self.restore_all_finished)
+        
     def force_restart(self):
         """Force restart the iPhone"""
         if not self.device_connected:
@@ -274,37 +737,34 @@ class iPhoneFirmwareManager:
             
         self.log_message("Attempting to exit recovery mode...")
         
-        def exit_thread():
+        async def probe():
+            # The shared inventory answers instead of another idevice_id probe
+            return await asyncio.get_running_loop().run_in_executor(None, self.watcher.refresh)
+            
+        def probe_done(future):
             try:
-                # Try to send exit recovery command
-                cmd = ['idevice_id', '-l']
-                result = subprocess.run(cmd, capture_output=True, text=True, timeout=10)
-                
-                if result.returncode == 0:
+                if future.result():
                     self.log_message("Device detected, attempting to exit recovery...")
                     # Try to force restart
-                    time.sleep(2)
-                    self.check_device_status()
+                    self.root.after(2000, self.check_device_status)
                 else:
                     self.log_message("Could not communicate with device")
                     
             except Exception as e:
                 self.log_message(f"Error: {str(e)}")
                 
-        threading.Thread(target=exit_thread, daemon=True).start()
+        self.bridge.submit(probe(), probe_done)
 
 def main():
-    # Check if required tools are installed
-    try:
-        subprocess.run(['which', 'idevicerestore'], check=True, capture_output=True)
-        subprocess.run(['which', 'lsusb'], check=True, capture_output=True)
-    except subprocess.CalledProcessError:
+    # Check if required tools are installed, from the cache unless they changed
+    toolchain = Toolchain()
+    if toolchain.missing():
         print("Error: Required tools not found. Please install:")
         print("sudo apt install libimobiledevice-utils")
         sys.exit(1)
     
     root = tk.Tk()
-    app = iPhoneFirmwareManager(root)
+    app = iPhoneFirmwareManager(root, toolchain)
     
     # Configure style
     style = ttk.Style()
@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+"""
+IPSW Catalog
+Persistent SQLite index of IPSW files and the devices they support
+"""
+
+import os
+import plistlib
+import sqlite3
+import threading
+import zipfile
+
+DEFAULT_CATALOG_PATH = os.path.expanduser("~/.cache/iphone_firmware_manager/ipsw_catalog.db")
+
+# Bump when the stored metadata changes, forces a full reindex
+SCHEMA_VERSION = 2
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS ipsw (
+    path TEXT PRIMARY KEY,
+    directory TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    product_version TEXT,
+    build_version TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS ipsw_directory ON ipsw(directory);
+CREATE TABLE IF NOT EXISTS ipsw_product_type (
+    path TEXT NOT NULL REFERENCES ipsw(path) ON DELETE CASCADE,
+    product_type TEXT NOT NULL,
+    PRIMARY KEY (product_type, path)
+);
+CREATE TABLE IF NOT EXISTS ipsw_identity (
+    path TEXT NOT NULL REFERENCES ipsw(path) ON DELETE CASCADE,
+    chip_id INTEGER,
+    board_id INTEGER,
+    device_class TEXT,
+    PRIMARY KEY (path, chip_id, board_id, device_class)
+);
+"""
+
+
+def library_dirs():
+    """Directories searched for firmware: ~/Downloads plus $IPSW_LIBRARY (os.pathsep separated)"""
+    dirs = [os.path.expanduser("~/Downloads")]
+    for directory in os.environ.get("IPSW_LIBRARY", "").split(os.pathsep):
+        if directory and os.path.expanduser(directory) not in dirs:
+            dirs.append(os.path.expanduser(directory))
+    return dirs
+
+
+def version_key(version):
+    """Sort key for versions like "17.1.2" """
+    return tuple(int(part) if part.isdigit() else 0 for part in (version or "").split('.'))
+
+
+def parse_int(value):
+    """Integer of a manifest field that may be a number or a "0x..." string, or None"""
+    if isinstance(value, int):
+        return value
+    try:
+        return int(value, 0)
+    except (TypeError, ValueError):
+        return None
+
+
+def build_identities(manifest):
+    """Distinct (chip_id, board_id, device_class) of a manifest's BuildIdentities"""
+    identities = []
+    for identity in manifest.get('BuildIdentities', []):
+        info = identity.get('Info', {})
+        device_class = info.get('DeviceClass')
+        key = (parse_int(identity.get('ApChipID')), parse_int(identity.get('ApBoardID')),
+               device_class.lower() if device_class else None)
+        if key not in identities:
+            identities.append(key)
+    return identities
+
+
+def read_build_manifest(path):
+    """Read BuildManifest.plist from an IPSW without reading the rest of the archive"""
+    # ZipFile only parses the central directory, read() then seeks to the one member
+    with zipfile.ZipFile(path) as archive:
+        return plistlib.loads(archive.read('BuildManifest.plist'))
+
+
+class IPSWEntry:
+    """Catalog metadata of one IPSW file"""
+
+    def __init__(self, path, size, product_version, build_version, product_types, error=None,
+                 identities=()):
+        self.path = path
+        self.size = size
+        self.product_version = product_version
+        self.build_version = build_version
+        self.product_types = product_types
+        self.error = error
+        # (chip_id, board_id, device_class) of every BuildIdentity
+        self.identities = list(identities)
+
+    @property
+    def name(self):
+        return os.path.basename(self.path)
+
+    @property
+    def description(self):
+        if self.error:
+            return f"unreadable: {self.error}"
+        return f"iOS {self.product_version} ({self.build_version})"
+
+    def supports(self, product_type):
+        return product_type in self.product_types
+
+    def __repr__(self):
+        return f"IPSWEntry({self.name!r}, {self.product_version!r}, {self.build_version!r})"
+
+
+class IPSWCatalog:
+    """On-disk catalog of IPSW files with incremental rescans"""
+
+    def __init__(self, db_path=DEFAULT_CATALOG_PATH):
+        if db_path != ':memory:':
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.db = sqlite3.connect(db_path, check_same_thread=False)
+        self.db.execute("PRAGMA foreign_keys = ON")
+        self._lock = threading.Lock()
+        with self._lock, self.db:
+            if self.db.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+                self.db.execute("DROP TABLE IF EXISTS ipsw_identity")
+                self.db.execute("DROP TABLE IF EXISTS ipsw_product_type")
+                self.db.execute("DROP TABLE IF EXISTS ipsw")
+                self.db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            self.db.executescript(SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self.db.close()
+
+    def scan(self, directory):
+        """Bring the catalog up to date with a directory and return its entries
+
+        Only files whose (path, size, mtime) changed are re-read.
+        """
+        directory = os.path.abspath(os.path.expanduser(directory))
+        try:
+            with os.scandir(directory) as it:
+                found = {}
+                for entry in it:
+                    if entry.name.lower().endswith('.ipsw') and entry.is_file():
+                        st = entry.stat()
+                        found[entry.path] = (st.st_size, st.st_mtime_ns)
+        except FileNotFoundError:
+            found = {}
+
+        with self._lock, self.db:
+            known = {row[0]: (row[1], row[2]) for row in self.db.execute(
+                "SELECT path, size, mtime_ns FROM ipsw WHERE directory = ?", (directory,))}
+
+            removed = [(path,) for path in known if path not in found]
+            if removed:
+                self.db.executemany("DELETE FROM ipsw WHERE path = ?", removed)
+
+            for path, stamp in found.items():
+                if known.get(path) != stamp:
+                    self._index(path, directory, *stamp)
+
+        return self.entries(directory)
+
+    def add(self, path):
+        """Index a single file if needed and return its entry"""
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        with self._lock, self.db:
+            row = self.db.execute("SELECT size, mtime_ns FROM ipsw WHERE path = ?",
+                                  (path,)).fetchone()
+            if row != (st.st_size, st.st_mtime_ns):
+                self._index(path, os.path.dirname(path), st.st_size, st.st_mtime_ns)
+        return self.get(path)
+
+    def _index(self, path, directory, size, mtime_ns):
+        product_version = build_version = error = None
+        product_types = []
+        identities = []
+        try:
+            manifest = read_build_manifest(path)
+            product_version = manifest.get('ProductVersion')
+            build_version = manifest.get('ProductBuildVersion')
+            product_types = list(manifest.get('SupportedProductTypes', []))
+            identities = build_identities(manifest)
+        except Exception as e:
+            error = str(e) or type(e).__name__
+
+        self.db.execute("DELETE FROM ipsw WHERE path = ?", (path,))
+        self.db.execute("INSERT INTO ipsw VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        (path, directory, size, mtime_ns, product_version, build_version, error))
+        self.db.executemany("INSERT OR IGNORE INTO ipsw_product_type VALUES (?, ?)",
+                            [(path, product_type) for product_type in product_types])
+        self.db.executemany("INSERT OR IGNORE INTO ipsw_identity VALUES (?, ?, ?, ?)",
+                            [(path, *identity) for identity in identities])
+
+    def _entries(self, where, params):
+        # Executor threads read while others scan; one cursor at a time on the shared connection
+        with self._lock:
+            rows = self.db.execute(
+                "SELECT path, size, product_version, build_version, error FROM ipsw " + where,
+                params).fetchall()
+            product_types = {}
+            for path, product_type in self.db.execute(
+                    "SELECT path, product_type FROM ipsw_product_type "
+                    "WHERE path IN (SELECT path FROM ipsw " + where + ")", params):
+                product_types.setdefault(path, []).append(product_type)
+            identities = {}
+            for path, *identity in self.db.execute(
+                    "SELECT path, chip_id, board_id, device_class FROM ipsw_identity "
+                    "WHERE path IN (SELECT path FROM ipsw " + where + ")", params):
+                identities.setdefault(path, []).append(tuple(identity))
+        return [IPSWEntry(path, size, version, build, product_types.get(path, []), error,
+                          identities.get(path, []))
+                for path, size, version, build, error in rows]
+
+    def entries(self, directory):
+        """All catalogued IPSW files in a directory, by name"""
+        directory = os.path.abspath(os.path.expanduser(directory))
+        entries = self._entries("WHERE directory = ?", (directory,))
+        return sorted(entries, key=lambda entry: entry.name)
+
+    def get(self, path):
+        """Catalog entry for a path, or None"""
+        entries = self._entries("WHERE path = ?", (os.path.abspath(path),))
+        return entries[0] if entries else None
+
+    def compatible(self, product_type):
+        """All catalogued firmware for a ProductType, newest first"""
+        entries = self._entries(
+            "WHERE path IN (SELECT path FROM ipsw_product_type WHERE product_type = ?)",
+            (product_type,))
+        return sorted(entries, key=lambda entry: version_key(entry.product_version), reverse=True)
@@ -0,0 +1,409 @@
+#!/usr/bin/env python3
+"""
+IPSW Fetch
+Download firmware from an HTTP mirror over parallel Range requests, with
+resume, streaming SHA-256 and registration in the firmware library
+
+The download goes to "<name>.part", preallocated to the full size, next to
+a "<name>.part.json" state file listing the chunks already written. An
+interrupted fetch of the same URL (same size and ETag) picks up where it
+stopped. Chunks are hashed in file order as they complete, so the digest
+is ready when the last chunk lands; the zip CRCs are then checked by
+IPSWVerifier and the file is renamed into place with a .sha256 sidecar.
+"""
+
+import hashlib
+import http.client
+import json
+import os
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from ipsw_catalog import library_dirs
+
+# Base URL of the firmware mirror, bare file names are fetched from here
+DEFAULT_MIRROR = os.environ.get("IPHONE_MANAGER_IPSW_MIRROR", "")
+
+CONNECTIONS = 8
+CHUNK_SIZE = 32 * 1024 * 1024
+READ_SIZE = 1024 * 1024
+STATE_INTERVAL = 1.0
+
+
+def download_dir():
+    """Where fetched firmware goes: the first $IPSW_LIBRARY directory, else ~/Downloads"""
+    dirs = library_dirs()
+    return dirs[1] if len(dirs) > 1 else dirs[0]
+
+
+def resolve_url(name, mirror=None):
+    """A full URL, or a file name relative to the mirror"""
+    if urllib.parse.urlsplit(name).scheme:
+        return name
+    mirror = mirror if mirror is not None else DEFAULT_MIRROR
+    if not mirror:
+        raise ValueError(f"{name!r} is not a URL and IPHONE_MANAGER_IPSW_MIRROR is not set")
+    return urllib.parse.urljoin(mirror.rstrip('/') + '/', urllib.parse.quote(name))
+
+
+class FetchResult:
+    """Outcome of one download"""
+
+    def __init__(self, url, path, ok, errors, size=0, seconds=0.0, resumed=0, sha256=None,
+                 connections=1):
+        self.url = url
+        self.path = path
+        self.ok = ok
+        self.errors = errors
+        self.size = size
+        self.seconds = seconds
+        self.resumed = resumed
+        self.sha256 = sha256
+        self.connections = connections
+
+    @property
+    def throughput(self):
+        """MB/s of the bytes transferred in this run"""
+        if self.seconds <= 0:
+            return 0.0
+        return (self.size - self.resumed) / self.seconds / (1024 * 1024)
+
+    @property
+    def summary(self):
+        detail = f"{self.size / (1024 * 1024):.1f} MB"
+        if self.seconds:
+            detail += (f" in {self.seconds:.1f}s, {self.throughput:.0f} MB/s over "
+                       f"{self.connections} connection(s)")
+        if self.resumed:
+            detail += f", resumed at {self.resumed / (1024 * 1024):.0f} MB"
+        if self.ok:
+            return f"downloaded ({detail})"
+        return f"download failed: {'; '.join(self.errors[:3])} ({detail})"
+
+
+class RemoteFile:
+    """Size and validators of a URL, from a one-byte Range request"""
+
+    def __init__(self, url, size, etag=None, last_modified=None, ranges=True):
+        self.url = url
+        self.size = size
+        self.etag = etag
+        self.last_modified = last_modified
+        self.ranges = ranges
+
+
+def _connect(url, timeout):
+    parts = urllib.parse.urlsplit(url)
+    if parts.scheme == 'https':
+        return http.client.HTTPSConnection(parts.netloc, timeout=timeout)
+    if parts.scheme == 'http':
+        return http.client.HTTPConnection(parts.netloc, timeout=timeout)
+    raise ValueError(f"unsupported URL scheme {parts.scheme!r}")
+
+
+def _target(url):
+    parts = urllib.parse.urlsplit(url)
+    return (parts.path or '/') + (f"?{parts.query}" if parts.query else '')
+
+
+class IPSWFetcher:
+    """Parallel ranged downloader; catalog and verifier are optional
+
+    on_progress(done_bytes, total_bytes) is called from the fetching thread,
+    at most every STATE_INTERVAL seconds and once at the end.
+    """
+
+    def __init__(self, connections=CONNECTIONS, chunk_size=CHUNK_SIZE, timeout=30.0, retries=3,
+                 catalog=None, verifier=None):
+        self.connections = max(1, int(connections))
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+        self.retries = retries
+        self.catalog = catalog
+        self.verifier = verifier
+        self._cancel = threading.Event()
+
+    def cancel(self):
+        """Stop a running fetch; the partial download is kept for resume"""
+        self._cancel.set()
+
+    def probe(self, url, redirects=5):
+        """RemoteFile for a URL, following redirects"""
+        for _ in range(redirects + 1):
+            conn = _connect(url, self.timeout)
+            try:
+                conn.request('GET', _target(url), headers={'Range': 'bytes=0-0'})
+                response = conn.getresponse()
+                # A 200 would be the whole file, only small bodies are drained
+                if response.status != 200:
+                    response.read()
+            finally:
+                conn.close()
+            if response.status in (301, 302, 303, 307, 308):
+                url = urllib.parse.urljoin(url, response.getheader('Location'))
+                continue
+            if response.status == 206:
+                total = response.getheader('Content-Range', '').rpartition('/')[2]
+                if not total.isdigit():
+                    raise OSError(f"{url}: missing Content-Range size")
+                return RemoteFile(url, int(total), response.getheader('ETag'),
+                                  response.getheader('Last-Modified'))
+            if response.status == 200:
+                # No Range support, a single stream it is
+                length = response.getheader('Content-Length')
+                return RemoteFile(url, int(length) if length else None,
+                                  response.getheader('ETag'), response.getheader('Last-Modified'),
+                                  ranges=False)
+            raise OSError(f"{url}: HTTP {response.status} {response.reason}")
+        raise OSError(f"{url}: too many redirects")
+
+    def expected_sha256(self, url):
+        """The digest from a "<url>.sha256" file on the mirror, or None"""
+        conn = _connect(url, self.timeout)
+        try:
+            conn.request('GET', _target(url) + '.sha256')
+            response = conn.getresponse()
+            body = response.read(4096)
+        except (OSError, http.client.HTTPException):
+            return None
+        finally:
+            conn.close()
+        if response.status != 200:
+            return None
+        fields = body.decode('ascii', errors='replace').split()
+        return fields[0].lower() if fields and len(fields[0]) == 64 else None
+
+    def fetch(self, url, dest_dir=None, sha256=None, on_progress=None):
+        """Download url into dest_dir (default download_dir()) and return a FetchResult"""
+        self._cancel.clear()
+        url = resolve_url(url)
+        dest_dir = os.path.expanduser(dest_dir or download_dir())
+        name = os.path.basename(urllib.parse.unquote(urllib.parse.urlsplit(url).path))
+        path = os.path.join(dest_dir, name)
+        start = time.monotonic()
+        try:
+            remote = self.probe(url)
+            expected = (sha256 or self.expected_sha256(remote.url) or "").lower() or None
+            os.makedirs(dest_dir, exist_ok=True)
+            if remote.ranges and remote.size:
+                digest, resumed = self._fetch_ranges(remote, path, on_progress)
+            else:
+                digest, resumed = self._fetch_stream(remote, path, on_progress), 0
+        except (OSError, ValueError, http.client.HTTPException) as e:
+            return FetchResult(url, path, False, [str(e) or type(e).__name__],
+                               seconds=time.monotonic() - start)
+        size = os.path.getsize(path + '.part')
+        seconds = time.monotonic() - start
+        connections = self.connections if remote.ranges else 1
+
+        errors = []
+        if expected and digest != expected:
+            errors.append(f"SHA-256 mismatch (expected {expected}, got {digest})")
+        if not errors and self.verifier:
+            result = self.verifier.verify(path + '.part')
+            errors += result.errors
+        if errors:
+            # A corrupt download is not resumable
+            self._discard(path)
+            return FetchResult(url, path, False, errors, size, seconds, resumed, digest,
+                               connections)
+
+        os.replace(path + '.part', path)
+        self._remove(path + '.part.json')
+        with open(path + '.sha256', 'w') as f:
+            f.write(f"{digest}  {name}\n")
+        if self.verifier and self.verifier.cache:
+            # Same inode after the rename: complete the cached verdict with the digest
+            self.verifier.cache.put(os.stat(path), True, [], digest)
+        if self.catalog:
+            self.catalog.add(path)
+        return FetchResult(url, path, True, [], size, seconds, resumed, digest, connections)
+
+    def _fetch_ranges(self, remote, path, on_progress):
+        part, state_path = path + '.part', path + '.part.json'
+        chunks = (remote.size + self.chunk_size - 1) // self.chunk_size
+        state = {'url': remote.url, 'size': remote.size, 'etag': remote.etag,
+                 'last_modified': remote.last_modified, 'chunk_size': self.chunk_size, 'done': []}
+        saved = self._load_state(state_path)
+        if (saved and os.path.exists(part) and os.path.getsize(part) == remote.size and
+                all(saved.get(key) == state[key] for key in ('url', 'size', 'etag',
+                                                             'last_modified', 'chunk_size'))):
+            state['done'] = sorted(set(saved.get('done', [])))
+        done = set(state['done'])
+        resumed = sum(self._chunk_length(remote.size, i) for i in done)
+
+        fd = os.open(part, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if not done:
+                os.ftruncate(fd, 0)
+                # Preallocate so chunks land in place and a full disk fails now, not at 90%
+                if hasattr(os, 'posix_fallocate'):
+                    os.posix_fallocate(fd, 0, remote.size)
+                else:
+                    os.ftruncate(fd, remote.size)
+            self._save_state(state_path, state)
+
+            digest = hashlib.sha256()
+            hashed = 0
+            written = resumed
+            last_report = 0.0
+            pending = [i for i in range(chunks) if i not in done]
+            # Set on the way out so workers stop after the first failure
+            stop = threading.Event()
+            with ThreadPoolExecutor(max_workers=self.connections,
+                                    thread_name_prefix="ipsw-fetch") as pool:
+                connections = threading.local()
+                futures = {}
+                try:
+                    futures = {pool.submit(self._fetch_chunk, remote, fd, i, connections, stop): i
+                               for i in pending}
+                    while futures or hashed < chunks:
+                        # Hash every chunk that is now contiguous with the digest
+                        while hashed < chunks and hashed in done:
+                            self._hash_chunk(digest, fd, remote.size, hashed)
+                            hashed += 1
+                        if not futures:
+                            continue
+                        finished, _ = wait(futures, return_when=FIRST_COMPLETED)
+                        for future in finished:
+                            i = futures.pop(future)
+                            future.result()
+                            done.add(i)
+                            written += self._chunk_length(remote.size, i)
+                        now = time.monotonic()
+                        if now - last_report >= STATE_INTERVAL:
+                            last_report = now
+                            # Data first, so the state never lists a chunk that is not on disk
+                            os.fdatasync(fd)
+                            state['done'] = sorted(done)
+                            self._save_state(state_path, state)
+                            if on_progress:
+                                on_progress(written, remote.size)
+                finally:
+                    stop.set()
+                    for future in futures:
+                        future.cancel()
+                    # Keep what was finished before the failure for the next run
+                    state['done'] = sorted(done)
+                    os.fdatasync(fd)
+                    self._save_state(state_path, state)
+        finally:
+            os.close(fd)
+        if on_progress:
+            on_progress(remote.size, remote.size)
+        return digest.hexdigest(), resumed
+
+    def _fetch_chunk(self, remote, fd, index, connections, stop):
+        start = index * self.chunk_size
+        end = start + self._chunk_length(remote.size, index) - 1
+        for attempt in range(self.retries + 1):
+            if self._cancel.is_set() or stop.is_set():
+                raise OSError("download cancelled")
+            conn = getattr(connections, 'conn', None)
+            try:
+                if conn is None:
+                    # One keep-alive connection per worker thread
+                    conn = connections.conn = _connect(remote.url, self.timeout)
+                headers = {'Range': f"bytes={start}-{end}"}
+                if remote.etag:
+                    headers['If-Range'] = remote.etag
+                conn.request('GET', _target(remote.url), headers=headers)
+                response = conn.getresponse()
+                if response.status == 200:
+                    # If-Range failed: the mirror now serves a different file
+                    raise OSError(f"{remote.url} changed on the mirror, fetch it again")
+                if response.status != 206:
+                    response.read()
+                    raise OSError(f"HTTP {response.status} for bytes {start}-{end}")
+                offset = start
+                while offset <= end:
+                    if self._cancel.is_set() or stop.is_set():
+                        raise OSError("download cancelled")
+                    data = response.read(min(READ_SIZE, end + 1 - offset))
+                    if not data:
+                        raise OSError(f"connection closed at byte {offset}")
+                    os.pwrite(fd, data, offset)
+                    offset += len(data)
+                return
+            except (OSError, http.client.HTTPException) as e:
+                if conn is not None:
+                    conn.close()
+                connections.conn = None
+                if (self._cancel.is_set() or stop.is_set() or attempt == self.retries or
+                        "changed on the mirror" in str(e)):
+                    raise
+                time.sleep(min(8.0, 0.5 * 2 ** attempt))
+
+    def _fetch_stream(self, remote, path, on_progress):
+        """Single GET for mirrors without Range support; not resumable"""
+        part = path + '.part'
+        digest = hashlib.sha256()
+        conn = _connect(remote.url, self.timeout)
+        try:
+            conn.request('GET', _target(remote.url))
+            response = conn.getresponse()
+            if response.status != 200:
+                raise OSError(f"HTTP {response.status} {response.reason}")
+            written = 0
+            last_report = 0.0
+            with open(part, 'wb') as f:
+                while True:
+                    if self._cancel.is_set():
+                        raise OSError("download cancelled")
+                    data = response.read(READ_SIZE)
+                    if not data:
+                        break
+                    f.write(data)
+                    digest.update(data)
+                    written += len(data)
+                    if on_progress and time.monotonic() - last_report >= STATE_INTERVAL:
+                        last_report = time.monotonic()
+                        on_progress(written, remote.size or written)
+        finally:
+            conn.close()
+        if remote.size is not None and written != remote.size:
+            raise OSError(f"short download: {written} of {remote.size} bytes")
+        if on_progress:
+            on_progress(written, written)
+        return digest.hexdigest()
+
+    def _chunk_length(self, size, index):
+        return min(self.chunk_size, size - index * self.chunk_size)
+
+    def _hash_chunk(self, digest, fd, size, index):
+        offset = index * self.chunk_size
+        end = offset + self._chunk_length(size, index)
+        while offset < end:
+            data = os.pread(fd, min(READ_SIZE, end - offset), offset)
+            if not data:
+                raise OSError(f"short read at byte {offset}")
+            digest.update(data)
+            offset += len(data)
+
+    @staticmethod
+    def _load_state(state_path):
+        try:
+            with open(state_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def _save_state(state_path, state):
+        tmp = state_path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp, state_path)
+
+    def _discard(self, path):
+        for suffix in ('.part', '.part.json'):
+            self._remove(path + suffix)
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
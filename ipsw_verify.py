@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+"""
+IPSW Verifier
+Pre-flight integrity check of IPSW archives: every member's CRC-32 and an
+optional whole-file SHA-256, computed in parallel over a memory map
+"""
+
+import hashlib
+import mmap
+import os
+import sqlite3
+import struct
+import threading
+import time
+import zipfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_CACHE_PATH = os.path.expanduser("~/.cache/iphone_firmware_manager/verify_cache.db")
+
+# Stored members are split into chunks of this size so one large root
+# filesystem image is spread over all workers
+CHUNK_SIZE = 64 * 1024 * 1024
+READ_SIZE = 4 * 1024 * 1024
+
+LOCAL_HEADER = struct.Struct('<IHHHHHIIIHH')
+LOCAL_HEADER_SIGNATURE = 0x04034b50
+
+
+def _gf2_matrix_times(mat, vec):
+    total = 0
+    i = 0
+    while vec:
+        if vec & 1:
+            total ^= mat[i]
+        vec >>= 1
+        i += 1
+    return total
+
+
+def _gf2_matrix_square(mat):
+    return [_gf2_matrix_times(mat, mat[n]) for n in range(32)]
+
+
+def crc32_combine(crc1, crc2, len2):
+    """CRC-32 of A+B from crc32(A), crc32(B) and len(B), as zlib's crc32_combine"""
+    if len2 <= 0:
+        return crc1
+    odd = [0xedb88320] + [1 << n for n in range(31)]
+    even = _gf2_matrix_square(odd)
+    odd = _gf2_matrix_square(even)
+    while True:
+        even = _gf2_matrix_square(odd)
+        if len2 & 1:
+            crc1 = _gf2_matrix_times(even, crc1)
+        len2 >>= 1
+        if not len2:
+            break
+        odd = _gf2_matrix_square(even)
+        if len2 & 1:
+            crc1 = _gf2_matrix_times(odd, crc1)
+        len2 >>= 1
+        if not len2:
+            break
+    return crc1 ^ crc2
+
+
+class VerifyResult:
+    """Outcome of verifying one IPSW"""
+
+    def __init__(self, path, ok, errors, size, seconds=0.0, members=0, cached=False, sha256=None):
+        self.path = path
+        self.ok = ok
+        self.errors = errors
+        self.size = size
+        self.seconds = seconds
+        self.members = members
+        self.cached = cached
+        self.sha256 = sha256
+
+    @property
+    def throughput(self):
+        """Bytes per second"""
+        return self.size / self.seconds if self.seconds else 0.0
+
+    @property
+    def summary(self):
+        size_mb = self.size / (1024 * 1024)
+        if self.cached:
+            detail = "cached result"
+        else:
+            detail = f"{self.members} members, {self.throughput / (1024 * 1024):.0f} MB/s"
+        if self.ok:
+            return f"{size_mb:.1f} MB verified ({detail})"
+        return f"verification failed: {'; '.join(self.errors[:3])} ({detail})"
+
+
+class VerifyCache:
+    """Verdicts keyed by (device, inode, size, mtime) so unchanged files are never re-hashed"""
+
+    def __init__(self, db_path=DEFAULT_CACHE_PATH):
+        if db_path != ':memory:':
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.db = sqlite3.connect(db_path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self.db:
+            self.db.execute("""
+                CREATE TABLE IF NOT EXISTS verdict (
+                    dev INTEGER, inode INTEGER, size INTEGER, mtime_ns INTEGER,
+                    crc_ok INTEGER, errors TEXT, sha256 TEXT,
+                    PRIMARY KEY (dev, inode, size, mtime_ns)
+                )""")
+
+    @staticmethod
+    def key(st):
+        return (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+
+    def get(self, st):
+        """Return (crc_ok, errors, sha256) or None"""
+        with self._lock:
+            row = self.db.execute(
+                "SELECT crc_ok, errors, sha256 FROM verdict "
+                "WHERE dev = ? AND inode = ? AND size = ? AND mtime_ns = ?", self.key(st)
+            ).fetchone()
+        if row is None:
+            return None
+        return bool(row[0]), [e for e in row[1].split('\n') if e], row[2]
+
+    def put(self, st, crc_ok, errors, sha256=None):
+        with self._lock, self.db:
+            self.db.execute("INSERT OR REPLACE INTO verdict VALUES (?, ?, ?, ?, ?, ?, ?)",
+                            self.key(st) + (int(crc_ok), '\n'.join(errors), sha256))
+
+
+class IPSWVerifier:
+    """Check the CRC-32 of every zip member (and optionally the SHA-256) of an IPSW"""
+
+    def __init__(self, workers=None, cache=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.cache = cache
+
+    def verify(self, path, sha256=None):
+        """Verify an IPSW and return a VerifyResult"""
+        st = os.stat(path)
+        expected_sha256 = sha256.lower() if sha256 else None
+
+        cached = self.cache.get(st) if self.cache else None
+        check_crc = True
+        if cached is not None:
+            crc_ok, errors, known_sha256 = cached
+            if not crc_ok or expected_sha256 is None or known_sha256:
+                return self._result(path, st, crc_ok, errors, known_sha256, expected_sha256,
+                                    cached=True)
+            # CRCs already verified, only the digest is missing
+            check_crc = False
+
+        start = time.monotonic()
+        with open(path, 'rb') as f:
+            infos = []
+            if check_crc:
+                try:
+                    with zipfile.ZipFile(f) as archive:
+                        infos = archive.infolist()
+                except zipfile.BadZipFile as e:
+                    errors = [f"not a valid zip archive ({e})"]
+                    if self.cache:
+                        self.cache.put(st, False, errors)
+                    return VerifyResult(path, False, errors, st.st_size, time.monotonic() - start)
+
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                view = memoryview(mapped)
+                try:
+                    with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                        # The digest is sequential, it runs alongside the CRC workers
+                        sha_future = pool.submit(self._sha256, view) if expected_sha256 else None
+                        errors, members = [], 0
+                        if check_crc:
+                            errors, members = self._check_members(pool, f, view, infos,
+                                                                  st.st_size)
+                        digest = sha_future.result() if sha_future else None
+                finally:
+                    view.release()
+
+        if self.cache:
+            self.cache.put(st, not errors, errors, digest)
+        return self._result(path, st, not errors, errors, digest, expected_sha256,
+                            seconds=time.monotonic() - start, members=members)
+
+    @staticmethod
+    def _result(path, st, crc_ok, errors, digest, expected_sha256, seconds=0.0, members=0,
+                cached=False):
+        errors = list(errors)
+        if expected_sha256 and digest != expected_sha256:
+            errors.append(f"SHA-256 mismatch (expected {expected_sha256}, got {digest})")
+        return VerifyResult(path, crc_ok and not errors, errors, st.st_size, seconds, members,
+                            cached, digest)
+
+    def _check_members(self, pool, f, view, infos, file_size):
+        errors = []
+        jobs = []
+        for info in infos:
+            if info.is_dir():
+                continue
+            start = self._data_offset(view, info)
+            if start is None:
+                errors.append(f"{info.filename}: bad local header")
+                continue
+            end = start + info.compress_size
+            if end > file_size:
+                errors.append(f"{info.filename}: truncated")
+                continue
+
+            if info.compress_type == zipfile.ZIP_STORED:
+                chunks = [pool.submit(zlib.crc32, view[offset:min(offset + CHUNK_SIZE, end)])
+                          for offset in range(start, end, CHUNK_SIZE)]
+                jobs.append((info, 'stored', chunks))
+            elif info.compress_type == zipfile.ZIP_DEFLATED:
+                jobs.append((info, 'deflated', pool.submit(self._inflate_crc, view[start:end])))
+            else:
+                jobs.append((info, 'other', pool.submit(self._zipfile_crc, f.name, info)))
+
+        for info, kind, work in jobs:
+            if kind == 'stored':
+                crc = 0
+                for offset, future in zip(range(0, info.compress_size, CHUNK_SIZE), work):
+                    length = min(CHUNK_SIZE, info.compress_size - offset)
+                    crc = crc32_combine(crc, future.result(), length)
+                size = info.compress_size
+            else:
+                crc, size = work.result()
+
+            if size != info.file_size:
+                errors.append(f"{info.filename}: size mismatch")
+            elif crc != info.CRC:
+                errors.append(f"{info.filename}: CRC mismatch")
+
+        return errors, len(jobs)
+
+    @staticmethod
+    def _data_offset(view, info):
+        offset = info.header_offset
+        if offset + LOCAL_HEADER.size > len(view):
+            return None
+        header = LOCAL_HEADER.unpack_from(view, offset)
+        if header[0] != LOCAL_HEADER_SIGNATURE:
+            return None
+        return offset + LOCAL_HEADER.size + header[9] + header[10]
+
+    @staticmethod
+    def _inflate_crc(data):
+        """Return (crc32, uncompressed size) of a raw deflate stream"""
+        inflater = zlib.decompressobj(-zlib.MAX_WBITS)
+        crc = 0
+        size = 0
+        try:
+            for offset in range(0, len(data), READ_SIZE):
+                chunk = inflater.decompress(data[offset:offset + READ_SIZE])
+                crc = zlib.crc32(chunk, crc)
+                size += len(chunk)
+            chunk = inflater.flush()
+        except zlib.error:
+            return None, -1
+        crc = zlib.crc32(chunk, crc)
+        return crc, size + len(chunk)
+
+    @staticmethod
+    def _zipfile_crc(path, info):
+        """Fallback for compression methods other than stored/deflate"""
+        crc = 0
+        size = 0
+        try:
+            with zipfile.ZipFile(path) as archive, archive.open(info) as member:
+                while True:
+                    chunk = member.read(READ_SIZE)
+                    if not chunk:
+                        break
+                    crc = zlib.crc32(chunk, crc)
+                    size += len(chunk)
+        except (zipfile.BadZipFile, NotImplementedError, OSError):
+            return None, -1
+        return crc, size
+
+    @staticmethod
+    def _sha256(view):
+        digest = hashlib.sha256()
+        for offset in range(0, len(view), READ_SIZE):
+            digest.update(view[offset:offset + READ_SIZE])
+        return digest.hexdigest()
+
+
+def read_sha256_file(path):
+    """Expected SHA-256 from a "<file>.sha256" sidecar (sha256sum format), or None"""
+    try:
+        with open(path + '.sha256') as f:
+            fields = f.read().split()
+    except OSError:
+        return None
+    return fields[0].lower() if fields else None
+
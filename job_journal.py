@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+"""
+Job Journal
+Crash-safe SQLite (WAL) journal of restore jobs and their state transitions
+
+A job is queued, then running, then succeeded, failed or cancelled. Jobs
+that fail with a known-transient USB error go to "retry" and are due again
+after an exponential backoff, up to max_attempts per device: attempts are
+counted over every job for the device within the last retry_window
+seconds, so queueing it again right away does not reset the budget but an
+old run of failures does not hold back a later batch. Active jobs of a
+process that died are adopted, and requeued if they were running, by
+recover().
+"""
+
+import contextlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+DEFAULT_JOURNAL_PATH = os.path.expanduser("~/.cache/iphone_firmware_manager/jobs.db")
+
+# Seconds of a device's attempt history that count against its retry budget
+DEFAULT_RETRY_WINDOW = 30 * 60
+
+QUEUED = "queued"
+RUNNING = "running"
+RETRY = "retry"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+ACTIVE_STATES = (QUEUED, RUNNING, RETRY)
+
+# Checked first: these never get better by trying again
+PERMANENT_RE = re.compile(
+    r"not (?:compatible|supported)|isn'?t eligible|not (?:being )?signed|"
+    r"TSS|SHSH|APTicket|Unable to find|No such file|Invalid IPSW|"
+    r"BuildIdentity|unsupported (?:device|firmware)", re.IGNORECASE)
+
+TRANSIENT_RE = re.compile(
+    r"timed? ?out|timeout|LIBUSB_ERROR|libusb|USB (?:transfer|error)|"
+    r"Unable to (?:connect|send|receive|open)|could not connect|"
+    r"device (?:did not|didn'?t) (?:reconnect|come back)|No device found|"
+    r"Unable to discover device|Broken pipe|Connection (?:reset|refused)|"
+    r"Resource temporarily unavailable|ASR|usbmuxd", re.IGNORECASE)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS job (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    key TEXT UNIQUE,
+    device TEXT NOT NULL,
+    port TEXT,
+    ipsw TEXT NOT NULL,
+    sha256 TEXT,
+    options TEXT NOT NULL,
+    state TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    next_attempt_at REAL NOT NULL,
+    owner_pid INTEGER,
+    returncode INTEGER,
+    last_error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS job_due ON job(state, next_attempt_at);
+CREATE INDEX IF NOT EXISTS job_device ON job(device);
+CREATE TABLE IF NOT EXISTS transition (
+    job_id INTEGER NOT NULL REFERENCES job(id) ON DELETE CASCADE,
+    at REAL NOT NULL,
+    from_state TEXT,
+    to_state TEXT NOT NULL,
+    detail TEXT
+);
+CREATE INDEX IF NOT EXISTS transition_job ON transition(job_id);
+"""
+
+
+def classify_failure(returncode, errors=()):
+    """True if a failed idevicerestore run is worth retrying
+
+    errors are the ERROR lines (or last output lines) of the run. A run
+    killed by a signal or by our timeout is transient, a cancelled one is not
+    retried by the caller.
+    """
+    text = "\n".join(errors)
+    if PERMANENT_RE.search(text):
+        return False
+    if returncode is not None and returncode < 0:
+        return True
+    return bool(TRANSIENT_RE.search(text))
+
+
+def backoff_delay(attempt, base=30.0, cap=600.0):
+    """Seconds before retry number `attempt` (1-based): base, 2*base, 4*base ... cap"""
+    return min(cap, base * (2 ** max(0, attempt - 1)))
+
+
+class Job:
+    """One row of the journal"""
+
+    COLUMNS = ("id", "key", "device", "port", "ipsw", "sha256", "options", "state", "attempts",
+               "max_attempts", "next_attempt_at", "owner_pid", "returncode", "last_error",
+               "created_at", "updated_at")
+
+    def __init__(self, row):
+        for name, value in zip(self.COLUMNS, row):
+            setattr(self, name, value)
+        self.options = json.loads(self.options)
+
+    @property
+    def active(self):
+        return self.state in ACTIVE_STATES
+
+    def __repr__(self):
+        return f"Job({self.id}, {self.device!r}, {self.state!r}, attempt {self.attempts})"
+
+
+class JobJournal:
+    """Durable restore queue shared by every front-end on this machine"""
+
+    def __init__(self, db_path=DEFAULT_JOURNAL_PATH, max_attempts=3, backoff_base=30.0,
+                 backoff_cap=600.0, retry_window=DEFAULT_RETRY_WINDOW):
+        if db_path != ':memory:':
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.db = sqlite3.connect(db_path, check_same_thread=False, timeout=30,
+                                  isolation_level=None)
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.retry_window = retry_window
+        self._lock = threading.Lock()
+        with self._lock:
+            # WAL lets readers run during writes; NORMAL still survives a process crash
+            self.db.execute("PRAGMA journal_mode = WAL")
+            self.db.execute("PRAGMA synchronous = NORMAL")
+            self.db.execute("PRAGMA foreign_keys = ON")
+            self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        """BEGIN IMMEDIATE ... COMMIT, serialised with other threads of this process"""
+        with self._lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                yield self.db
+            except BaseException:
+                self.db.execute("ROLLBACK")
+                raise
+            self.db.execute("COMMIT")
+
+    def _move(self, db, job_id, from_state, to_state, detail=None, **fields):
+        now = time.time()
+        fields['state'] = to_state
+        fields['updated_at'] = now
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        db.execute(f"UPDATE job SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+        db.execute("INSERT INTO transition VALUES (?, ?, ?, ?, ?)",
+                   (job_id, now, from_state, to_state, detail))
+
+    def enqueue(self, device, ipsw, options=None, sha256=None, key=None, max_attempts=None):
+        """Queue one job, return its id; an existing active job with the same key is reused"""
+        return self.enqueue_many([(device, ipsw, options, sha256, key, max_attempts)])[0]
+
+    def enqueue_many(self, jobs):
+        """Queue (device, ipsw, options, sha256, key, max_attempts) tuples in one transaction"""
+        now = time.time()
+        ids = []
+        with self._transaction() as db:
+            for device, ipsw, options, sha256, key, max_attempts in jobs:
+                if key is not None:
+                    row = db.execute("SELECT id, state FROM job WHERE key = ?", (key,)).fetchone()
+                    if row and row[1] in ACTIVE_STATES:
+                        ids.append(row[0])
+                        continue
+                    if row:
+                        # The finished job keeps its history but gives up the key
+                        db.execute("UPDATE job SET key = NULL WHERE id = ?", (row[0],))
+                job_id = db.execute(
+                    "INSERT INTO job (key, device, ipsw, sha256, options, state, max_attempts, "
+                    "next_attempt_at, owner_pid, created_at, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (key, device, ipsw, sha256, json.dumps(options or {}), QUEUED,
+                     max_attempts or self.max_attempts, now, os.getpid(), now, now)).lastrowid
+                db.execute("INSERT INTO transition VALUES (?, ?, NULL, ?, NULL)",
+                           (job_id, now, QUEUED))
+                ids.append(job_id)
+        return ids
+
+    def recover(self):
+        """Adopt the active jobs of processes that are gone, return their ids
+
+        Jobs they left running are requeued. Call once at startup: a job
+        owned by this pid can only be left over from an earlier process with
+        the same pid.
+        """
+        recovered = []
+        with self._transaction() as db:
+            rows = db.execute(f"SELECT id, state, owner_pid FROM job WHERE state IN "
+                              f"({', '.join('?' * len(ACTIVE_STATES))})", ACTIVE_STATES).fetchall()
+            for job_id, state, pid in rows:
+                if pid != os.getpid() and pid_alive(pid):
+                    continue
+                if state == RUNNING:
+                    self._move(db, job_id, RUNNING, QUEUED, "interrupted", owner_pid=os.getpid(),
+                               next_attempt_at=time.time())
+                else:
+                    db.execute("UPDATE job SET owner_pid = ? WHERE id = ?", (os.getpid(), job_id))
+                recovered.append(job_id)
+        return recovered
+
+    def start(self, job_id):
+        """Mark a due job running and count the attempt; False if it is not due any more"""
+        with self._transaction() as db:
+            row = db.execute("SELECT state FROM job WHERE id = ?", (job_id,)).fetchone()
+            if not row or row[0] not in (QUEUED, RETRY):
+                return False
+            db.execute("UPDATE job SET attempts = attempts + 1 WHERE id = ?", (job_id,))
+            self._move(db, job_id, row[0], RUNNING, owner_pid=os.getpid())
+        return True
+
+    def bind(self, job_id, port):
+        """Remember the USB port a job's device was found on, for retries after re-enumeration"""
+        with self._lock:
+            self.db.execute("UPDATE job SET port = ? WHERE id = ?", (port, job_id))
+
+    def finish(self, job_id, returncode, errors=(), cancelled=False):
+        """Record the outcome of an attempt, return the job's new state"""
+        error = errors[-1] if errors and returncode != 0 else None
+        with self._transaction() as db:
+            job = Job(db.execute(f"SELECT {', '.join(Job.COLUMNS)} FROM job WHERE id = ?",
+                                 (job_id,)).fetchone())
+            retry = returncode != 0 and not cancelled and classify_failure(returncode, errors)
+            attempts = self._device_attempts(db, job) if retry else job.attempts
+            if returncode == 0:
+                state, detail, delay = SUCCEEDED, None, 0
+            elif cancelled:
+                state, detail, delay = CANCELLED, "cancelled", 0
+            elif retry and attempts < job.max_attempts:
+                delay = backoff_delay(attempts, self.backoff_base, self.backoff_cap)
+                state, detail = RETRY, f"transient failure, retry in {delay:.0f}s"
+            else:
+                state, detail, delay = FAILED, error, 0
+            # A job waiting for its retry stays with this process
+            self._move(db, job_id, job.state, state, detail, returncode=returncode,
+                       last_error=error, owner_pid=os.getpid() if state == RETRY else None,
+                       next_attempt_at=time.time() + delay)
+        return state
+
+    def _device_attempts(self, db, job):
+        """Attempts on a job's device over all of its jobs, within the retry window
+
+        Attempts before the device's last success do not count. An "any"
+        job has no fixed device and only counts its own attempts.
+        """
+        if job.device == 'any':
+            return job.attempts
+        since = time.time() - self.retry_window
+        succeeded = db.execute("SELECT MAX(updated_at) FROM job WHERE device = ? AND state = ?",
+                               (job.device, SUCCEEDED)).fetchone()[0]
+        if succeeded:
+            since = max(since, succeeded)
+        attempts = db.execute(
+            "SELECT COUNT(*) FROM transition JOIN job ON job.id = transition.job_id "
+            "WHERE job.device = ? AND transition.to_state = ? AND transition.at > ?",
+            (job.device, RUNNING, since)).fetchone()[0]
+        # The job's own attempts count even if the clock stepped back
+        return max(attempts, job.attempts)
+
+    def cancel(self, job_id):
+        """Cancel a job that is not running"""
+        with self._transaction() as db:
+            row = db.execute("SELECT state FROM job WHERE id = ?", (job_id,)).fetchone()
+            if row and row[0] in (QUEUED, RETRY):
+                self._move(db, job_id, row[0], CANCELLED, "cancelled", owner_pid=None)
+                return True
+        return False
+
+    def get(self, job_id):
+        with self._lock:
+            row = self.db.execute(f"SELECT {', '.join(Job.COLUMNS)} FROM job WHERE id = ?",
+                                  (job_id,)).fetchone()
+        return Job(row) if row else None
+
+    def jobs(self, states=None, ids=None):
+        """Jobs by state and/or id, oldest first"""
+        query = f"SELECT {', '.join(Job.COLUMNS)} FROM job WHERE 1"
+        params = []
+        if states:
+            query += f" AND state IN ({', '.join('?' * len(states))})"
+            params += list(states)
+        if ids is not None:
+            query += f" AND id IN ({', '.join('?' * len(ids))})"
+            params += list(ids)
+        with self._lock:
+            rows = self.db.execute(query + " ORDER BY id", params).fetchall()
+        return [Job(row) for row in rows]
+
+    def history(self, job_id):
+        """[(at, from_state, to_state, detail)] of one job"""
+        with self._lock:
+            return self.db.execute("SELECT at, from_state, to_state, detail FROM transition "
+                                   "WHERE job_id = ? ORDER BY rowid", (job_id,)).fetchall()
+
+
+def pid_alive(pid):
+    """True if a process with this pid runs; shared by every store that records owner pids"""
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    # A killed manager stays a zombie until its parent reaps it
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            return f.read().rsplit(')', 1)[1].split()[0] != 'Z'
+    except (OSError, IndexError):
+        return True
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Log Pipeline
+Thread-safe, coalescing log sink for the Tk text widget
+"""
+
+import os
+import queue
+import time
+
+DEFAULT_LOG_DIR = os.path.expanduser("~/.cache/iphone_firmware_manager/logs")
+
+
+class LogPipeline:
+    """Queue log lines from any thread and insert them in batches on the Tk main loop
+
+    The widget keeps only the last max_lines lines; every line is also
+    appended to spill_path so nothing is lost.
+    """
+
+    def __init__(self, widget, root, max_lines=5000, fps=30, spill_path=None):
+        self.widget = widget
+        self.root = root
+        self.max_lines = max_lines
+        self.interval_ms = max(1, int(1000 / fps))
+        self.spill_path = spill_path
+        self.lines_written = 0
+        self._queue = queue.SimpleQueue()
+        self._visible = 0
+        self._spill = None
+        self._after_id = None
+        if spill_path:
+            os.makedirs(os.path.dirname(spill_path), exist_ok=True)
+            self._spill = open(spill_path, 'a', encoding='utf-8')
+
+    @staticmethod
+    def default_spill_path():
+        return os.path.join(DEFAULT_LOG_DIR, time.strftime("gui-%Y%m%d-%H%M%S.log"))
+
+    def write(self, line):
+        """Queue one line, safe to call from any thread"""
+        self._queue.put(line)
+
+    def start(self):
+        """Start draining on the Tk main loop"""
+        if self._after_id is None:
+            self._after_id = self.root.after(self.interval_ms, self._tick)
+
+    def stop(self):
+        if self._after_id is not None:
+            self.root.after_cancel(self._after_id)
+            self._after_id = None
+        self.drain()
+
+    def close(self):
+        self.stop()
+        if self._spill:
+            self._spill.close()
+            self._spill = None
+
+    def clear(self):
+        """Clear the widget, the spill file keeps the full log"""
+        self.widget.delete('1.0', 'end')
+        self._visible = 0
+
+    def _tick(self):
+        self.drain()
+        self._after_id = self.root.after(self.interval_ms, self._tick)
+
+    def drain(self):
+        """Move every queued line to the spill file and the widget, return the count"""
+        lines = []
+        try:
+            while True:
+                lines.append(self._queue.get_nowait())
+        except queue.Empty:
+            pass
+        if not lines:
+            return 0
+
+        text = '\n'.join(lines) + '\n'
+        if self._spill:
+            self._spill.write(text)
+            self._spill.flush()
+        self.lines_written += len(lines)
+
+        # Lines that would be trimmed straight away are only spilled
+        if len(lines) > self.max_lines:
+            lines = lines[-self.max_lines:]
+            text = '\n'.join(lines) + '\n'
+        count = text.count('\n')
+
+        self.widget.insert('end', text)
+        self._visible += count
+        excess = self._visible - self.max_lines
+        if excess > 0:
+            self.widget.delete('1.0', f'{excess + 1}.0')
+            self._visible -= excess
+        self.widget.see('end')
+        return len(lines)
@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+"""
+Log Store
+Raw idevicerestore output of every session, one gzip file per device and
+session, rotated under a disk budget, with an SQLite index for queries
+
+The index keeps device, firmware, outcome, the phase a session ended in
+and its error lines, so "every failure in the baseband phase this week"
+is one indexed query; only the logs actually opened are decompressed.
+Index rows outlive their rotated logs (path is then NULL).
+"""
+
+import contextlib
+import gzip
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from job_journal import pid_alive
+
+DEFAULT_LOG_DIR = os.environ.get(
+    "IPHONE_MANAGER_LOG_DIR",
+    os.path.expanduser("~/.cache/iphone_firmware_manager/logs"))
+
+# Disk budget for compressed logs in MiB
+DEFAULT_BUDGET = int(float(os.environ.get("IPHONE_MANAGER_LOG_BUDGET_MB", "1024")) * 2**20)
+
+# zlib level 6 compresses debug-level restore output about 20:1
+COMPRESS_LEVEL = 6
+# Seconds between sync flushes, so a crash loses at most this much of a log
+FLUSH_INTERVAL = 5.0
+# Error lines indexed per session
+MAX_ERROR_LINES = 50
+
+SUCCESS = "success"
+FAILURE = "failure"
+CANCELLED = "cancelled"
+RUNNING = "running"
+# A session whose process died before it finished
+INTERRUPTED = "interrupted"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS session (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    device TEXT NOT NULL,
+    ipsw TEXT,
+    build TEXT,
+    started_at REAL NOT NULL,
+    ended_at REAL,
+    returncode INTEGER,
+    outcome TEXT NOT NULL,
+    phase TEXT,
+    errors INTEGER NOT NULL DEFAULT 0,
+    lines INTEGER NOT NULL DEFAULT 0,
+    raw_bytes INTEGER NOT NULL DEFAULT 0,
+    compressed_bytes INTEGER NOT NULL DEFAULT 0,
+    path TEXT,
+    pid INTEGER
+);
+CREATE INDEX IF NOT EXISTS session_started ON session(started_at);
+CREATE INDEX IF NOT EXISTS session_device ON session(device, started_at);
+CREATE INDEX IF NOT EXISTS session_outcome ON session(outcome, phase, started_at);
+CREATE INDEX IF NOT EXISTS session_build ON session(build, started_at);
+CREATE TABLE IF NOT EXISTS error_line (
+    session_id INTEGER NOT NULL REFERENCES session(id) ON DELETE CASCADE,
+    phase TEXT,
+    text TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS error_line_session ON error_line(session_id);
+"""
+
+UNSAFE_RE = re.compile(r"[^A-Za-z0-9._-]")
+
+
+class LogSession:
+    """One row of the index"""
+
+    COLUMNS = ("id", "device", "ipsw", "build", "started_at", "ended_at", "returncode", "outcome",
+               "phase", "errors", "lines", "raw_bytes", "compressed_bytes", "path")
+
+    def __init__(self, row):
+        for name, value in zip(self.COLUMNS, row):
+            setattr(self, name, value)
+
+    @property
+    def duration(self):
+        return (self.ended_at or time.time()) - self.started_at
+
+    @property
+    def summary(self):
+        when = time.strftime("%Y-%m-%d %H:%M", time.localtime(self.started_at))
+        phase = f" in {self.phase}" if self.phase and self.outcome != SUCCESS else ""
+        return (f"#{self.id} {when} {self.device} {self.build or self.ipsw or '?'} "
+                f"{self.outcome}{phase}, {self.errors} error(s), {self.duration:.0f}s")
+
+    def __repr__(self):
+        return f"LogSession({self.id}, {self.device!r}, {self.outcome!r}, {self.phase!r})"
+
+
+class SessionLog:
+    """Writer for the log of one running session; not thread-safe, one per restore"""
+
+    def __init__(self, store, session_id, path):
+        self.store = store
+        self.session_id = session_id
+        self.path = path
+        self.lines = 0
+        self.raw_bytes = 0
+        self.errors = []
+        self.error_count = 0
+        self.closed = False
+        self._file = gzip.open(path, 'wt', compresslevel=COMPRESS_LEVEL, encoding='utf-8',
+                               errors='replace')
+        self._next_flush = time.monotonic() + FLUSH_INTERVAL
+
+    def write(self, text):
+        """Append one output line"""
+        self._file.write(text)
+        self._file.write('\n')
+        self.lines += 1
+        self.raw_bytes += len(text) + 1
+        if self.lines % 256 == 0 and time.monotonic() >= self._next_flush:
+            self.flush()
+
+    def error(self, phase, text):
+        """Index an error line (it is written to the log as a line as well)"""
+        self.error_count += 1
+        if len(self.errors) < MAX_ERROR_LINES:
+            self.errors.append((phase, text))
+
+    def flush(self):
+        self._file.flush()
+        self._next_flush = time.monotonic() + FLUSH_INTERVAL
+
+    def close(self, returncode, phase=None, cancelled=False):
+        """Finish the log and its index row; see LogStore.finish()"""
+        self.store.finish(self, returncode, phase, cancelled)
+
+
+class LogStore:
+    """Compressed per-session restore logs plus their SQLite index"""
+
+    def __init__(self, log_dir=DEFAULT_LOG_DIR, budget=DEFAULT_BUDGET, catalog=None):
+        self.log_dir = log_dir
+        self.budget = budget
+        # Optional IPSWCatalog, to index the build of the firmware
+        self.catalog = catalog
+        os.makedirs(log_dir, exist_ok=True)
+        self.db = sqlite3.connect(os.path.join(log_dir, "index.db"), check_same_thread=False,
+                                  timeout=30, isolation_level=None)
+        self._lock = threading.Lock()
+        with self._lock:
+            self.db.execute("PRAGMA journal_mode = WAL")
+            self.db.execute("PRAGMA synchronous = NORMAL")
+            self.db.execute("PRAGMA foreign_keys = ON")
+            self.db.executescript(SCHEMA)
+        self._recover()
+
+    def close(self):
+        self.db.close()
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        with self._lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                yield self.db
+            except BaseException:
+                self.db.execute("ROLLBACK")
+                raise
+            self.db.execute("COMMIT")
+
+    def _recover(self):
+        """Mark sessions of processes that are gone as interrupted"""
+        with self._transaction() as db:
+            rows = db.execute("SELECT id, pid, path FROM session WHERE outcome = ?",
+                              (RUNNING,)).fetchall()
+            for session_id, pid, path in rows:
+                if pid and pid != os.getpid() and pid_alive(pid):
+                    continue
+                size = os.path.getsize(path) if path and os.path.exists(path) else 0
+                db.execute("UPDATE session SET outcome = ?, compressed_bytes = ?, pid = NULL "
+                           "WHERE id = ?", (INTERRUPTED, size, session_id))
+
+    def _build(self, ipsw_file):
+        if not self.catalog or not ipsw_file:
+            return None
+        try:
+            entry = self.catalog.get(ipsw_file)
+        except sqlite3.Error:
+            return None
+        return entry.build_version if entry else None
+
+    def open(self, device, ipsw_file=None):
+        """Start the log of a new session, return its SessionLog"""
+        now = time.time()
+        build = self._build(ipsw_file)
+        with self._transaction() as db:
+            session_id = db.execute(
+                "INSERT INTO session (device, ipsw, build, started_at, outcome, pid) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (device, os.path.basename(ipsw_file) if ipsw_file else None, build, now,
+                 RUNNING, os.getpid())).lastrowid
+            directory = os.path.join(self.log_dir, UNSAFE_RE.sub('_', device) or "unknown")
+            name = time.strftime("%Y%m%d-%H%M%S", time.localtime(now)) + f"-{session_id}.log.gz"
+            path = os.path.join(directory, name)
+            db.execute("UPDATE session SET path = ? WHERE id = ?", (path, session_id))
+        os.makedirs(directory, exist_ok=True)
+        return SessionLog(self, session_id, path)
+
+    def finish(self, log, returncode, phase=None, cancelled=False):
+        """Finish a session: close its file, index it, rotate old logs out of the budget
+
+        phase is the restore phase the session ended in.
+        """
+        if log.closed:
+            return
+        log.closed = True
+        log._file.close()
+        if returncode == 0:
+            outcome = SUCCESS
+        else:
+            outcome = CANCELLED if cancelled else FAILURE
+        with self._transaction() as db:
+            db.execute("UPDATE session SET ended_at = ?, returncode = ?, outcome = ?, phase = ?, "
+                       "errors = ?, lines = ?, raw_bytes = ?, compressed_bytes = ?, pid = NULL "
+                       "WHERE id = ?",
+                       (time.time(), returncode, outcome, phase, log.error_count, log.lines,
+                        log.raw_bytes, os.path.getsize(log.path), log.session_id))
+            db.executemany("INSERT INTO error_line VALUES (?, ?, ?)",
+                           [(log.session_id, error_phase, text) for error_phase, text in log.errors])
+        self.rotate()
+
+    def rotate(self):
+        """Delete the oldest finished logs until the rest fit the budget, return how many"""
+        with self._lock:
+            total = self.db.execute("SELECT COALESCE(SUM(compressed_bytes), 0) FROM session "
+                                    "WHERE path IS NOT NULL").fetchone()[0]
+            if total <= self.budget:
+                return 0
+            rows = self.db.execute("SELECT id, path, compressed_bytes FROM session "
+                                   "WHERE path IS NOT NULL AND outcome != ? ORDER BY started_at",
+                                   (RUNNING,)).fetchall()
+        removed = []
+        for session_id, path, size in rows:
+            if total <= self.budget:
+                break
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path)
+            with contextlib.suppress(OSError):
+                # Only succeeds once a device has no logs left
+                os.rmdir(os.path.dirname(path))
+            total -= size
+            removed.append(session_id)
+        with self._transaction() as db:
+            db.executemany("UPDATE session SET path = NULL WHERE id = ?",
+                           [(session_id,) for session_id in removed])
+        return len(removed)
+
+    def sessions(self, device=None, outcome=None, phase=None, build=None, since=None, until=None,
+                 error=None, limit=100):
+        """Indexed sessions matching every given filter, newest first
+
+        since/until are epoch seconds, error a substring of an indexed error line.
+        """
+        query = f"SELECT {', '.join(LogSession.COLUMNS)} FROM session WHERE 1"
+        params = []
+        for column, value in (("device", device), ("outcome", outcome), ("phase", phase),
+                              ("build", build)):
+            if value is not None:
+                query += f" AND {column} = ?"
+                params.append(value)
+        if since is not None:
+            query += " AND started_at >= ?"
+            params.append(since)
+        if until is not None:
+            query += " AND started_at < ?"
+            params.append(until)
+        if error:
+            query += " AND id IN (SELECT session_id FROM error_line WHERE text LIKE ? ESCAPE '\\')"
+            params.append('%' + re.sub(r"([%_\\])", r"\\\1", error) + '%')
+        query += " ORDER BY started_at DESC"
+        if limit:
+            query += f" LIMIT {int(limit)}"
+        with self._lock:
+            rows = self.db.execute(query, params).fetchall()
+        return [LogSession(row) for row in rows]
+
+    def get(self, session_id):
+        with self._lock:
+            row = self.db.execute(f"SELECT {', '.join(LogSession.COLUMNS)} FROM session "
+                                  f"WHERE id = ?", (session_id,)).fetchone()
+        return LogSession(row) if row else None
+
+    def errors(self, session_id):
+        """[(phase, text)] indexed for a session"""
+        with self._lock:
+            return self.db.execute("SELECT phase, text FROM error_line WHERE session_id = ? "
+                                   "ORDER BY rowid", (session_id,)).fetchall()
+
+    def lines(self, session_id):
+        """Iterate over the lines of a session's log
+
+        The log of a running or crashed session ends at its last flush. Raises
+        FileNotFoundError when the log was rotated away.
+        """
+        session = self.get(session_id)
+        if not session or not session.path:
+            raise FileNotFoundError(f"No log for session {session_id}")
+        with gzip.open(session.path, 'rt', encoding='utf-8', errors='replace') as f:
+            try:
+                for line in f:
+                    yield line.rstrip('\n')
+            except (EOFError, gzip.BadGzipFile):
+                # Truncated at a sync flush
+                return
+
+    @property
+    def disk_usage(self):
+        """Compressed bytes of the logs still on disk"""
+        with self._lock:
+            return self.db.execute("SELECT COALESCE(SUM(compressed_bytes), 0) FROM session "
+                                   "WHERE path IS NOT NULL").fetchone()[0]
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Preflight
+Checks that an IPSW has a build identity for a device before a restore puts
+the device through a recovery-mode cycle
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import device_info
+from ipsw_catalog import parse_int
+from usb_detector import MODE_NORMAL
+
+
+class DeviceIdentity:
+    """What a device is, as far as it could be told: model, chip and board"""
+
+    def __init__(self, product_type=None, chip_id=None, board_id=None, device_class=None):
+        self.product_type = product_type
+        self.chip_id = chip_id
+        self.board_id = board_id
+        # Board config, e.g. "d79ap"
+        self.device_class = device_class.lower() if device_class else None
+
+    @property
+    def known(self):
+        return bool(self.product_type or self.device_class or self.chip_id is not None)
+
+    @property
+    def description(self):
+        parts = [self.product_type] if self.product_type else []
+        if self.device_class:
+            parts.append(self.device_class.upper())
+        if self.chip_id is not None:
+            board = f"/0x{self.board_id:02X}" if self.board_id is not None else ""
+            parts.append(f"CPID 0x{self.chip_id:04X}{board}")
+        return " ".join(parts) or "unknown device"
+
+    def __repr__(self):
+        return f"DeviceIdentity({self.description!r})"
+
+
+def identity_from_usb(device):
+    """Chip and board from the iBoot serial of a recovery/DFU device, no tool needed"""
+    return DeviceIdentity(chip_id=parse_int(f"0x{device.cpid}") if device.cpid else None,
+                          board_id=parse_int(f"0x{device.bdid}") if device.bdid else None)
+
+
+def identity_from_ideviceinfo(fields):
+    return DeviceIdentity(fields.get('ProductType'), parse_int(fields.get('ChipID')),
+                          parse_int(fields.get('BoardId')), fields.get('HardwareModel'))
+
+
+def identity_from_irecovery(fields):
+    return DeviceIdentity(fields.get('PRODUCT'), parse_int(fields.get('CPID')),
+                          parse_int(fields.get('BDID')), fields.get('MODEL'))
+
+
+def incompatibility(entry, identity):
+    """Why the firmware cannot be restored to the device, or None
+
+    Chip and board are compared with the BuildIdentities when both sides
+    have them, else the board config, else the ProductType. A device that
+    could not be identified passes; idevicerestore has the last word.
+    """
+    if entry.error:
+        return f"Invalid IPSW: BuildManifest.plist unreadable ({entry.error})"
+    chips = [(chip, board) for chip, board, _ in entry.identities if chip is not None]
+    classes = [device_class for _, _, device_class in entry.identities if device_class]
+    if identity.chip_id is not None and identity.board_id is not None and chips:
+        compatible = (identity.chip_id, identity.board_id) in chips
+    elif identity.device_class and classes:
+        compatible = identity.device_class in classes
+    elif identity.product_type and entry.product_types:
+        compatible = identity.product_type in entry.product_types
+    else:
+        return None
+    if compatible:
+        return None
+    return f"{entry.name} ({entry.description}) is not compatible with {identity.description}"
+
+
+class PreflightResult:
+    """Outcome of checking one IPSW against one device"""
+
+    def __init__(self, path, device, identity=None, error=None, seconds=0.0):
+        self.path = path
+        self.device = device
+        self.identity = identity
+        self.error = error
+        self.seconds = seconds
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    @property
+    def summary(self):
+        if self.error:
+            return self.error
+        identity = self.identity.description if self.identity else "device"
+        return f"compatible with {identity} (checked in {self.seconds * 1000:.0f} ms)"
+
+
+class Preflight:
+    """Match devices against the build identities of IPSW files
+
+    Manifests come from the IPSWCatalog, parsed once per file. A device in
+    recovery or DFU mode is identified from its USB serial; otherwise
+    query_device (ideviceinfo) or query_recovery (irecovery) is run once per
+    device. Both are plain functions so tests and benchmarks can stub them.
+    """
+
+    def __init__(self, catalog, ideviceinfo_cmd='ideviceinfo', irecovery_cmd='irecovery',
+                 query_device=device_info.query_device,
+                 query_recovery=device_info.query_recovery, workers=8):
+        self.catalog = catalog
+        self.ideviceinfo_cmd = ideviceinfo_cmd
+        self.irecovery_cmd = irecovery_cmd
+        self.query_device = query_device
+        self.query_recovery = query_recovery
+        self.workers = workers
+        self._identities = {}
+        self._lock = threading.Lock()
+
+    def identify(self, device):
+        """DeviceIdentity of a USBDevice; a device that answered is not asked again"""
+        key = (device.identifier, device.mode)
+        with self._lock:
+            if key in self._identities:
+                return self._identities[key]
+
+        identity = identity_from_usb(device)
+        if identity.chip_id is None or identity.board_id is None:
+            if device.mode == MODE_NORMAL:
+                fields = self.query_device(device.udid, self.ideviceinfo_cmd)
+                parse = identity_from_ideviceinfo
+            else:
+                fields = self.query_recovery(device.ecid, self.irecovery_cmd)
+                parse = identity_from_irecovery
+            if fields:
+                identity = parse(fields)
+        if identity.known:
+            with self._lock:
+                self._identities[key] = identity
+        return identity
+
+    def check(self, ipsw_file, device):
+        """PreflightResult of restoring ipsw_file to a USBDevice"""
+        start = time.perf_counter()
+        try:
+            entry = self.catalog.add(ipsw_file)
+        except OSError as e:
+            return PreflightResult(ipsw_file, device, error=f"IPSW file not found: {e}",
+                                   seconds=time.perf_counter() - start)
+        identity = self.identify(device)
+        return PreflightResult(ipsw_file, device, identity, incompatibility(entry, identity),
+                               time.perf_counter() - start)
+
+    def check_many(self, checks):
+        """PreflightResults of [(ipsw_file, device)], checked in parallel"""
+        checks = list(checks)
+        if len(checks) <= 1:
+            return [self.check(*pair) for pair in checks]
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(checks))) as pool:
+            return list(pool.map(lambda pair: self.check(*pair), checks))
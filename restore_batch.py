@@ -0,0 +1,384 @@
+#!/usr/bin/env python3
+"""
+Restore Batch
+Run journaled restore jobs without a TTY, one result per finished job
+
+A jobs file is a JSON list of jobs, or {"max_concurrent": N, "jobs": [...]}:
+
+    [
+        {"id": "bench-1", "device": "00008030-001A2B3C4D5E6F70", "ipsw": "/srv/ipsw/17.5.ipsw"},
+        {"device": "ecid:1A2B3C4D5E6F", "ipsw": "17.5.ipsw", "erase": false},
+        {"device": "port:1-4", "ipsw": "17.5.ipsw", "exclude_baseband": false, "timeout": 3600},
+        {"device": "any", "ipsw": "17.5.ipsw", "sha256": "..."}
+    ]
+
+Jobs go through the JobJournal, so transient failures are retried with
+backoff and jobs interrupted by a crash are picked up by the next run.
+Devices are resolved from a sysfs scan when a job starts; "any" takes a
+device that no running or explicitly-targeted job uses.
+"""
+
+import asyncio
+import json
+import os
+import time
+
+from job_journal import ACTIVE_STATES, RETRY, SUCCEEDED
+from restore_engine import CANCELLED
+
+JOB_OPTIONS = {'erase': True, 'exclude_baseband': True, 'debug': False}
+
+
+def check_selector(selector):
+    """Raise ValueError unless selector is "any", a UDID, ecid:<hex> or port:<port>"""
+    kind, _, value = selector.partition(':')
+    if kind == 'ecid':
+        int(value, 16)
+    elif kind == 'port' and not value:
+        raise ValueError(f"invalid device selector {selector!r}")
+
+
+class BatchJob:
+    """One entry of a jobs file"""
+
+    def __init__(self, index, spec, base_dir="."):
+        if not isinstance(spec, dict):
+            raise ValueError(f"job {index + 1}: expected an object, got {type(spec).__name__}")
+        unknown = set(spec) - {'id', 'device', 'ipsw', 'sha256', 'timeout'} - set(JOB_OPTIONS)
+        if unknown:
+            raise ValueError(f"job {index + 1}: unknown field(s) {', '.join(sorted(unknown))}")
+        if not spec.get('ipsw'):
+            raise ValueError(f"job {index + 1}: missing \"ipsw\"")
+
+        self.id = str(spec.get('id', index + 1))
+        self.selector = str(spec.get('device', 'any'))
+        try:
+            check_selector(self.selector)
+        except ValueError:
+            raise ValueError(f"job {index + 1}: invalid device selector {self.selector!r}")
+        # Relative IPSW paths are relative to the jobs file
+        self.ipsw = os.path.join(base_dir, os.path.expanduser(spec['ipsw']))
+        self.sha256 = spec.get('sha256')
+        self.options = {option: bool(spec.get(option, default))
+                        for option, default in JOB_OPTIONS.items()}
+        self.options['timeout'] = spec.get('timeout')
+        self.options['label'] = self.id
+
+
+def load_jobs(path):
+    """Read a jobs file, return (jobs, max_concurrent or None); raises ValueError"""
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        raise ValueError(f"cannot read {path}: {e}")
+
+    max_concurrent = None
+    if isinstance(data, dict):
+        max_concurrent = data.get('max_concurrent')
+        data = data.get('jobs')
+    if not isinstance(data, list):
+        raise ValueError(f"{path}: expected a list of jobs")
+    base_dir = os.path.dirname(os.path.abspath(path))
+    return [BatchJob(i, spec, base_dir) for i, spec in enumerate(data)], max_concurrent
+
+
+def device_selector(device):
+    """The most stable selector for a detected USBDevice"""
+    if device.udid:
+        return device.udid
+    if device.ecid:
+        return f"ecid:{device.ecid}"
+    return f"port:{device.port}"
+
+
+def match_device(selector, devices, port=None):
+    """The device a selector names, falling back to the port it was last seen on"""
+    kind, _, value = selector.partition(':')
+    for device in devices:
+        if kind == 'ecid' and device.ecid and int(device.ecid, 16) == int(value, 16):
+            return device
+        if kind == 'port' and device.port == value:
+            return device
+        if device.udid and device.udid.lower() == selector.lower():
+            return device
+    # A device changing mode between attempts keeps its port, not its UDID
+    if port:
+        for device in devices:
+            if device.port == port:
+                return device
+    return None
+
+
+def spread(topology, port, busy):
+    """(controller, hub) count of busy ports sharing them with port, to sort candidates by"""
+    controller, hub = topology.controller(port), topology.hub(port)
+    return (sum(1 for other in busy if topology.controller(other) == controller),
+            sum(1 for other in busy if topology.hub(other) == hub))
+
+
+def job_result(job, device=None, restore=None, error=None):
+    """The JSON-lines record of one finished job"""
+    result = {
+        'id': job.options.get('label', str(job.id)),
+        'job': job.id,
+        'device': job.device,
+        'udid': device.udid if device else None,
+        'ecid': device.ecid if device else None,
+        'ipsw': job.ipsw,
+        'state': job.state,
+        'status': restore.status if restore else "Rejected",
+        'succeeded': job.state == SUCCEEDED,
+        'attempts': job.attempts,
+        'returncode': job.returncode,
+        'duration_seconds': round(restore.duration, 3) if restore else 0.0,
+        'error': error or job.last_error,
+        'finished_at': round(time.time(), 3),
+    }
+    if restore:
+        result['phase'] = restore.phase
+        result['errors'] = restore.errors[-5:]
+        if restore.session_log:
+            result['log'] = restore.session_log.path
+        if restore.session and restore.session.phases:
+            result['phases'] = {phase['phase']: phase['seconds'] for phase in restore.session.phases}
+    return result
+
+
+async def run_jobs(engine, journal, job_ids, scan, verify, on_result, max_concurrent=4,
+                   on_retry=None, poll=1.0, preflight=None):
+    """Run journal jobs until each has succeeded, failed or been cancelled
+
+    scan() returns the attached USBDevices. verify(ipsw, sha256) returns an
+    error message or None and runs once per distinct firmware on an executor
+    thread. preflight(ipsw, device), if given, does the same for a firmware
+    and device pair; it runs before verify, and up front, in parallel, for
+    every queued job whose device is attached, so an incompatible job is
+    rejected before any restore starts. on_result(job, device, restore,
+    error) is called when a job is finished for good and on_retry(job,
+    error) when one is scheduled again. Cancelling run_jobs cancels every
+    job that has not finished, including those waiting out a retry backoff.
+    """
+    loop = asyncio.get_running_loop()
+    scheduler = engine.scheduler
+    job_ids = list(job_ids)
+    verified = {}
+    compatible = {}
+    # job id -> (task, port, device identifier)
+    running = {}
+
+    def safe_verify(ipsw, sha256):
+        try:
+            return verify(ipsw, sha256)
+        except Exception as e:
+            return str(e)
+
+    async def check_firmware(job):
+        key = (job.ipsw, job.sha256)
+        if key not in verified:
+            if os.path.exists(job.ipsw):
+                verified[key] = loop.run_in_executor(None, safe_verify, job.ipsw, job.sha256)
+            else:
+                verified[key] = loop.create_future()
+                verified[key].set_result(f"IPSW file not found: {job.ipsw}")
+        return await verified[key]
+
+    def safe_preflight(ipsw, device):
+        try:
+            return preflight(ipsw, device)
+        except Exception:
+            # A check that cannot run leaves the decision to idevicerestore
+            return None
+
+    def check_compatible(job, device):
+        key = (job.ipsw, device.identifier)
+        if key not in compatible:
+            compatible[key] = loop.run_in_executor(None, safe_preflight, job.ipsw, device)
+        return compatible[key]
+
+    def command_options(job):
+        return {'erase': job.options.get('erase', True),
+                'exclude_baseband': job.options.get('exclude_baseband', True),
+                'debug': job.options.get('debug', False)}
+
+    async def check_options(job, device):
+        """Why the installed idevicerestore cannot run the job's command line, or None"""
+        await engine.probe_tools()
+        try:
+            engine.build_command(device.udid, job.ipsw, ecid=None if device.udid else device.ecid,
+                                 **command_options(job))
+        except ValueError as e:
+            return str(e)
+        return None
+
+    async def attempt(job, device):
+        restore = None
+        error = None
+        try:
+            if preflight:
+                error = await check_compatible(job, device)
+                if error:
+                    # An incompatible device and firmware pair is never retried
+                    journal.finish(job.id, 1, [error])
+            if not error:
+                error = await check_options(job, device)
+                if error:
+                    # A missing idevicerestore option will still be missing next time
+                    journal.finish(job.id, 1, [error])
+            if not error:
+                error = await check_firmware(job)
+                if error:
+                    # Firmware problems are permanent, never retried
+                    journal.finish(job.id, 1, [f"Invalid IPSW: {error}"])
+            if not error:
+                restore = await engine.restore_device(
+                    job.ipsw, udid=device.udid, ecid=None if device.udid else device.ecid,
+                    device=device.identifier, timeout=job.options.get('timeout'),
+                    port=device.port, **command_options(job))
+                journal.finish(job.id, restore.returncode, restore.errors or restore.log[-3:],
+                               cancelled=restore.status == CANCELLED)
+        except asyncio.CancelledError:
+            journal.finish(job.id, None, ["cancelled"], cancelled=True)
+            raise
+        except Exception as e:
+            # One broken job must not stop the scheduler and every other job
+            error = f"Error during restore: {str(e) or type(e).__name__}"
+            journal.finish(job.id, 1, [error])
+        report(journal.get(job.id), device, restore, error)
+
+    def claimed_ports():
+        """Ports of running jobs that have yet to take a transfer slot from the scheduler"""
+        ports = []
+        for _, port, identifier in running.values():
+            restore = engine.restores.get(identifier)
+            if restore is None or restore.finished is not None or restore.slot is None:
+                ports.append(port)
+        return ports
+
+    def pick(job, devices, busy, reserved):
+        """The device a due job would run on, None if there is none"""
+        if job.device != 'any':
+            return match_device(job.device, devices, job.port)
+        free = [device for device in devices
+                if device.port not in busy and device.port not in reserved]
+        if scheduler:
+            free.sort(key=lambda device: spread(scheduler.topology, device.port, busy))
+        return free[0] if free else None
+
+    def report(job, device, restore=None, error=None):
+        if job.state == RETRY:
+            if on_retry:
+                on_retry(job, job.last_error)
+        else:
+            on_result(job, device, restore, error)
+
+    if preflight:
+        # Every queued job whose device is attached is checked at once, so
+        # incompatible ones do not wait for a restore slot to be rejected
+        devices = scan()
+        targets = []
+        for job in journal.jobs(ACTIVE_STATES, job_ids):
+            device = match_device(job.device, devices, job.port) if job.device != 'any' else None
+            if device and os.path.exists(job.ipsw):
+                targets.append((job, device))
+        errors = await asyncio.gather(*(check_compatible(job, device) for job, device in targets))
+        for (job, device), error in zip(targets, errors):
+            if error and journal.start(job.id):
+                journal.finish(job.id, 1, [error])
+                report(journal.get(job.id), device, None, error)
+
+    try:
+        while True:
+            jobs = journal.jobs(ACTIVE_STATES, job_ids)
+            waiting = [job for job in jobs if job.id not in running]
+            if not waiting and not running:
+                break
+
+            now = time.time()
+            due = [job for job in waiting if job.next_attempt_at <= now]
+            if due and len(running) < max_concurrent:
+                devices = scan()
+                busy = {port for _, port, _ in running.values()}
+                claimed = claimed_ports() if scheduler else []
+                # Explicitly targeted devices are never handed to an "any" job
+                reserved = {device.port for device in (
+                    match_device(job.device, devices, job.port)
+                    for job in waiting if job.device != 'any') if device}
+                pending = list(due)
+                while pending and len(running) < max_concurrent:
+                    picks = [(job, pick(job, devices, busy, reserved)) for job in pending]
+                    if scheduler:
+                        # Least busy controllers and hubs first, so jobs on idle ones
+                        # never queue behind a saturated hub
+                        picks.sort(key=lambda p: spread(scheduler.topology, p[1].port, busy)
+                                   if p[1] else (0, 0))
+                    job, device = picks[0]
+                    pending.remove(job)
+                    if device is not None and device.port in busy:
+                        continue
+                    if scheduler and device is not None and scheduler.would_wait(device.port,
+                                                                                 claimed):
+                        # Left queued rather than holding a concurrency slot while it waits
+                        continue
+                    if device is None and job.device == 'any' and running:
+                        # Wait for a running job to free a device
+                        continue
+                    if not journal.start(job.id):
+                        continue
+                    if device is None:
+                        # Possibly re-enumerating; counts as a transient failed attempt
+                        journal.finish(job.id, -1, [f"No device found for {job.device}"])
+                        report(journal.get(job.id), None)
+                        continue
+                    journal.bind(job.id, device.port)
+                    busy.add(device.port)
+                    claimed.append(device.port)
+                    running[job.id] = (asyncio.ensure_future(attempt(job, device)), device.port,
+                                       device.identifier)
+
+            next_due = [job.next_attempt_at - now for job in waiting
+                        if job.id not in running and job.next_attempt_at > now]
+            timeout = min([poll] + next_due) if (next_due or due) else None
+            tasks = [task for task, _, _ in running.values()]
+            if tasks:
+                await asyncio.wait(tasks, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            else:
+                await asyncio.sleep(timeout or poll)
+            for job_id, (task, _, _) in list(running.items()):
+                if task.done():
+                    del running[job_id]
+                    task.result()
+    except asyncio.CancelledError:
+        # Queued jobs and those waiting out a retry backoff stop with the running ones
+        for job_id in job_ids:
+            journal.cancel(job_id)
+        raise
+    finally:
+        for task, _, _ in running.values():
+            task.cancel()
+        if running:
+            await asyncio.gather(*(task for task, _, _ in running.values()),
+                                 return_exceptions=True)
+
+
+async def run_batch(engine, journal, batch_jobs, scan, verify, on_result, max_concurrent=4,
+                    on_retry=None, preflight=None):
+    """Journal and run the jobs of a jobs file plus any interrupted earlier jobs
+
+    on_result(dict) receives one job_result() per finished job. Returns the
+    number of jobs that did not succeed.
+    """
+    failures = 0
+
+    def finished(job, device, restore, error):
+        nonlocal failures
+        if job.state != SUCCEEDED:
+            failures += 1
+        on_result(job_result(job, device, restore, error))
+
+    recovered = journal.recover()
+    job_ids = journal.enqueue_many([(job.selector, job.ipsw, job.options, job.sha256, None, None)
+                                    for job in batch_jobs])
+    await run_jobs(engine, journal, recovered + job_ids, scan, verify, finished, max_concurrent,
+                   on_retry, preflight=preflight)
+    return failures
@@ -0,0 +1,381 @@
+#!/usr/bin/env python3
+"""
+Restore Engine
+Headless asyncio engine behind both front-ends: every idevicerestore session,
+device probe and timeout of the process runs on one event loop
+"""
+
+import asyncio
+import os
+import sys
+import threading
+import time
+
+from restore_metrics import RestoreSession
+from restore_output import RestoreEvent, RestoreOutputParser, LINE, ERROR, PHASE_START, PHASE_END
+from usb_topology import TRANSFER_PHASES
+
+READ_SIZE = 65536
+
+PENDING = "Pending"
+WAITING = "Waiting for USB"
+RESTORING = "Restoring"
+COMPLETED = "Completed"
+FAILED = "Failed"
+CANCELLED = "Cancelled"
+TIMED_OUT = "Timed out"
+
+
+def attach_child_watcher(loop):
+    """Before Python 3.12 asyncio waits for each child on its own thread, pidfds need none"""
+    if sys.version_info >= (3, 12) or not hasattr(asyncio, 'PidfdChildWatcher'):
+        return False
+    try:
+        os.close(os.pidfd_open(os.getpid()))
+    except (AttributeError, OSError):
+        return False
+    watcher = asyncio.PidfdChildWatcher()
+    watcher.attach_loop(loop)
+    asyncio.set_child_watcher(watcher)
+    return True
+
+
+def run(coro):
+    """asyncio.run() for blocking callers, with the thread-free child watcher"""
+    if not hasattr(asyncio, 'Runner'):
+        return asyncio.run(coro)
+    with asyncio.Runner() as runner:
+        attach_child_watcher(runner.get_loop())
+        return runner.run(coro)
+
+
+class DeviceRestore:
+    """Status, exit code and log of the restore of a single device"""
+
+    def __init__(self, udid, device=None, port=None):
+        self.udid = udid
+        # Label for logs and metrics when no UDID is passed to idevicerestore
+        self.device = device or udid
+        self.port = port
+        # TransferSlot held while firmware goes over USB
+        self.slot = None
+        self.status = PENDING
+        self.returncode = None
+        self.log = []
+        self.phase = None
+        self.percent = 0.0
+        self.errors = []
+        self.session = None
+        # SessionLog of the raw output when the engine has a LogStore
+        self.session_log = None
+        self.started = None
+        self.finished = None
+
+    @property
+    def succeeded(self):
+        return self.returncode == 0
+
+    @property
+    def duration(self):
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.monotonic()) - self.started
+
+
+class RestoreEngine:
+    """Run idevicerestore sessions as asyncio subprocesses
+
+    on_update(restore) is called on every status change, on_event(restore,
+    event) for every parsed RestoreEvent and on_message(text) for notes from
+    the engine itself, all on the event loop. Blocking work (firmware
+    extraction) is sent to the default executor so the loop stays responsive.
+    With a TopologyScheduler, a restore waits for a hub and controller slot
+    before idevicerestore starts and gives it back once the filesystem is
+    sent. With a LogStore, the raw output of every session is kept on disk
+    and indexed. With a Toolchain, command lines use the options the
+    installed idevicerestore reported and fail early on ones it lacks.
+    How many devices restore at once is up to the caller: run_jobs caps it.
+    """
+
+    def __init__(self, idevicerestore_cmd='idevicerestore', on_update=None, on_event=None,
+                 on_message=None, metrics=None, firmware_cache=None, terminate_timeout=10.0,
+                 scheduler=None, log_store=None, toolchain=None):
+        self.idevicerestore_cmd = idevicerestore_cmd
+        self.on_update = on_update
+        self.on_event = on_event
+        self.on_message = on_message
+        self.metrics = metrics
+        self.firmware_cache = firmware_cache
+        self.terminate_timeout = terminate_timeout
+        self.scheduler = scheduler
+        self.log_store = log_store
+        self.toolchain = toolchain
+        # Running sessions plus those of the latest run, keyed by device
+        self.restores = {}
+        self._tasks = {}
+
+    def build_command(self, udid, ipsw_file, erase=True, exclude_baseband=True, debug=False,
+                      ecid=None):
+        """Build the idevicerestore command line for one device (any device if udid is None)
+
+        Devices in recovery or DFU mode have no UDID and are selected by ECID.
+        Raises ValueError if the installed idevicerestore lacks a needed option.
+        """
+        tool = self.toolchain.tool(self.idevicerestore_cmd) if self.toolchain else None
+        cmd = [tool.path if tool else self.idevicerestore_cmd]
+        if udid:
+            cmd += [self._option(tool, '-u'), udid]
+        elif ecid:
+            cmd += [self._option(tool, '-i'),
+                    f"0x{ecid}" if not ecid.lower().startswith('0x') else ecid]
+        if erase:
+            cmd.append(self._option(tool, '-e'))
+        if exclude_baseband:
+            cmd.append(self._option(tool, '-x'))
+        if debug:
+            cmd.append(self._option(tool, '-d'))
+        if tool and tool.supports('-y'):
+            # Newer releases ask before erasing and nobody is at a terminal to answer
+            cmd.append('-y')
+        cmd.append(ipsw_file)
+        return cmd
+
+    @staticmethod
+    def _option(tool, option):
+        # A tool that printed no usage is assumed to take the classic options
+        if tool and not tool.supports(option, default=True):
+            raise ValueError(f"{tool.description} does not support {option}")
+        return option
+
+    async def probe_tools(self):
+        """Probe idevicerestore off the loop, so build_command only reads the cache"""
+        if self.toolchain:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, self.toolchain.tool, self.idevicerestore_cmd)
+
+    async def checkout(self, ipsw_file):
+        """Lease the extracted firmware from the cache, None without a cache"""
+        if not self.firmware_cache:
+            return None
+        loop = asyncio.get_running_loop()
+        firmware = await loop.run_in_executor(None, self.firmware_cache.checkout, ipsw_file)
+        if self.on_message:
+            self.on_message(firmware.description.capitalize())
+        return firmware
+
+    async def restore_device(self, ipsw_file, udid=None, device=None, erase=True,
+                             exclude_baseband=True, debug=False, timeout=None, ecid=None,
+                             port=None):
+        """Restore one device and return its DeviceRestore
+
+        port is the device's sysfs USB port, found from the UDID or ECID when
+        a scheduler needs it and it is not given.
+        """
+        restore = DeviceRestore(udid, device or ecid, port)
+        await self.probe_tools()
+        firmware = await self.checkout(ipsw_file)
+        try:
+            source = firmware.path if firmware else ipsw_file
+            cmd = self.build_command(udid, source, erase, exclude_baseband, debug, ecid)
+            await self._supervise([restore], [cmd], ipsw_file, timeout)
+        finally:
+            if firmware:
+                firmware.release()
+        return restore
+
+    def cancel(self, udid=None):
+        """Cancel the restore of one device, or of all devices; call on the loop"""
+        for restore, task in list(self._tasks.values()):
+            if udid is None or restore.udid == udid:
+                task.cancel()
+
+    @property
+    def active(self):
+        return len(self._tasks)
+
+    def overall_percent(self):
+        """Mean progress of the known sessions"""
+        if not self.restores:
+            return 0.0
+        return sum(r.percent for r in self.restores.values()) / len(self.restores)
+
+    async def _supervise(self, restores, commands, ipsw_file, timeout):
+        """Run one task per device; cancelling one device leaves the others running"""
+        self.restores = {device: restore for device, restore in self.restores.items()
+                         if restore.finished is None}
+        tasks = []
+        for restore, cmd in zip(restores, commands):
+            self.restores[restore.device] = restore
+            task = asyncio.ensure_future(self._restore(restore, cmd, ipsw_file, timeout))
+            self._tasks[id(restore)] = (restore, task)
+            tasks.append(task)
+        try:
+            # return_exceptions keeps siblings running when one device is cancelled
+            await asyncio.gather(*tasks, return_exceptions=True)
+        except asyncio.CancelledError:
+            # The caller was cancelled: wait until every child process is stopped
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        finally:
+            for restore in restores:
+                self._tasks.pop(id(restore), None)
+
+    def _set_status(self, restore, status):
+        restore.status = status
+        if self.on_update:
+            self.on_update(restore)
+
+    def _event(self, restore, event):
+        restore.session.handle(event)
+        if restore.slot and event.kind in (PHASE_START, PHASE_END):
+            # The USB-heavy part is over once the filesystem is sent
+            if (event.phase not in TRANSFER_PHASES or
+                    (event.kind == PHASE_END and event.phase == TRANSFER_PHASES[-1])):
+                restore.slot.release()
+        if event.kind == LINE:
+            restore.log.append(event.text)
+            if restore.session_log:
+                restore.session_log.write(event.text)
+        else:
+            if event.kind == ERROR:
+                restore.errors.append(event.text)
+                if restore.session_log:
+                    restore.session_log.error(event.phase, event.text)
+            restore.phase = event.phase
+            if event.overall is not None:
+                restore.percent = event.overall
+        if self.on_event:
+            self.on_event(restore, event)
+
+    async def _restore(self, restore, cmd, ipsw_file, timeout):
+        restore.session = RestoreSession(restore.device, ipsw_file)
+        status = None
+        process = None
+        try:
+            if self.log_store:
+                restore.session_log = self.log_store.open(restore.device, ipsw_file)
+            if self.scheduler:
+                port = restore.port or self.scheduler.topology.locate(restore.udid or restore.device)
+                if self.scheduler.would_wait(port):
+                    self._set_status(restore, WAITING)
+                restore.slot = await self.scheduler.acquire(port)
+            restore.started = time.monotonic()
+            self._set_status(restore, RESTORING)
+            process = await asyncio.create_subprocess_exec(
+                *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT)
+            try:
+                await asyncio.wait_for(self._stream(restore, process), timeout)
+            finally:
+                # No idevicerestore outlives its session, even on timeout or cancel
+                await self._stop(process)
+            restore.returncode = process.returncode
+
+        except asyncio.TimeoutError:
+            status = TIMED_OUT
+            self._event(restore, self._note(restore, f"Restore timed out after {timeout}s"))
+        except asyncio.CancelledError:
+            status = CANCELLED
+            raise
+        except Exception as e:
+            self._event(restore, self._note(restore, f"Error during restore: {str(e)}"))
+            restore.returncode = -1
+
+        finally:
+            if process is not None and restore.returncode is None:
+                restore.returncode = process.returncode
+            if restore.slot:
+                restore.slot.release()
+            restore.finished = time.monotonic()
+            restore.session.finish(restore.returncode)
+            if self.metrics:
+                self.metrics.write(restore.session)
+            if restore.session_log:
+                restore.session_log.close(restore.returncode, restore.phase,
+                                          cancelled=status == CANCELLED)
+            if restore.succeeded:
+                restore.percent = 100.0
+            self._set_status(restore, status or (COMPLETED if restore.succeeded else FAILED))
+
+    async def _stream(self, restore, process):
+        parser = RestoreOutputParser()
+        while True:
+            data = await process.stdout.read(READ_SIZE)
+            if not data:
+                break
+            for event in parser.feed(data):
+                self._event(restore, event)
+        for event in parser.close():
+            self._event(restore, event)
+        await process.wait()
+
+    @staticmethod
+    def _note(restore, text):
+        """A LINE event for messages from the engine itself"""
+        return RestoreEvent(LINE, restore.phase, text=text)
+
+    async def _stop(self, process):
+        """Terminate a child, kill it if it ignores SIGTERM"""
+        if process.returncode is not None:
+            return
+        try:
+            process.terminate()
+            try:
+                await asyncio.wait_for(asyncio.shield(process.wait()), self.terminate_timeout)
+                return
+            except asyncio.TimeoutError:
+                process.kill()
+        except ProcessLookupError:
+            pass
+        await asyncio.shield(process.wait())
+
+
+class LoopBridge:
+    """One asyncio loop on a background thread, for threaded front-ends like Tk
+
+    submit() schedules a coroutine from any thread; on_done(future) is called
+    back through root.after() so it runs on the Tk thread.
+    """
+
+    def __init__(self, root=None):
+        self.root = root
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run, name="restore-engine", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        attach_child_watcher(self.loop)
+        self.loop.run_forever()
+
+    def submit(self, coro, on_done=None):
+        """Schedule a coroutine, return a concurrent.futures.Future"""
+        future = asyncio.run_coroutine_threadsafe(coro, self.loop)
+        if on_done:
+            future.add_done_callback(lambda f: self.call_in_ui(on_done, f))
+        return future
+
+    def call_soon(self, func, *args):
+        """Run a plain function on the loop thread"""
+        self.loop.call_soon_threadsafe(func, *args)
+
+    def call_in_ui(self, func, *args):
+        if self.root is not None:
+            self.root.after(0, func, *args)
+        else:
+            func(*args)
+
+    def stop(self, timeout=5.0):
+        """Cancel everything still running and stop the loop"""
+        async def shutdown():
+            tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        if self._thread.is_alive():
+            try:
+                asyncio.run_coroutine_threadsafe(shutdown(), self.loop).result(timeout)
+            except Exception:
+                pass
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self._thread.join(timeout)
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""
+Restore Metrics
+Per-restore phase timings, exported as JSON lines and as a Prometheus
+textfile-collector file
+"""
+
+import fcntl
+import json
+import os
+import re
+import threading
+import time
+
+from restore_output import LINE, PHASE_START, PHASE_END, ERROR
+
+DEFAULT_METRICS_DIR = os.environ.get(
+    "IPHONE_MANAGER_METRICS_DIR",
+    os.path.expanduser("~/.cache/iphone_firmware_manager/metrics"))
+
+BYTES_RE = re.compile(r"\((\d+) bytes\)")
+RETRY_RE = re.compile(r"\bretry(?:ing)?\b", re.IGNORECASE)
+
+
+class RestoreSession:
+    """Monotonic phase timestamps, bytes and retries of one idevicerestore run
+
+    Feed it every RestoreEvent with handle(); it does no work for ordinary
+    output lines beyond two substring tests.
+    """
+
+    def __init__(self, device=None, ipsw_file=None):
+        self.device = device
+        self.ipsw_file = ipsw_file
+        self.wall_start = time.time()
+        self.start = time.monotonic()
+        self.end = None
+        self.returncode = None
+        self.retries = 0
+        self.errors = 0
+        self.phases = []
+        self._open = {}
+
+    def handle(self, event):
+        kind = event.kind
+        if kind == LINE:
+            text = event.text
+            if 'bytes)' in text and event.phase in self._open:
+                match = BYTES_RE.search(text)
+                if match:
+                    self._open[event.phase]['bytes'] += int(match.group(1))
+            if 'etry' in text and RETRY_RE.search(text):
+                self.retries += 1
+        elif kind == PHASE_START:
+            phase = {'phase': event.phase, 'start': time.monotonic() - self.start,
+                     'end': None, 'seconds': None, 'bytes': 0}
+            self.phases.append(phase)
+            self._open[event.phase] = phase
+        elif kind == PHASE_END:
+            phase = self._open.pop(event.phase, None)
+            if phase:
+                self._close(phase)
+        elif kind == ERROR:
+            self.errors += 1
+
+    def _close(self, phase):
+        phase['end'] = time.monotonic() - self.start
+        phase['seconds'] = round(phase['end'] - phase['start'], 6)
+        phase['start'] = round(phase['start'], 6)
+        phase['end'] = round(phase['end'], 6)
+
+    def finish(self, returncode):
+        """Close any open phase and stop the clock"""
+        self.returncode = returncode
+        for phase in self._open.values():
+            self._close(phase)
+        self._open = {}
+        self.end = time.monotonic()
+
+    @property
+    def duration(self):
+        return (self.end or time.monotonic()) - self.start
+
+    def record(self):
+        """The session as a JSON-serialisable dict"""
+        return {
+            'device': self.device,
+            'ipsw': os.path.basename(self.ipsw_file) if self.ipsw_file else None,
+            'started_at': round(self.wall_start, 3),
+            'duration_seconds': round(self.duration, 6),
+            'returncode': self.returncode,
+            'outcome': 'success' if self.returncode == 0 else 'failure',
+            'retries': self.retries,
+            'errors': self.errors,
+            'bytes': sum(phase['bytes'] for phase in self.phases),
+            'phases': self.phases,
+        }
+
+
+class MetricsWriter:
+    """Append session records to restores.jsonl and keep iphone_restore.prom current
+
+    The Prometheus counters are the totals of restores.jsonl, so every
+    front-end writing the same directory exports the same numbers and they
+    survive restarts. The file is locked while a record is appended and
+    the totals are brought up to date with the lines added since the last
+    write, by this process or any other.
+    """
+
+    def __init__(self, metrics_dir=DEFAULT_METRICS_DIR):
+        self.metrics_dir = metrics_dir
+        self.jsonl_path = os.path.join(metrics_dir, "restores.jsonl")
+        self.prom_path = os.path.join(metrics_dir, "iphone_restore.prom")
+        self._lock = threading.Lock()
+        # Bytes of restores.jsonl already counted
+        self._offset = 0
+        self._reset()
+
+    def _reset(self):
+        self._restores = {}
+        self._duration_sum = 0.0
+        self._retries = 0
+        self._phase_seconds = {}
+        self._phase_count = {}
+        self._phase_bytes = {}
+        self._last_duration = None
+
+    def write(self, session):
+        """Record a finished session"""
+        record = session.record()
+        with self._lock:
+            os.makedirs(self.metrics_dir, exist_ok=True)
+            with open(self.jsonl_path, 'ab+') as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    data = (json.dumps(record) + '\n').encode()
+                    f.seek(0, os.SEEK_END)
+                    if f.tell():
+                        f.seek(-1, os.SEEK_END)
+                        if f.read(1) != b'\n':
+                            # A writer that crashed mid-line must not swallow this record
+                            data = b'\n' + data
+                    f.write(data)
+                    f.flush()
+                    self._catch_up(f)
+                    self._write_prom()
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+        return record
+
+    def _catch_up(self, f):
+        """Add the records appended since the last call to the totals"""
+        f.seek(0, os.SEEK_END)
+        if f.tell() < self._offset:
+            # Truncated or rotated: count again from the start
+            self._offset = 0
+            self._reset()
+        f.seek(self._offset)
+        for line in f:
+            if not line.endswith(b'\n'):
+                break
+            self._offset += len(line)
+            try:
+                self._add(json.loads(line))
+            except (ValueError, KeyError, TypeError):
+                continue
+
+    def _add(self, record):
+        outcome = record['outcome']
+        self._restores[outcome] = self._restores.get(outcome, 0) + 1
+        self._duration_sum += record['duration_seconds']
+        self._retries += record['retries']
+        self._last_duration = record['duration_seconds']
+        for phase in record['phases']:
+            name = phase['phase']
+            self._phase_seconds[name] = self._phase_seconds.get(name, 0.0) + (phase['seconds'] or 0.0)
+            self._phase_count[name] = self._phase_count.get(name, 0) + 1
+            self._phase_bytes[name] = self._phase_bytes.get(name, 0) + phase['bytes']
+
+    def _write_prom(self):
+        lines = [
+            "# HELP iphone_restore_total Finished restores by outcome.",
+            "# TYPE iphone_restore_total counter",
+        ]
+        lines += [f'iphone_restore_total{{outcome="{outcome}"}} {count}'
+                  for outcome, count in sorted(self._restores.items())]
+        lines += [
+            "# HELP iphone_restore_duration_seconds_sum Total time spent restoring.",
+            "# TYPE iphone_restore_duration_seconds_sum counter",
+            f"iphone_restore_duration_seconds_sum {self._duration_sum:.6f}",
+        ]
+        if self._last_duration is not None:
+            # No gauge until a complete record has been read
+            lines += [
+                "# HELP iphone_restore_last_duration_seconds Duration of the most recent restore.",
+                "# TYPE iphone_restore_last_duration_seconds gauge",
+                f"iphone_restore_last_duration_seconds {self._last_duration:.6f}",
+            ]
+        lines += [
+            "# HELP iphone_restore_retries_total Retries reported by idevicerestore.",
+            "# TYPE iphone_restore_retries_total counter",
+            f"iphone_restore_retries_total {self._retries}",
+            "# HELP iphone_restore_phase_seconds_sum Time spent per restore phase.",
+            "# TYPE iphone_restore_phase_seconds_sum counter",
+        ]
+        lines += [f'iphone_restore_phase_seconds_sum{{phase="{phase}"}} {seconds:.6f}'
+                  for phase, seconds in sorted(self._phase_seconds.items())]
+        lines += [
+            "# HELP iphone_restore_phase_count Completed restore phases.",
+            "# TYPE iphone_restore_phase_count counter",
+        ]
+        lines += [f'iphone_restore_phase_count{{phase="{phase}"}} {count}'
+                  for phase, count in sorted(self._phase_count.items())]
+        lines += [
+            "# HELP iphone_restore_phase_bytes_total Bytes sent per restore phase, where reported.",
+            "# TYPE iphone_restore_phase_bytes_total counter",
+        ]
+        lines += [f'iphone_restore_phase_bytes_total{{phase="{phase}"}} {count}'
+                  for phase, count in sorted(self._phase_bytes.items())]
+
+        # The textfile collector may read at any time, replace the file atomically
+        tmp_path = f"{self.prom_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(tmp_path, self.prom_path)
+
+
+def phase_summary(record):
+    """One-line "phase 12.3s, ..." summary of a session record"""
+    return ", ".join(f"{phase['phase']} {phase['seconds'] or 0:.1f}s" for phase in record['phases'])
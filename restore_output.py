@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Restore Output Parser
+Incremental parser for idevicerestore output, turning raw pipe bytes into
+typed line, progress, phase and error events
+"""
+
+import codecs
+import re
+
+LINE = "line"
+PROGRESS = "progress"
+PHASE_START = "phase_start"
+PHASE_END = "phase_end"
+ERROR = "error"
+
+# Restore phases in the order idevicerestore runs them, with the share of
+# the overall progress bar each one covers (start %, end %)
+PHASES = {
+    "iBSS": (0, 3),
+    "iBEC": (3, 6),
+    "ramdisk": (6, 12),
+    "kernelcache": (12, 15),
+    "NOR": (15, 20),
+    "filesystem": (20, 80),
+    "baseband": (80, 90),
+    "finalize": (90, 100),
+}
+
+PHASE_PATTERNS = [
+    (PHASE_START, "iBSS", r"Sending iBSS"),
+    (PHASE_START, "iBEC", r"Sending iBEC"),
+    (PHASE_START, "ramdisk", r"Sending (?:Restore)?Ram[Dd]isk"),
+    (PHASE_START, "kernelcache", r"Sending (?:Restore)?KernelCache"),
+    (PHASE_START, "NOR", r"About to send NORData"),
+    (PHASE_END, "NOR", r"Done sending NORData"),
+    (PHASE_START, "filesystem", r"About to send filesystem|Sending filesystem now"),
+    (PHASE_END, "filesystem", r"Done sending filesystem"),
+    (PHASE_START, "baseband", r"About to send BasebandData|Updating baseband"),
+    (PHASE_END, "baseband", r"Done sending BasebandData"),
+    (PHASE_START, "finalize", r"Flashing firmware|Verifying restore|Restoring image"),
+    (PHASE_END, "finalize", r"Status: Restore Finished|DONE$"),
+]
+
+# Phase markers are matched at the start of a line only, which keeps the
+# cost for ordinary output lines low
+BREAK_RE = re.compile(r"\r\n|\r|\n")
+PHASE_RE = re.compile('|'.join(f"(?P<p{i}>{pattern})"
+                               for i, (_, _, pattern) in enumerate(PHASE_PATTERNS)))
+PERCENT_RE = re.compile(r"(\d{1,3}(?:\.\d+)?)\s*%\s*$")
+PROGRESS_BAR_RE = re.compile(r"^\[[=\-#> ]*\]\s*\d{1,3}(?:\.\d+)?\s*%$")
+ERROR_RE = re.compile(r"^(?:ERROR|Error|error)\b")
+
+
+class RestoreEvent:
+    """One typed event parsed from idevicerestore output"""
+
+    __slots__ = ('kind', 'phase', 'percent', 'overall', 'text')
+
+    def __init__(self, kind, phase=None, percent=None, overall=None, text=None):
+        self.kind = kind
+        self.phase = phase
+        self.percent = percent
+        self.overall = overall
+        self.text = text
+
+    def __repr__(self):
+        return (f"RestoreEvent({self.kind!r}, phase={self.phase!r}, percent={self.percent!r}, "
+                f"overall={self.overall!r}, text={self.text!r})")
+
+
+def overall_percent(phase, percent):
+    """Map a percentage within a phase onto the whole restore"""
+    start, end = PHASES.get(phase, (0, 0))
+    return start + (end - start) * min(max(percent, 0.0), 100.0) / 100.0
+
+
+class RestoreOutputParser:
+    """Feed raw bytes, get RestoreEvents back
+
+    Lines ending in "\\r" and bare progress bars are in-place progress
+    updates: they produce only PROGRESS events, not LINE events.
+    """
+
+    def __init__(self, encoding='utf-8'):
+        self._decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+        self._pending = ""
+        self.phase = None
+        self.overall = 0.0
+        self.errors = []
+
+    def feed(self, data):
+        """Parse a chunk of bytes, return the events it completes"""
+        text = self._pending + self._decoder.decode(data)
+        events = []
+        start = 0
+        length = len(text)
+        for match in BREAK_RE.finditer(text):
+            end = match.start()
+            if match.group() == '\r':
+                if end + 1 == length:
+                    # Wait for the next chunk to tell "\r\n" from an in-place update
+                    break
+                self._update(text[start:end], events)
+            else:
+                self._line(text[start:end], events)
+            start = match.end()
+        self._pending = text[start:]
+        return events
+
+    def close(self):
+        """Flush the decoder and any unterminated last line"""
+        text = self._pending + self._decoder.decode(b'', final=True)
+        self._pending = ""
+        events = []
+        text = text.rstrip('\r')
+        if text:
+            self._line(text, events)
+        return events
+
+    def _update(self, text, events):
+        match = PERCENT_RE.search(text)
+        if match:
+            self._progress(float(match.group(1)), events)
+
+    def _progress(self, percent, events):
+        overall = overall_percent(self.phase, percent) if self.phase else self.overall
+        self.overall = max(self.overall, overall)
+        events.append(RestoreEvent(PROGRESS, self.phase, percent, self.overall))
+
+    def _line(self, text, events):
+        text = text.strip()
+        if not text:
+            return
+        if PROGRESS_BAR_RE.match(text):
+            # Final redraw of an in-place progress bar
+            self._update(text, events)
+            return
+        # Phase events come first so a marker line belongs to the phase it starts
+        line = RestoreEvent(LINE, self.phase, text=text)
+
+        match = PHASE_RE.match(text)
+        if match:
+            kind, phase, _ = PHASE_PATTERNS[int(match.lastgroup[1:])]
+            if kind == PHASE_START and phase != self.phase:
+                if self.phase:
+                    events.append(RestoreEvent(PHASE_END, self.phase, overall=self.overall,
+                                               text=text))
+                self.phase = line.phase = phase
+                self.overall = max(self.overall, PHASES[phase][0])
+                events.append(RestoreEvent(PHASE_START, phase, overall=self.overall, text=text))
+            elif kind == PHASE_END and phase in (self.phase, "finalize"):
+                # The end-of-restore markers also close whatever phase is running
+                self.overall = max(self.overall, PHASES[phase][1])
+                if self.phase:
+                    events.append(RestoreEvent(PHASE_END, self.phase, overall=self.overall,
+                                               text=text))
+                self.phase = None
+            events.append(line)
+        elif ERROR_RE.match(text):
+            self.errors.append(text)
+            events.append(line)
+            events.append(RestoreEvent(ERROR, self.phase, text=text))
+        else:
+            events.append(line)
+            if text.endswith('%'):
+                self._update(text, events)
+
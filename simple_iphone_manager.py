@@ -4,56 +4,168 @@ Simple iPhone Firmware Manager (Command Line)
 A simple command-line interface for iPhone firmware management
 """
 
-import subprocess
+import argparse
+import json
 import sys
 import os
 import time
 from pathlib import Path
 
+from device_info import get_product_type
+from firmware_cache import FirmwareCache
+from inventory_daemon import connect_watcher, is_shared
+from ipsw_catalog import IPSWCatalog, library_dirs
+from ipsw_fetch import CONNECTIONS, IPSWFetcher, resolve_url
+from ipsw_verify import IPSWVerifier, VerifyCache, read_sha256_file
+from job_journal import JobJournal, SUCCEEDED
+from log_store import LogStore
+from preflight import Preflight
+import restore_engine
+from restore_batch import device_selector, load_jobs, run_batch, run_jobs
+from restore_engine import RestoreEngine
+from restore_metrics import MetricsWriter, phase_summary
+from restore_output import LINE, PROGRESS, PHASE_START
+from toolchain import Toolchain
+from usb_detector import MODE_NORMAL
+from usb_topology import TopologyScheduler
+from usb_watcher import HotplugWatcher, ATTACH, MODE_CHANGE
+
+
 class SimpleiPhoneManager:
-    def __init__(self):
+    def __init__(self, inventory=True, toolchain=None):
         self.device_connected = False
         self.device_mode = "Unknown"
+        # Device discovery is shared with other front-ends through the inventory daemon
+        self.watcher = connect_watcher() if inventory else HotplugWatcher()
+        self.catalog = IPSWCatalog()
+        self.verifier = IPSWVerifier(cache=VerifyCache())
+        self.metrics = MetricsWriter()
+        self.firmware_cache = FirmwareCache()
+        self.journal = JobJournal()
+        # Raw output of every session, compressed and indexed for later searches
+        self.log_store = LogStore(catalog=self.catalog)
+        # Caps concurrent firmware transfers per USB hub and controller
+        self.scheduler = TopologyScheduler()
+        # Tool paths and capabilities, probed once per installed binary
+        self.toolchain = toolchain or Toolchain()
+        # Device/firmware compatibility, manifests parsed once per file by the catalog
+        self.preflight = Preflight(self.catalog,
+                                   self.toolchain.path('ideviceinfo') or 'ideviceinfo',
+                                   self.toolchain.path('irecovery') or 'irecovery')
+        self.product_types = {}
+        self.progress_line = False
+        self.engine = RestoreEngine(on_update=self.print_engine_update,
+                                    on_event=self.print_engine_event,
+                                    on_message=lambda text: print(f"📦 {text}"),
+                                    metrics=self.metrics, firmware_cache=self.firmware_cache,
+                                    scheduler=self.scheduler, log_store=self.log_store,
+                                    toolchain=self.toolchain)
         
     def check_device_status(self):
         """Check if iPhone is connected and its mode"""
         try:
-            result = subprocess.run(['lsusb'], capture_output=True, text=True, timeout=10)
-            apple_devices = [line for line in result.stdout.split('\n') if 'Apple' in line and 'Mobile Device' in line]
-            
-            if apple_devices:
-                self.device_connected = True
-                if 'Recovery Mode' in apple_devices[0]:
-                    self.device_mode = "Recovery Mode"
-                    print("📱 iPhone Status: Connected (Recovery Mode)")
-                else:
-                    self.device_mode = "Normal"
-                    print("📱 iPhone Status: Connected (Normal Mode)")
-            else:
-                self.device_connected = False
-                self.device_mode = "Not Connected"
-                print("📱 iPhone Status: Not Connected")
+            self.show_device_status(self.watcher.refresh())
                 
         except Exception as e:
             print(f"❌ Error checking device: {str(e)}")
             self.device_connected = False
             
-    def list_ipsw_files(self, directory="~/Downloads"):
-        """List available IPSW files"""
-        downloads_path = os.path.expanduser(directory)
-        ipsw_files = list(Path(downloads_path).glob("*.ipsw"))
-        
-        if ipsw_files:
-            print(f"\n📁 Found {len(ipsw_files)} IPSW file(s) in {downloads_path}:")
-            for i, file in enumerate(ipsw_files, 1):
-                size_mb = file.stat().st_size / (1024 * 1024)
-                print(f"  {i}. {file.name} ({size_mb:.1f} MB)")
-            return ipsw_files
+    def show_device_status(self, devices):
+        """Print the status of a list of detected devices"""
+        if devices:
+            self.device_connected = True
+            self.device_mode = devices[0].mode
+            mode = "Normal Mode" if self.device_mode == MODE_NORMAL else self.device_mode
+            print(f"📱 iPhone Status: Connected ({mode})")
+            if len(devices) > 1:
+                print(f"   {len(devices)} devices attached")
+            for device in devices:
+                # Only devices from the inventory daemon know their job
+                job = getattr(device, 'job', None)
+                if job:
+                    print(f"   {device.identifier}: job #{job['id']} {job['state']} "
+                          f"(attempt {job['attempts']}/{job['max_attempts']}, {job['ipsw']})")
+        else:
+            self.device_connected = False
+            self.device_mode = "Not Connected"
+            print("📱 iPhone Status: Not Connected")
+            
+    def on_device_event(self, event):
+        """Print hotplug events as they happen"""
+        device = event.device
+        if event.kind == MODE_CHANGE:
+            print(f"\n🔌 {device.identifier}: {event.previous_mode} → {device.mode}")
+        elif event.kind == ATTACH:
+            print(f"\n🔌 iPhone attached: {device.mode} ({device.identifier})")
         else:
-            print(f"\n❌ No IPSW files found in {downloads_path}")
-            return []
+            print(f"\n🔌 iPhone detached ({device.identifier})")
+            
+    def connected_product_type(self):
+        """ProductType of the first connected normal-mode device, or None"""
+        devices = self.watcher.devices
+        if not devices or not devices[0].udid:
+            return None
+        udid = devices[0].udid
+        if udid not in self.product_types:
+            self.product_types[udid] = get_product_type(udid, self.toolchain.path('ideviceinfo')
+                                                        or 'ideviceinfo')
+        return self.product_types[udid]
+        
+    def list_ipsw_files(self, directory=None):
+        """List available IPSW files"""
+        directories = [directory] if directory else library_dirs()
+        product_type = self.connected_product_type()
+        ipsw_files = []
+        
+        for directory in directories:
+            downloads_path = os.path.expanduser(directory)
+            entries = self.catalog.scan(downloads_path)
+            
+            if entries:
+                print(f"\n📁 Found {len(entries)} IPSW file(s) in {downloads_path}:")
+                for entry in entries:
+                    ipsw_files.append(Path(entry.path))
+                    size_mb = entry.size / (1024 * 1024)
+                    mark = " ✅" if product_type and entry.supports(product_type) else ""
+                    print(f"  {len(ipsw_files)}. {entry.name} ({size_mb:.1f} MB) "
+                          f"- {entry.description}{mark}")
+            else:
+                print(f"\n❌ No IPSW files found in {downloads_path}")
+                
+        if product_type and ipsw_files:
+            compatible = self.catalog.compatible(product_type)
+            print(f"\n✅ = compatible with {product_type} ({len(compatible)} catalogued)")
+        return ipsw_files
             
-    def restore_iphone(self, ipsw_file, erase=True, exclude_baseband=True, debug=True):
+    def verify_firmware(self, ipsw_file, sha256=None):
+        """Pre-flight integrity check of an IPSW"""
+        print(f"\n🔍 Verifying {os.path.basename(ipsw_file)}...")
+        result = self.verifier.verify(ipsw_file, sha256 or read_sha256_file(ipsw_file))
+        if result.ok:
+            print(f"✅ IPSW {result.summary}")
+        else:
+            print(f"❌ IPSW {result.summary}")
+        return result.ok
+        
+    def preflight_devices(self, ipsw_file, devices):
+        """Check an IPSW against devices in parallel, return the devices it can restore"""
+        compatible = []
+        for result in self.preflight.check_many((ipsw_file, device) for device in devices):
+            if result.ok:
+                compatible.append(result.device)
+            else:
+                print(f"❌ {result.device.identifier}: {result.summary}")
+        if compatible:
+            print(f"✅ {os.path.basename(ipsw_file)} fits {len(compatible)} of {len(devices)} "
+                  f"device(s)")
+        return compatible
+        
+    def check_compatibility(self, ipsw_file, device):
+        """preflight() for run_jobs: why the IPSW cannot restore the device, or None"""
+        result = self.preflight.check(ipsw_file, device)
+        return None if result.ok else result.error
+        
+    def restore_iphone(self, ipsw_file, erase=True, exclude_baseband=True, debug=True, sha256=None):
         """Restore iPhone with given options"""
         if not self.device_connected:
             print("❌ No iPhone detected. Please connect your device.")
@@ -63,46 +175,256 @@ class SimpleiPhoneManager:
             print(f"❌ IPSW file not found: {ipsw_file}")
             return False
             
+        # Seconds to rule out the wrong firmware, before the whole file is verified
+        devices = self.watcher.devices[:1]
+        if devices and not self.preflight_devices(ipsw_file, devices):
+            return False
+            
+        if not self.verify_firmware(ipsw_file, sha256):
+            return False
+            
         print(f"\n🔄 Starting restore with {os.path.basename(ipsw_file)}...")
         print("⚠️  This will erase all data on your iPhone!")
-        
-        # Build command
-        cmd = ['idevicerestore']
-        if erase:
-            cmd.append('-e')
-        if exclude_baseband:
-            cmd.append('-x')
-        if debug:
-            cmd.append('-d')
-        cmd.append(ipsw_file)
-        
-        print(f"Command: {' '.join(cmd)}")
+        print("📦 Preparing firmware components...")
         
         try:
-            # Run restore
-            process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, 
-                                     text=True, bufsize=1, universal_newlines=True)
-            
-            print("\n📋 Restore Output:")
-            print("-" * 50)
+            devices = self.watcher.devices
+            job_id = self.journal.enqueue(
+                device_selector(devices[0]) if devices else 'any', ipsw_file,
+                {'erase': erase, 'exclude_baseband': exclude_baseband, 'debug': debug}, sha256)
+            [(job, restore)] = self.run_jobs([job_id])
+            self.end_progress_line()
             
-            for line in iter(process.stdout.readline, ''):
-                if line:
-                    print(line.strip())
-                    
-            process.wait()
+            if restore and restore.session:
+                record = restore.session.record()
+                print(f"\n⏱  Restore took {restore.duration:.0f}s ({phase_summary(record)})")
             
-            if process.returncode == 0:
+            if job.state == SUCCEEDED:
                 print("\n✅ Restore completed successfully!")
                 return True
             else:
-                print(f"\n❌ Restore failed with exit code: {process.returncode}")
+                print(f"\n❌ Restore failed after {job.attempts} attempt(s): "
+                      f"{job.last_error or f'exit code {job.returncode}'}")
                 return False
                 
+        except KeyboardInterrupt:
+            self.end_progress_line()
+            print("\n⏹ Restore cancelled")
+            return False
+            
         except Exception as e:
             print(f"\n❌ Error during restore: {str(e)}")
             return False
             
+    def check_firmware(self, ipsw_file, sha256=None):
+        """verify() for run_jobs: an error message, or None if the IPSW is intact"""
+        result = self.verifier.verify(ipsw_file, sha256 or read_sha256_file(ipsw_file))
+        return None if result.ok else f"IPSW {result.summary}"
+        
+    def fetch_ipsw(self, url, sha256=None, connections=CONNECTIONS):
+        """Download an IPSW from the mirror into the library, return True on success"""
+        fetcher = IPSWFetcher(connections, catalog=self.catalog, verifier=self.verifier)
+        
+        def show_progress(done, total):
+            if total:
+                print(f"\r⬇️  {done / (1024 * 1024):.0f}/{total / (1024 * 1024):.0f} MB "
+                      f"({100.0 * done / total:.1f}%)", end="", flush=True)
+                
+        url = resolve_url(url)
+        print(f"🌐 Downloading {url}...")
+        try:
+            result = fetcher.fetch(url, sha256=sha256, on_progress=show_progress)
+        except KeyboardInterrupt:
+            fetcher.cancel()
+            print("\n⏹️  Download interrupted, run again to resume")
+            return False
+        print()
+        if result.ok:
+            print(f"✅ {result.path} {result.summary}")
+        else:
+            print(f"❌ {os.path.basename(result.path)}: {result.summary}")
+        return result.ok
+        
+    def list_sessions(self, limit=100, days=None, **filters):
+        """Print indexed restore sessions, newest first; filters as for LogStore.sessions()"""
+        since = time.time() - days * 86400 if days else None
+        sessions = self.log_store.sessions(since=since, limit=limit, **filters)
+        for session in sessions:
+            print(session.summary)
+            for phase, text in self.log_store.errors(session.id)[-3:]:
+                print(f"    [{phase or '-'}] {text}")
+        print(f"{len(sessions)} session(s)")
+        
+    def show_log(self, session_id):
+        """Print the raw output of one session, return True if it was found"""
+        try:
+            for line in self.log_store.lines(session_id):
+                print(line)
+        except FileNotFoundError as e:
+            print(f"❌ {str(e)}")
+            return False
+        return True
+        
+    def print_retry(self, job, error, out=sys.stdout):
+        delay = max(0, job.next_attempt_at - time.time())
+        print(f"🔁 {job.device}: attempt {job.attempts}/{job.max_attempts} failed ({error}), "
+              f"retrying in {delay:.0f}s", file=out, flush=True)
+        
+    def run_jobs(self, job_ids, max_concurrent=4):
+        """Run journal jobs to the end, return [(job, restore)] in the order they finished"""
+        results = []
+        restore_engine.run(run_jobs(
+            self.engine, self.journal, job_ids, self.watcher.refresh, self.check_firmware,
+            lambda job, device, restore, error: results.append((job, restore)),
+            max_concurrent, on_retry=self.print_retry, preflight=self.check_compatibility))
+        return results
+        
+    def print_engine_update(self, restore):
+        """Print status changes of multi-device restores"""
+        if restore.device:
+            print(f"[{self.restore_label(restore)}] {restore.status}")
+            
+    def print_engine_event(self, restore, event):
+        """Prefix lines of multi-device restores, single restores get the progress line"""
+        if self.engine.active <= 1:
+            self.print_restore_event(event)
+        elif event.kind == LINE:
+            print(f"[{self.restore_label(restore)}] {event.text}")
+            
+    @staticmethod
+    def restore_label(restore):
+        """Short device label; recovery and DFU restores have an ECID but no UDID"""
+        return str(restore.udid or restore.device)[:8]
+            
+    def print_restore_event(self, event):
+        """Print output lines and phases, redraw a single progress line in place"""
+        if event.kind == PROGRESS:
+            bar = "=" * int(event.overall / 5)
+            print(f"\r[{bar:<20}] {event.overall:5.1f}% {event.phase or ''}", end="", flush=True)
+            self.progress_line = True
+        elif event.kind == LINE:
+            self.end_progress_line()
+            print(event.text)
+        elif event.kind == PHASE_START:
+            self.end_progress_line()
+            print(f"▶ Phase: {event.phase}")
+            
+    def end_progress_line(self):
+        if self.progress_line:
+            print()
+            self.progress_line = False
+            
+    def restore_all_devices(self, ipsw_file, erase=True, exclude_baseband=True, debug=False,
+                            max_concurrent=4):
+        """Restore every attached device in parallel"""
+        if not os.path.exists(ipsw_file):
+            print(f"❌ IPSW file not found: {ipsw_file}")
+            return False
+            
+        devices = self.watcher.refresh()
+        if not devices:
+            print("❌ No devices found for restore.")
+            return False
+            
+        devices = self.preflight_devices(ipsw_file, devices)
+        if not devices or not self.verify_firmware(ipsw_file):
+            return False
+            
+        max_concurrent = max(1, int(max_concurrent))
+        print(f"\n🔄 Restoring {len(devices)} device(s) with {os.path.basename(ipsw_file)}, "
+              f"{max_concurrent} at a time...")
+        print("⚠️  This will erase all data on every connected iPhone!")
+        print("📦 Preparing firmware components...")
+        
+        options = {'erase': erase, 'exclude_baseband': exclude_baseband, 'debug': debug}
+        job_ids = self.journal.enqueue_many([(device_selector(device), ipsw_file, options,
+                                              None, None, None) for device in devices])
+        return self.run_and_report(job_ids, max_concurrent)
+        
+    def run_and_report(self, job_ids, max_concurrent=4):
+        """Run journal jobs and print one result line per job"""
+        try:
+            results = self.run_jobs(job_ids, max_concurrent)
+        except KeyboardInterrupt:
+            print("\n⏹ Restores cancelled")
+            return False
+            
+        print("\n📋 Results:")
+        print("-" * 50)
+        for job, restore in results:
+            mark = "✅" if job.state == SUCCEEDED else "❌"
+            duration = f", {restore.duration:.0f}s" if restore else ""
+            print(f"{mark} {job.device}: {job.state} after {job.attempts} attempt(s) "
+                  f"(exit code {job.returncode}{duration})")
+            
+        failed = sum(1 for job, _ in results if job.state != SUCCEEDED)
+        print(f"\n{len(results) - failed} succeeded, {failed} failed")
+        return failed == 0
+        
+    def resume_jobs(self):
+        """Offer to resume restore jobs left behind by a manager that exited or crashed"""
+        recovered = self.journal.recover()
+        if not recovered:
+            return
+            
+        print(f"\n♻️  {len(recovered)} restore job(s) did not finish last time:")
+        for job in self.journal.jobs(ids=recovered):
+            print(f"  {job.device}: {os.path.basename(job.ipsw)} "
+                  f"({job.state}, attempt {job.attempts}/{job.max_attempts})")
+        if input("Resume them now? (y/n): ").strip().lower() == 'y':
+            self.run_and_report(recovered)
+        else:
+            for job_id in recovered:
+                self.journal.cancel(job_id)
+            print("Jobs cancelled")
+            
+    def run_batch(self, jobs_file, max_concurrent=None):
+        """Run a jobs file without prompting: JSON lines on stdout, progress on stderr
+        
+        Returns the exit code: 0 if every job succeeded, 1 if any failed or
+        the batch stopped on an error, 2 if the jobs file is invalid and 130
+        when interrupted.
+        """
+        try:
+            jobs, file_concurrency = load_jobs(jobs_file)
+        except ValueError as e:
+            print(f"❌ {e}", file=sys.stderr)
+            return 2
+            
+        engine = RestoreEngine(
+            on_update=lambda restore: print(f"[{restore.device}] {restore.status}",
+                                            file=sys.stderr, flush=True),
+            on_message=lambda text: print(f"📦 {text}", file=sys.stderr),
+            metrics=self.metrics, firmware_cache=self.firmware_cache, scheduler=self.scheduler,
+            log_store=self.log_store, toolchain=self.toolchain)
+        
+        results = []
+        
+        def on_result(result):
+            results.append(result)
+            print(json.dumps(result), flush=True)
+            
+        print(f"Running {len(jobs)} job(s) on {len(self.watcher.refresh())} attached device(s)",
+              file=sys.stderr)
+        try:
+            failures = restore_engine.run(run_batch(
+                engine, self.journal, jobs, self.watcher.refresh, self.check_firmware, on_result,
+                max_concurrent or file_concurrency or 4,
+                on_retry=lambda job, error: self.print_retry(job, error, sys.stderr),
+                preflight=self.check_compatibility))
+        except KeyboardInterrupt:
+            print("⏹ Batch cancelled", file=sys.stderr)
+            return 130
+        except Exception as e:
+            failed = sum(1 for result in results if not result['succeeded'])
+            print(f"❌ Batch stopped: {str(e)}", file=sys.stderr)
+            print(f"{len(results) - failed} succeeded, {failed} failed before the error",
+                  file=sys.stderr)
+            return 1
+            
+        print(f"{len(results) - failures} succeeded, {failures} failed", file=sys.stderr)
+        return 1 if failures else 0
+        
     def force_restart_instructions(self):
         """Show force restart instructions"""
         print("\n🔄 Force Restart Instructions:")
@@ -113,22 +435,35 @@ class SimpleiPhoneManager:
         
     def main_menu(self):
         """Main menu interface"""
+        # Devices present at startup are reported by the first redraw
+        self.watcher.refresh()
+        self.watcher.subscribe(self.on_device_event)
+        watching = self.watcher.start()
+        if watching and is_shared(self.watcher):
+            print("🔗 Device list shared through the inventory daemon")
+        self.resume_jobs()
+        
         while True:
             print("\n" + "="*60)
             print("📱 iPhone Firmware Manager")
             print("="*60)
             
-            self.check_device_status()
+            # With hotplug events the device list is always current
+            if watching:
+                self.show_device_status(self.watcher.devices)
+            else:
+                self.check_device_status()
             
             print("\nOptions:")
             print("1. List available IPSW files")
             print("2. Restore iPhone (Full erase)")
             print("3. Restore iPhone (Keep data)")
-            print("4. Show force restart instructions")
-            print("5. Refresh device status")
-            print("6. Exit")
+            print("4. Restore all connected devices (Full erase)")
+            print("5. Show force restart instructions")
+            print("6. Refresh device status")
+            print("7. Exit")
             
-            choice = input("\nEnter your choice (1-6): ").strip()
+            choice = input("\nEnter your choice (1-7): ").strip()
             
             if choice == '1':
                 self.list_ipsw_files()
@@ -158,12 +493,24 @@ class SimpleiPhoneManager:
                         print("❌ Please enter a valid number")
                         
             elif choice == '4':
+                ipsw_files = self.list_ipsw_files()
+                if ipsw_files:
+                    try:
+                        file_num = int(input(f"\nSelect file (1-{len(ipsw_files)}): ")) - 1
+                        if 0 <= file_num < len(ipsw_files):
+                            self.restore_all_devices(str(ipsw_files[file_num]), erase=True)
+                        else:
+                            print("❌ Invalid selection")
+                    except ValueError:
+                        print("❌ Please enter a valid number")
+                        
+            elif choice == '5':
                 self.force_restart_instructions()
                 
-            elif choice == '5':
+            elif choice == '6':
                 self.check_device_status()
                 
-            elif choice == '6':
+            elif choice == '7':
                 print("👋 Goodbye!")
                 break
                 
@@ -171,18 +518,67 @@ class SimpleiPhoneManager:
                 print("❌ Invalid choice. Please try again.")
 
 def main():
-    print("🚀 Starting Simple iPhone Firmware Manager...")
+    parser = argparse.ArgumentParser(description="Simple iPhone Firmware Manager")
+    parser.add_argument('--batch', metavar='JOBS_JSON',
+                        help="run the restores in a jobs file without prompting, "
+                             "one JSON result line per job on stdout")
+    parser.add_argument('--max-concurrent', type=int,
+                        help="parallel restores in batch mode (default: jobs file, else 4)")
+    parser.add_argument('--status', action='store_true',
+                        help="print the status of the attached devices and exit")
+    parser.add_argument('--fetch', metavar='URL_OR_NAME',
+                        help="download an IPSW from a URL, or by file name from "
+                             "$IPHONE_MANAGER_IPSW_MIRROR, resuming a partial download")
+    parser.add_argument('--sha256', help="expected digest of the --fetch download")
+    parser.add_argument('--connections', type=int, default=CONNECTIONS,
+                        help=f"parallel connections for --fetch (default: {CONNECTIONS})")
+    logs = parser.add_argument_group("restore logs")
+    logs.add_argument('--logs', action='store_true',
+                      help="list logged restore sessions, newest first, and exit")
+    logs.add_argument('--device', help="only sessions of this UDID/ECID")
+    logs.add_argument('--outcome', choices=('success', 'failure', 'cancelled', 'interrupted'))
+    logs.add_argument('--phase', help="only sessions that ended in this phase, e.g. baseband")
+    logs.add_argument('--days', type=float, help="only sessions of the last DAYS days")
+    logs.add_argument('--error', help="only sessions with an error line containing this text")
+    logs.add_argument('--show-log', type=int, metavar='SESSION',
+                      help="print the raw output of a logged session and exit")
+    args = parser.parse_args()
+    
+    # Downloading and log searches need no device tools
+    if args.logs:
+        SimpleiPhoneManager(inventory=False).list_sessions(days=args.days, device=args.device,
+                                                           outcome=args.outcome, phase=args.phase,
+                                                           error=args.error)
+        sys.exit(0)
+    if args.show_log is not None:
+        sys.exit(0 if SimpleiPhoneManager(inventory=False).show_log(args.show_log) else 1)
+    if args.fetch:
+        try:
+            ok = SimpleiPhoneManager(inventory=False).fetch_ipsw(args.fetch, args.sha256,
+                                                                 args.connections)
+        except ValueError as e:
+            print(f"❌ {str(e)}")
+            ok = False
+        sys.exit(0 if ok else 1)
+    
+    # In batch mode stdout carries only JSON lines
+    out = sys.stderr if args.batch else sys.stdout
+    print("🚀 Starting Simple iPhone Firmware Manager...", file=out)
     
-    # Check if required tools are installed
-    try:
-        subprocess.run(['which', 'idevicerestore'], check=True, capture_output=True)
-        subprocess.run(['which', 'lsusb'], check=True, capture_output=True)
-    except subprocess.CalledProcessError:
-        print("❌ Error: Required tools not found.")
-        print("Please install: sudo apt install libimobiledevice-utils usbutils")
-        sys.exit(1)
+    # Check if required tools are installed, from the cache unless they changed
+    toolchain = Toolchain()
+    if toolchain.missing():
+        print("❌ Error: Required tools not found.", file=out)
+        print("Please install: sudo apt install libimobiledevice-utils", file=out)
+        sys.exit(2 if args.batch else 1)
+    print(f"🔧 {toolchain.tool('idevicerestore').description}", file=out)
     
-    manager = SimpleiPhoneManager()
+    manager = SimpleiPhoneManager(toolchain=toolchain)
+    if args.status:
+        manager.check_device_status()
+        sys.exit(0)
+    if args.batch:
+        sys.exit(manager.run_batch(args.batch, args.max_concurrent))
     manager.main_menu()
 
 if __name__ == "__main__":
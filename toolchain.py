@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Toolchain
+Finds the libimobiledevice tools in-process and probes the version and
+options of each binary once; results are cached on disk per binary path,
+size and mtime, so a launch with unchanged tools forks nothing
+"""
+
+import json
+import os
+import re
+import shutil
+import subprocess
+import threading
+
+DEFAULT_CACHE_PATH = os.path.expanduser("~/.cache/iphone_firmware_manager/toolchain.json")
+
+REQUIRED_TOOLS = ("idevicerestore",)
+
+PROBE_TIMEOUT = 5
+
+# Option lines of a usage text: "  -e, --erase   ..." or "  --ipsw-info   ..."
+OPTION_RE = re.compile(r"^\s{1,8}(-[A-Za-z0-9])?(?:,\s*)?(--[A-Za-z0-9][\w-]*)?", re.MULTILINE)
+VERSION_RE = re.compile(r"\b(\d+\.\d+(?:\.\d+)?(?:-[\w.]+)?)")
+
+
+class Tool:
+    """A resolved binary with the version and options it reported"""
+
+    def __init__(self, name, path, version=None, options=(), size=0, mtime_ns=0):
+        self.name = name
+        self.path = path
+        self.version = version
+        self.options = set(options)
+        self.size = size
+        self.mtime_ns = mtime_ns
+
+    def supports(self, option, default=False):
+        """True if the usage text lists option; default if the tool printed no usage"""
+        if not self.options:
+            return default
+        return option in self.options
+
+    @property
+    def description(self):
+        return f"{self.name} {self.version or '(unknown version)'} at {self.path}"
+
+    def record(self):
+        return {'name': self.name, 'version': self.version, 'options': sorted(self.options),
+                'size': self.size, 'mtime_ns': self.mtime_ns}
+
+    def __repr__(self):
+        return f"Tool({self.name!r}, {self.path!r}, {self.version!r})"
+
+
+def parse_usage(text):
+    """The set of short and long options in a usage text"""
+    options = set()
+    for short, long in OPTION_RE.findall(text):
+        options.update(option for option in (short, long) if option)
+    return options
+
+
+def _run(cmd):
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True, errors='replace',
+                                stdin=subprocess.DEVNULL, timeout=PROBE_TIMEOUT)
+    except (OSError, subprocess.TimeoutExpired):
+        return ""
+    return result.stdout + result.stderr
+
+
+def probe(name, path):
+    """Run path --help (and --version if listed) and return a Tool"""
+    st = os.stat(path)
+    options = parse_usage(_run([path, '--help']))
+    version = None
+    if '--version' in options:
+        match = VERSION_RE.search(_run([path, '--version']))
+        version = match.group(1) if match else None
+    return Tool(name, path, version, options, st.st_size, st.st_mtime_ns)
+
+
+class Toolchain:
+    """Resolve and probe device tools, cached in memory and on disk
+
+    search_path defaults to $PATH at the time of the lookup.
+    """
+
+    def __init__(self, cache_path=DEFAULT_CACHE_PATH, search_path=None):
+        self.cache_path = cache_path
+        self.search_path = search_path
+        self.probes = 0
+        self._tools = {}
+        self._cache = None
+        self._lock = threading.Lock()
+
+    def path(self, name):
+        """Absolute path of a tool (name or path), or None"""
+        found = shutil.which(name, path=self.search_path)
+        return os.path.abspath(found) if found else None
+
+    def tool(self, name):
+        """Tool for a name or path, probing the binary only if it is new or changed; or None"""
+        with self._lock:
+            if name in self._tools:
+                return self._tools[name]
+            path = self.path(name)
+            tool = self._lookup(os.path.basename(name), path) if path else None
+            self._tools[name] = tool
+            return tool
+
+    def missing(self, names=REQUIRED_TOOLS):
+        """Names of the tools that are not installed"""
+        return [name for name in names if self.path(name) is None]
+
+    def _lookup(self, name, path):
+        if self._cache is None:
+            self._cache = self._load()
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        entry = self._cache.get(path)
+        if entry and entry['size'] == st.st_size and entry['mtime_ns'] == st.st_mtime_ns:
+            return Tool(name, path, entry['version'], entry['options'], entry['size'],
+                        entry['mtime_ns'])
+        tool = probe(name, path)
+        self.probes += 1
+        self._cache[path] = tool.record()
+        self._save()
+        return tool
+
+    def _load(self):
+        try:
+            with open(self.cache_path) as f:
+                cache = json.load(f)
+            return cache if isinstance(cache, dict) else {}
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self):
+        # Another front-end may be reading it, replace the file atomically
+        try:
+            os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+            tmp_path = f"{self.cache_path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(self._cache, f, indent=1, sort_keys=True)
+            os.replace(tmp_path, self.cache_path)
+        except OSError:
+            pass
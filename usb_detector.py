@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+USB Detector
+Finds Apple mobile devices by reading /sys/bus/usb/devices directly
+"""
+
+import os
+
+SYSFS_USB_DEVICES = "/sys/bus/usb/devices"
+
+APPLE_VENDOR_ID = 0x05ac
+
+# Product ID ranges (inclusive) of Apple mobile devices per mode
+DFU_PRODUCT_IDS = range(0x1220, 0x1228)
+RECOVERY_PRODUCT_IDS = range(0x1280, 0x1284)
+NORMAL_PRODUCT_IDS = range(0x1290, 0x12b0)
+
+MODE_NORMAL = "Normal"
+MODE_RECOVERY = "Recovery Mode"
+MODE_DFU = "DFU Mode"
+
+
+def device_mode(product_id):
+    """Return the device mode for an Apple product ID, or None if it is not a mobile device"""
+    if product_id in NORMAL_PRODUCT_IDS:
+        return MODE_NORMAL
+    if product_id in RECOVERY_PRODUCT_IDS:
+        return MODE_RECOVERY
+    if product_id in DFU_PRODUCT_IDS:
+        return MODE_DFU
+    return None
+
+
+def parse_serial(serial):
+    """Parse an iBoot serial string ("CPID:8020 ... ECID:...") into a dict"""
+    fields = {}
+    for token in serial.split():
+        key, sep, value = token.partition(':')
+        if sep:
+            fields[key] = value
+    return fields
+
+
+class USBDevice:
+    """An Apple mobile device attached to a USB port"""
+
+    def __init__(self, port, busnum, devnum, product_id, serial=""):
+        self.port = port
+        self.busnum = busnum
+        self.devnum = devnum
+        self.product_id = product_id
+        self.serial = serial
+        self.mode = device_mode(product_id)
+
+        # In recovery and DFU mode the serial is a list of iBoot fields,
+        # in normal mode it is the UDID (without the dash on newer devices)
+        fields = parse_serial(serial) if self.mode != MODE_NORMAL else {}
+        self.ecid = fields.get('ECID')
+        self.cpid = fields.get('CPID')
+        self.bdid = fields.get('BDID')
+        self.udid = None
+        if self.mode == MODE_NORMAL and serial:
+            if len(serial) == 24:
+                self.udid = f"{serial[:8]}-{serial[8:]}"
+            else:
+                self.udid = serial
+
+    @property
+    def identifier(self):
+        """UDID in normal mode, ECID in recovery/DFU mode, else the port"""
+        return self.udid or self.ecid or self.port
+
+    def __repr__(self):
+        return f"USBDevice({self.port!r}, {self.mode!r}, {self.identifier!r})"
+
+
+class USBDetector:
+    """Scan sysfs for Apple mobile devices, caching what was read per bus/port"""
+
+    def __init__(self, sysfs_root=SYSFS_USB_DEVICES):
+        self.sysfs_root = sysfs_root
+        # port -> (devnum, USBDevice or None for non-Apple devices)
+        self._cache = {}
+
+    def scan(self):
+        """Return all attached Apple mobile devices, ordered by port"""
+        cache = {}
+        devices = []
+        with os.scandir(self.sysfs_root) as entries:
+            for entry in entries:
+                port = entry.name
+                # Skip root hubs ("usb1") and interfaces ("1-1:1.0")
+                if ':' in port or not port[:1].isdigit():
+                    continue
+
+                devnum = self._read(entry.path, 'devnum')
+                if devnum is None:
+                    continue
+
+                cached = self._cache.get(port)
+                if cached is not None and cached[0] == devnum:
+                    device = cached[1]
+                else:
+                    # New or re-enumerated device (e.g. after a mode change)
+                    device = self._read_device(entry.path, port, devnum)
+                cache[port] = (devnum, device)
+
+                if device is not None:
+                    devices.append(device)
+
+        self._cache = cache
+        devices.sort(key=lambda device: device.port)
+        return devices
+
+    def _read_device(self, path, port, devnum):
+        vendor = self._read(path, 'idVendor')
+        if vendor is None or int(vendor, 16) != APPLE_VENDOR_ID:
+            return None
+
+        product_id = int(self._read(path, 'idProduct') or '0', 16)
+        if device_mode(product_id) is None:
+            return None
+
+        busnum = self._read(path, 'busnum')
+        return USBDevice(port, int(busnum) if busnum else None, int(devnum), product_id,
+                         self._read(path, 'serial') or "")
+
+    @staticmethod
+    def _read(path, attribute):
+        try:
+            with open(os.path.join(path, attribute)) as f:
+                return f.read().strip()
+        except OSError:
+            return None
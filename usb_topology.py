@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+USB Topology
+Hub and host-controller tree of USB ports from sysfs, and an asyncio
+scheduler that caps concurrent transfer-heavy restore phases per hub and
+per controller
+
+Ports are sysfs names: "1-4.2.3" is port 3 of the hub on port 2 of the hub
+on port 4 of root hub usb1. Phones sharing a hub or a controller share its
+bandwidth; too many filesystem transfers at once end in USB timeouts.
+"""
+
+import asyncio
+import itertools
+import os
+
+from usb_detector import SYSFS_USB_DEVICES, USBDetector
+
+# 0 means no limit
+DEFAULT_PER_HUB = int(os.environ.get("IPHONE_MANAGER_USB_PER_HUB", "2"))
+DEFAULT_PER_CONTROLLER = int(os.environ.get("IPHONE_MANAGER_USB_PER_CONTROLLER", "4"))
+
+# Phases that move firmware over USB; the slot is held until the last ends
+TRANSFER_PHASES = ("iBSS", "iBEC", "ramdisk", "kernelcache", "NOR", "filesystem")
+
+
+def parent_hub(port):
+    """sysfs name of the hub a port hangs off: "1-4.2" for "1-4.2.3", "usb1" for "1-4" """
+    bus, _, path = port.partition('-')
+    if '.' in path:
+        return f"{bus}-{path.rsplit('.', 1)[0]}"
+    return f"usb{bus}"
+
+
+class UsbTopology:
+    """Resolve the hub and host controller of a port, cached per bus"""
+
+    def __init__(self, sysfs_root=SYSFS_USB_DEVICES):
+        self.sysfs_root = sysfs_root
+        self.detector = USBDetector(sysfs_root)
+        self._controllers = {}
+
+    def hub(self, port):
+        return parent_hub(port)
+
+    def controller(self, port):
+        """The host controller of a port
+
+        A USB 3 controller has two root hubs (usb1 for USB 2, usb2 for
+        USB 3) that share it; both resolve to the controller's PCI device.
+        """
+        bus = f"usb{port.partition('-')[0]}"
+        if bus not in self._controllers:
+            path = os.path.realpath(os.path.join(self.sysfs_root, bus))
+            parent = os.path.basename(os.path.dirname(path))
+            # In a flat tree (no /sys/devices behind it) every bus is its own controller
+            self._controllers[bus] = parent if parent and parent != os.path.basename(
+                os.path.normpath(self.sysfs_root)) else bus
+        return self._controllers[bus]
+
+    def locate(self, identifier):
+        """Port of the attached device with this UDID or ECID, or None"""
+        if not identifier:
+            return None
+        for device in self.detector.scan():
+            if identifier.lower() in ((device.udid or "").lower(), (device.ecid or "").lower()):
+                return device.port
+        return None
+
+
+class TransferSlot:
+    """A granted share of a hub and controller; release() is idempotent"""
+
+    def __init__(self, scheduler, port, hub, controller):
+        self.scheduler = scheduler
+        self.port = port
+        self.hub = hub
+        self.controller = controller
+        self.released = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.scheduler._release(self)
+
+
+class TopologyScheduler:
+    """Grant transfer slots so no hub or controller runs more than its limit
+
+    Waiting restores are granted in order of how idle their controller is,
+    so work spreads across controllers instead of piling onto the first.
+    Call acquire() and release() on the event loop.
+    """
+
+    def __init__(self, topology=None, per_hub=DEFAULT_PER_HUB,
+                 per_controller=DEFAULT_PER_CONTROLLER):
+        self.topology = topology or UsbTopology()
+        self.per_hub = per_hub
+        self.per_controller = per_controller
+        self.hubs = {}
+        self.controllers = {}
+        self._waiting = []
+        self._order = itertools.count()
+
+    def _fits(self, hub, controller, hubs=0, controllers=0):
+        return ((not self.per_hub or self.hubs.get(hub, 0) + hubs < self.per_hub) and
+                (not self.per_controller or
+                 self.controllers.get(controller, 0) + controllers < self.per_controller))
+
+    def _grant(self, hub, controller):
+        self.hubs[hub] = self.hubs.get(hub, 0) + 1
+        self.controllers[controller] = self.controllers.get(controller, 0) + 1
+
+    def would_wait(self, port, pending=()):
+        """True if acquire(port) would block, counting slots pending ports are about to take"""
+        if port is None:
+            return False
+        hub, controller = self.topology.hub(port), self.topology.controller(port)
+        return not self._fits(hub, controller,
+                              sum(1 for other in pending if self.topology.hub(other) == hub),
+                              sum(1 for other in pending
+                                  if self.topology.controller(other) == controller))
+
+    async def acquire(self, port):
+        """Wait for a slot on the hub and controller of port; None ports are not limited"""
+        if port is None:
+            return TransferSlot(self, None, None, None)
+        hub, controller = self.topology.hub(port), self.topology.controller(port)
+        if self._fits(hub, controller):
+            self._grant(hub, controller)
+            return TransferSlot(self, port, hub, controller)
+
+        future = asyncio.get_running_loop().create_future()
+        entry = (next(self._order), port, hub, controller, future)
+        self._waiting.append(entry)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if entry in self._waiting:
+                self._waiting.remove(entry)
+            elif not future.cancelled():
+                # Granted and cancelled in the same iteration: hand the slot on
+                future.result().release()
+            raise
+        return future.result()
+
+    def _release(self, slot):
+        if slot.port is None:
+            return
+        self.hubs[slot.hub] -= 1
+        self.controllers[slot.controller] -= 1
+        self._wake()
+
+    def _wake(self):
+        while True:
+            ready = [e for e in self._waiting if not e[4].done() and self._fits(e[2], e[3])]
+            if not ready:
+                return
+            # The idlest controller goes first, arrival order breaks ties
+            entry = min(ready, key=lambda e: (self.controllers.get(e[3], 0), e[0]))
+            _, port, hub, controller, future = entry
+            self._waiting.remove(entry)
+            self._grant(hub, controller)
+            future.set_result(TransferSlot(self, port, hub, controller))
+
+    @property
+    def waiting(self):
+        return len(self._waiting)
@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+"""
+USB Hotplug Watcher
+Pushes attach, detach and mode-change events for Apple mobile devices
+"""
+
+import ctypes
+import ctypes.util
+import os
+import select
+import socket
+import struct
+import threading
+import time
+
+from usb_detector import USBDetector
+
+NETLINK_KOBJECT_UEVENT = 15
+DEV_BUS_USB = "/dev/bus/usb"
+
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_ISDIR = 0x40000000
+INOTIFY_EVENT = struct.Struct('iIII')
+
+ATTACH = "attach"
+DETACH = "detach"
+MODE_CHANGE = "mode_change"
+
+
+class NetlinkEventSource:
+    """Kernel uevents from a NETLINK_KOBJECT_UEVENT socket"""
+
+    def __init__(self):
+        self.sock = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_KOBJECT_UEVENT)
+        self.sock.bind((0, 1))
+        self.sock.setblocking(False)
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def read(self):
+        """Drain pending uevents, return True if a USB device was added, removed or changed"""
+        relevant = False
+        while True:
+            try:
+                data = self.sock.recv(65536)
+            except BlockingIOError:
+                return relevant
+            fields = dict(item.partition('=')[::2]
+                          for item in data.decode('utf-8', 'replace').split('\0')[1:] if item)
+            if fields.get('SUBSYSTEM') == 'usb' and fields.get('DEVTYPE') == 'usb_device':
+                relevant = True
+
+    def close(self):
+        self.sock.close()
+
+
+class InotifyEventSource:
+    """Device node creation and removal under /dev/bus/usb, through inotify"""
+
+    def __init__(self, root=DEV_BUS_USB):
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        if not hasattr(libc, 'inotify_init1'):
+            raise OSError("inotify is not available")
+        self._libc = libc
+        self.root = root
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+        # One watch on the root for new buses, one per bus for device nodes
+        self._watch(root)
+        for name in os.listdir(root):
+            self._watch(os.path.join(root, name))
+
+    def _watch(self, path):
+        if self._libc.inotify_add_watch(self.fd, os.fsencode(path), IN_CREATE | IN_DELETE) < 0:
+            raise OSError(ctypes.get_errno(), f"Cannot watch {path}")
+
+    def fileno(self):
+        return self.fd
+
+    def read(self):
+        """Drain pending inotify events, return True if anything changed"""
+        relevant = False
+        while True:
+            try:
+                data = os.read(self.fd, 4096)
+            except BlockingIOError:
+                return relevant
+            offset = 0
+            while offset < len(data):
+                _wd, mask, _cookie, length = INOTIFY_EVENT.unpack_from(data, offset)
+                offset += INOTIFY_EVENT.size
+                name = data[offset:offset + length].rstrip(b'\0')
+                offset += length
+                if mask & IN_ISDIR and mask & IN_CREATE:
+                    self._watch(os.path.join(self.root, os.fsdecode(name)))
+                relevant = True
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PipeEventSource:
+    """Manually triggered event source, used for tests and forced refreshes"""
+
+    def __init__(self):
+        self._r, self._w = os.pipe()
+        os.set_blocking(self._r, False)
+
+    def fileno(self):
+        return self._r
+
+    def trigger(self):
+        os.write(self._w, b'\0')
+
+    def read(self):
+        try:
+            return bool(os.read(self._r, 4096))
+        except BlockingIOError:
+            return False
+
+    def close(self):
+        os.close(self._r)
+        os.close(self._w)
+
+
+def default_event_source():
+    """Return a netlink source, else an inotify source, else None"""
+    try:
+        return NetlinkEventSource()
+    except (OSError, AttributeError):
+        pass
+    try:
+        return InotifyEventSource()
+    except OSError:
+        return None
+
+
+class DeviceEvent:
+    """Attach, detach or mode change of the device on one USB port"""
+
+    def __init__(self, kind, device, previous_mode=None):
+        self.kind = kind
+        self.device = device
+        self.previous_mode = previous_mode
+        self.timestamp = time.monotonic()
+
+    def __repr__(self):
+        return f"DeviceEvent({self.kind!r}, {self.device!r}, previous_mode={self.previous_mode!r})"
+
+
+class HotplugWatcher:
+    """Long-lived watcher that rescans on USB events and notifies subscribers
+
+    Subscribers are called on the watcher thread (or the thread calling
+    refresh()) and must hand off to their own thread before touching UI.
+    """
+
+    def __init__(self, detector=None, source=None, reconnect_window=60.0):
+        self.detector = detector or USBDetector()
+        self.source = source
+        # A device that re-attaches on the same port within this many
+        # seconds with a different mode is reported as a mode change
+        self.reconnect_window = reconnect_window
+        self.devices = []
+        self._by_port = {}
+        self._detached = {}
+        self._subscribers = []
+        self._lock = threading.RLock()
+        self._thread = None
+        self._stop_r, self._stop_w = os.pipe()
+
+    def subscribe(self, callback):
+        """Call callback(event) for every DeviceEvent"""
+        self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        if callback in self._subscribers:
+            self._subscribers.remove(callback)
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """Start watching, return False if no event source is available"""
+        if self.source is None:
+            self.source = default_event_source()
+        self.refresh()
+        if self.source is None:
+            return False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return True
+
+    def stop(self):
+        if self.running:
+            os.write(self._stop_w, b'\0')
+            self._thread.join()
+
+    def refresh(self):
+        """Rescan now, dispatch events for any changes and return the devices"""
+        with self._lock:
+            devices = self.detector.scan()
+            events = self._diff(devices)
+            self.devices = devices
+            for event in events:
+                for callback in list(self._subscribers):
+                    callback(event)
+            return devices
+
+    def _run(self):
+        # Blocks in select() until the kernel reports a change, no polling
+        while True:
+            ready, _, _ = select.select([self.source, self._stop_r], [], [])
+            if self._stop_r in ready:
+                break
+            if self.source.read():
+                try:
+                    self.refresh()
+                except OSError:
+                    pass
+
+    def _diff(self, devices):
+        now = time.monotonic()
+        current = {device.port: device for device in devices}
+        events = []
+
+        for port, old in self._by_port.items():
+            new = current.get(port)
+            if new is None:
+                self._detached[port] = (old.mode, now)
+                events.append(DeviceEvent(DETACH, old))
+            elif new.devnum != old.devnum:
+                if new.mode != old.mode:
+                    events.append(DeviceEvent(MODE_CHANGE, new, old.mode))
+                else:
+                    events.append(DeviceEvent(DETACH, old))
+                    events.append(DeviceEvent(ATTACH, new))
+
+        for port, new in current.items():
+            if port in self._by_port:
+                continue
+            detached = self._detached.pop(port, None)
+            if (detached and now - detached[1] <= self.reconnect_window
+                    and detached[0] != new.mode):
+                events.append(DeviceEvent(MODE_CHANGE, new, detached[0]))
+            else:
+                events.append(DeviceEvent(ATTACH, new))
+
+        self._detached = {port: entry for port, entry in self._detached.items()
+                          if now - entry[1] <= self.reconnect_window}
+        self._by_port = current
+        return events